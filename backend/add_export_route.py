@@ -0,0 +1,59 @@
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+
+from managers.db_manager import registry
+from managers.query_manager import query_manager
+from utils.export import EXPORT_FORMATS, QueryExport
+from utils.logger import log_other
+
+
+def add_export_route(app: FastAPI, path: str):
+    async def export_query(query_id: str, request: Request, format: str = "csv"):
+        query = query_manager.get(query_id)
+        if query is None:
+            raise HTTPException(status_code=404, detail="Unknown or expired query")
+
+        try:
+            export = QueryExport(
+                registry.resolve(query["database"]), query["sql"], format
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+        async def body():
+            chunks = export.chunks()
+            try:
+                while True:
+                    if await request.is_disconnected():
+                        log_other(f"Client disconnected, cancelling export of {query_id}")
+                        break
+                    try:
+                        chunk = await run_in_threadpool(next, chunks, None)
+                    except ValueError as e:
+                        # the headers are sent, aborting the response tells the client it is incomplete
+                        log_other(f"Export of {query_id} failed: {e}")
+                        raise
+                    if chunk is None:
+                        break
+                    if chunk:
+                        yield chunk
+            finally:
+                # interrupts the statement if the stream is abandoned mid-way
+                export.cancel()
+                try:
+                    chunks.close()
+                except ValueError:
+                    # still running in the worker thread, the interrupt makes it stop
+                    pass
+
+        media_type, extension = EXPORT_FORMATS[format]
+        return StreamingResponse(
+            body(),
+            media_type=media_type,
+            headers={
+                "Content-Disposition": f'attachment; filename="{query_id}.{extension}"'
+            },
+        )
+
+    app.add_api_route(path + "/{query_id}", export_query, methods=["GET"])
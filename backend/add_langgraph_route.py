@@ -1,3 +1,9 @@
+import asyncio
+import json
+import os
+import uuid
+from contextlib import nullcontext
+
 from langchain_core.messages import (
     HumanMessage,
     AIMessage,
@@ -6,10 +12,22 @@ from langchain_core.messages import (
     BaseMessage,
 )
 from langgraph.graph import StateGraph
-from fastapi import FastAPI
-from pydantic import BaseModel
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel, ValidationError
 from typing import List, Literal, Union, Optional, Any
 
+from managers.example_manager import example_manager
+from managers.prompt_manager import PROMPT_MODE_COOKIE, prompt_manager
+from managers.query_manager import query_manager
+from managers.result_manager import result_manager
+from utils.admission import AdmissionRejected, admission
+from utils.cancellation import CancelScope, current_scope
+from utils.logger import log_other
+from utils.metrics import metrics
+from utils.profiling import profile_request, profiler
+from utils.tracing import start_trace
+
 
 class LanguageModelTextPart(BaseModel):
     type: Literal["text"]
@@ -138,23 +156,233 @@ class ChatRequest(BaseModel):
     system: Optional[str] = ""
     tools: Optional[List[FrontendToolCall]] = []
     messages: List[LanguageModelV1Message]
+    # "business" or "technical", falls back to the session cookie then to the default mode
+    promptMode: Optional[str] = None
+
+
+# -------------------------- Request decoding --------------------------
+
+
+# bounds of a chat request, checked before the history is parsed
+MAX_CHAT_BODY_BYTES = int(os.getenv("CHAT_MAX_BODY_BYTES", str(4 * 1024 * 1024)))
+MAX_CHAT_MESSAGES = int(os.getenv("CHAT_MAX_MESSAGES", "500"))
+# bodies larger than that are parsed off the event loop
+THREADED_DECODE_BYTES = 256 * 1024
+
+
+class ChatRequestError(Exception):
+    """Raised when a chat request body is rejected; carries the HTTP status"""
+
+    def __init__(self, status_code: int, message: str):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+async def read_body(http_request: Request, limit: int) -> bytes:
+    """Read the request body as it arrives, giving up as soon as it exceeds `limit` bytes"""
+    declared = http_request.headers.get("content-length", "")
+    if declared.isdigit() and int(declared) > limit:
+        raise ChatRequestError(413, f"The request body exceeds {limit} bytes")
+    body = bytearray()
+    async for chunk in http_request.stream():
+        body += chunk
+        if len(body) > limit:
+            raise ChatRequestError(413, f"The request body exceeds {limit} bytes")
+    return bytes(body)
+
+
+def _decode_text_messages(messages: list):
+    """LangChain messages of a text-only history, or None when it holds anything else.
+
+    Builds the same messages as `convert_to_langchain_messages` without validating the
+    message models, which dominates the cost of the common case.
+    """
+    result = []
+    for message in messages:
+        if not isinstance(message, dict):
+            return None
+        role, content = message.get("role"), message.get("content")
+        if role == "system" and isinstance(content, str):
+            result.append(SystemMessage(content=content))
+            continue
+        if role not in ("user", "assistant") or not isinstance(content, list):
+            return None
+        texts = []
+        for part in content:
+            if not isinstance(part, dict) or part.get("type") != "text" or not isinstance(part.get("text"), str):
+                return None
+            texts.append(part["text"])
+        if role == "user":
+            result.append(HumanMessage(content=[{"type": "text", "text": t} for t in texts]))
+        else:
+            result.append(AIMessage(content=" ".join(texts), tool_calls=[]))
+    return result
+
+
+def decode_chat_request(body: bytes):
+    """Return (ChatRequest, LangChain messages) of a request body.
+
+    Text-only histories take a fast path; tool calls, images and files go through the full
+    models. Raises ChatRequestError.
+    """
+    try:
+        data = json.loads(body)
+    except ValueError:
+        raise ChatRequestError(400, "The request body is not valid JSON")
+    if not isinstance(data, dict):
+        raise ChatRequestError(400, "The request body must be a JSON object")
+    messages = data.get("messages")
+    if isinstance(messages, list) and len(messages) > MAX_CHAT_MESSAGES:
+        raise ChatRequestError(413, f"The conversation exceeds {MAX_CHAT_MESSAGES} messages")
+
+    system, prompt_mode = data.get("system", ""), data.get("promptMode")
+    if (
+        isinstance(messages, list)
+        and not data.get("tools")
+        and isinstance(system, (str, type(None)))
+        and isinstance(prompt_mode, (str, type(None)))
+    ):
+        inputs = _decode_text_messages(messages)
+        if inputs is not None:
+            metrics.inc("chat_requests_decoded_total", path="fast")
+            # the raw messages are kept unvalidated, only their conversion is used
+            request = ChatRequest.model_construct(
+                system=system, tools=[], messages=messages, promptMode=prompt_mode
+            )
+            return request, inputs
+
+    metrics.inc("chat_requests_decoded_total", path="full")
+    try:
+        request = ChatRequest.model_validate(data)
+    except ValidationError as e:
+        raise ChatRequestError(422, f"Invalid chat request: {e.errors(include_url=False)}")
+    return request, convert_to_langchain_messages(request.messages)
+
+
+# how often a running request checks whether its client is still connected
+DISCONNECT_POLL_SECONDS = 0.5
+
+
+async def run_until_disconnected(coroutine, http_request: Request, scope: CancelScope):
+    """Await `coroutine`, cancelling it as soon as the client disconnects.
+
+    Returns None when the run was cancelled.
+    """
+    task = asyncio.create_task(coroutine)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_SECONDS)
+            if done:
+                return task.result()
+            if await http_request.is_disconnected():
+                log_other("Client disconnected, cancelling the graph run")
+                break
+    except asyncio.CancelledError:
+        scope.cancel()
+        task.cancel()
+        raise
+
+    # abort SQL in flight, pending LLM calls and every remaining node
+    scope.cancel()
+    task.cancel()
+    try:
+        await task
+    except (asyncio.CancelledError, Exception):
+        pass
+    metrics.inc("chat_runs_cancelled_total")
+    return None
+
+
+def _is_series(query_id: str) -> bool:
+    handle = result_manager.get(query_id)
+    return handle is not None and handle.series is not None
+
+
+# addresses of the reverse proxies allowed to vouch for the caller, e.g. "10.0.0.5,10.0.0.6";
+# their X-User-ID (set from an authenticated identity) and X-Forwarded-For headers are trusted
+TRUSTED_PROXIES = {a.strip() for a in os.getenv("TRUSTED_PROXIES", "").split(",") if a.strip()}
+
+
+def client_id(http_request: Request) -> str:
+    """Identity used to share the queue fairly: the client address, unless a trusted proxy names the caller"""
+    address = http_request.client.host if http_request.client else "anonymous"
+    if address not in TRUSTED_PROXIES:
+        # any client can send these headers, trusting them would let it dodge the per-user cap
+        return address
+    user = http_request.headers.get("x-user-id")
+    if user:
+        return user
+    # the last hop not added by one of our proxies is the one they saw connecting
+    forwarded = [a.strip() for a in http_request.headers.get("x-forwarded-for", "").split(",") if a.strip()]
+    for hop in reversed(forwarded):
+        if hop not in TRUSTED_PROXIES:
+            return hop
+    return address
 
 
 def add_langgraph_route(app: FastAPI, graph: StateGraph, path: str):
-    async def chat_completions(request: ChatRequest):
-        inputs = convert_to_langchain_messages(request.messages)
+    async def chat_completions(http_request: Request, response: Response):
+        try:
+            body = await read_body(http_request, MAX_CHAT_BODY_BYTES)
+            if len(body) > THREADED_DECODE_BYTES:
+                request, inputs = await asyncio.to_thread(decode_chat_request, body)
+            else:
+                request, inputs = decode_chat_request(body)
+        except ChatRequestError as e:
+            metrics.inc("chat_requests_rejected_total", status=str(e.status_code))
+            return JSONResponse({"type": "error", "content": str(e)}, status_code=e.status_code)
+        metrics.inc("chat_runs_total")
+
+        # the request ID identifies the trace of this run, see `python -m utils.tracing`
+        request_id = http_request.headers.get("x-request-id") or uuid.uuid4().hex
+        response.headers["X-Request-ID"] = request_id
+
+        # the task running the graph inherits the scope and the trace through its context
+        scope = CancelScope()
+        token = current_scope.set(scope)
+
+        prompt_mode = prompt_manager.resolve(
+            request.promptMode, http_request.cookies.get(PROMPT_MODE_COOKIE)
+        )
+        trace_attributes = {"chat.messages": len(inputs), "chat.prompt_mode": prompt_mode}
+
+        # the profile is fetched afterwards by request ID, see `/api/profiles`
+        profiled = profiler.should_profile(http_request.headers)
+        if profiled:
+            response.headers["X-Profiled"] = "1"
+
+        try:
+            with start_trace(request_id, f"POST {path}", **trace_attributes), (
+                profile_request(request_id) if profiled else nullcontext()
+            ):
+                return await _run_chat(
+                    request, inputs, prompt_mode, http_request, scope, request_id
+                )
+        finally:
+            current_scope.reset(token)
+
+    async def _run_chat(request, inputs, prompt_mode, http_request, scope, request_id):
+        config = {
+            "configurable": {
+                "system": request.system,
+                "frontend_tools": request.tools,
+                "prompt_mode": prompt_mode,
+            }
+        }
+
+        async def admitted_run():
+            # queued runs wait here, a client leaving the queue gives up its place
+            async with admission.admit(client_id(http_request)):
+                return await graph.ainvoke({"messages": inputs}, config)
 
         try:
+            # the user's new message confirms or corrects the previous answer
+            await asyncio.to_thread(example_manager.review, inputs)
+
             # Run the graph and get the final response
-            final_result = await graph.ainvoke(
-                {"messages": inputs},
-                {
-                    "configurable": {
-                        "system": request.system,
-                        "frontend_tools": request.tools,
-                    }
-                },
-            )
+            final_result = await run_until_disconnected(admitted_run(), http_request, scope)
+            if final_result is None:
+                return {"type": "error", "content": "Request cancelled", "requestId": request_id}
 
             # Extract the final response from the graph result
             final_response = ""
@@ -169,12 +397,52 @@ def add_langgraph_route(app: FastAPI, graph: StateGraph, path: str):
 
             if not final_response:
                 final_response = "No response was generated. Please try again."
+            else:
+                await asyncio.to_thread(
+                    example_manager.record,
+                    final_result["messages"],
+                    len(inputs),
+                    final_response,
+                    final_result.get("grader_sql_sense", ""),
+                )
 
-            # Return simple JSON response instead of streaming
-            return {"type": "text", "content": final_response}
+            # Queries executed during this run, their full results can be exported by ID
+            # and time series fetched downsampled for a chart
+            queries = [
+                {
+                    "id": tool_call["id"],
+                    "sql": tool_call["args"].get("sql_statement", ""),
+                    "series": _is_series(tool_call["id"]),
+                }
+                for message in final_result.get("messages", [])
+                if isinstance(message, AIMessage)
+                for tool_call in message.tool_calls
+                if tool_call["name"] == "ExecuteQuery"
+                and query_manager.get(tool_call["id"]) is not None
+            ]
 
+            # Return simple JSON response instead of streaming
+            return {
+                "type": "text",
+                "content": final_response,
+                "queries": queries,
+                "requestId": request_id,
+            }
+
+        except AdmissionRejected as e:
+            return JSONResponse(
+                {
+                    "type": "error",
+                    "content": "The server is busy, please retry shortly.",
+                    "reason": e.reason,
+                    "requestId": request_id,
+                },
+                status_code=e.status_code,
+                headers={"Retry-After": str(e.retry_after), "X-Request-ID": request_id},
+            )
         except Exception as e:
-            return {"type": "error", "content": f"Error: {str(e)}"}
+            metrics.inc("chat_runs_failed_total")
+            return {"type": "error", "content": f"Error: {str(e)}", "requestId": request_id}
 
     async def chat_options():
         return {"message": "OK"}
@@ -0,0 +1,32 @@
+from fastapi import FastAPI, HTTPException
+from starlette.concurrency import run_in_threadpool
+
+from managers.result_manager import result_manager
+from utils.timeseries import DEFAULT_SERIES_POINTS
+
+
+def add_results_route(app: FastAPI, path: str):
+    async def get_result_page(query_id: str, offset: int = 0, limit: int = 100):
+        # pages of large results are read from the database, keep that off the event loop
+        try:
+            page = await run_in_threadpool(result_manager.page, query_id, offset, limit)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        if page is None:
+            raise HTTPException(status_code=404, detail="Unknown or expired result")
+        return page
+
+    async def get_result_series(
+        query_id: str, points: int = DEFAULT_SERIES_POINTS, method: str = "lttb"
+    ):
+        # only the downsampled points are sent, the chart never needs the full series
+        try:
+            series = await run_in_threadpool(result_manager.series, query_id, points, method)
+        except (ValueError, TypeError) as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        if series is None:
+            raise HTTPException(status_code=404, detail="Unknown or expired result")
+        return series
+
+    app.add_api_route(path + "/{query_id}", get_result_page, methods=["GET"])
+    app.add_api_route(path + "/{query_id}/series", get_result_series, methods=["GET"])
@@ -1,5 +1,4 @@
-from datetime import datetime
-import os
+import operator
 from typing import Annotated, List, NotRequired, TypedDict
 
 from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage
@@ -9,14 +8,30 @@ from langgraph.graph import StateGraph, START, END
 from langgraph.graph.message import add_messages
 
 from graders.grader import get_sql_sense_grader
-from managers.llm_manager import llm
+from managers.example_manager import example_manager, message_text
+from managers.llm_manager import get_llm
+from managers.model_router import (
+    FAST,
+    MODELS,
+    STRONG,
+    choose_tier,
+    needs_escalation,
+    token_usage,
+)
+from managers.prompt_manager import prompt_manager
+from managers.summary_manager import summary_manager
 from tools.db_tools import (
+    describe_tables,
     execute_query,
     get_sample_rows,
     get_unique_column_values,
     list_tables_tool,
+    search_values,
 )
+from utils.cancellation import check_cancelled
 from utils.logger import log_llm_decision, log_llm_response, log_other, log_tool_call
+from utils.metrics import metrics
+from utils.tracing import span, traced
 
 
 # -------------------------- Tools --------------------------
@@ -24,12 +39,21 @@ from utils.logger import log_llm_decision, log_llm_response, log_other, log_tool
 
 tools = [
     list_tables_tool,
+    describe_tables,
     get_sample_rows,
     get_unique_column_values,
+    search_values,
     execute_query,
 ]
 tools_by_name = {tool.name: tool for tool in tools}
-llm_with_tools = llm.bind_tools(tools)
+_llm_with_tools = {}
+
+
+def get_llm_with_tools(tier: str):
+    """Model of the given tier bound to the tools, built on first use"""
+    if tier not in _llm_with_tools:
+        _llm_with_tools[tier] = get_llm(MODELS[tier], temperature=0).bind_tools(tools)
+    return _llm_with_tools[tier]
 
 
 # -------------------------- Type definitions --------------------------
@@ -45,6 +69,9 @@ class AgentState(TypedDict):
     retry_count: NotRequired[int]
     grading_feedback: NotRequired[str]
     query_ready_for_grading: NotRequired[bool]
+    model_routing: Annotated[List[dict], operator.add]
+    model_usage: NotRequired[dict]
+    few_shot_examples: NotRequired[str]
 
 
 # -------------------------- Grading --------------------------
@@ -64,7 +91,7 @@ def grade_results(state: AgentState, config: RunnableConfig) -> AgentState:
     retry_count = state.get("retry_count", 0)
 
     if not user_question or not query_result:
-        return state
+        return {}
 
     log_other(f"Starting grading - Current retry count: {retry_count}")
 
@@ -90,6 +117,9 @@ def grade_results(state: AgentState, config: RunnableConfig) -> AgentState:
         # ),
     ]
 
+    # Only the updated keys are returned, the graph merges them into the state
+    updates = {}
+
     # Execute graders in order, stop at first failure
     for name, grader, args in graders:
         with get_openai_callback() as cb:
@@ -99,16 +129,16 @@ def grade_results(state: AgentState, config: RunnableConfig) -> AgentState:
 
             # If grader fails, provide feedback
             if grade_result == "no":
-                state[name] = grade_result
+                updates[name] = grade_result
 
                 if retry_count >= 3:
                     # Max retries reached, clear feedback and allow final response
                     log_other(
                         f"Max retries ({retry_count}) reached, allowing final response"
                     )
-                    state["grading_feedback"] = ""
-                    state["query_ready_for_grading"] = False
-                    return state
+                    updates["grading_feedback"] = ""
+                    updates["query_ready_for_grading"] = False
+                    return updates
                 else:
                     feedback = GRADER_FEEDBACK_PROMPTS.get(
                         name, "Please reconsider your approach and try again."
@@ -120,7 +150,7 @@ def grade_results(state: AgentState, config: RunnableConfig) -> AgentState:
 
                     # Return updated state with feedback for retry
                     return {
-                        **state,
+                        **updates,
                         name: grade_result,
                         "grading_feedback": feedback,
                         "retry_count": new_retry_count,
@@ -128,12 +158,12 @@ def grade_results(state: AgentState, config: RunnableConfig) -> AgentState:
                     }
 
             # If grader passes, store result and continue
-            state[name] = grade_result
+            updates[name] = grade_result
 
     # All graders passed, clear any previous feedback
     log_other("All graders passed, clearing feedback")
     return {
-        **state,
+        **updates,
         "grading_feedback": "",
         "query_ready_for_grading": False,
     }
@@ -142,18 +172,25 @@ def grade_results(state: AgentState, config: RunnableConfig) -> AgentState:
 # -------------------------- Workflow --------------------------
 
 
-def call_llm_node(state: AgentState, config: RunnableConfig) -> AgentState:
+@traced("node call_llm")
+async def call_llm_node(state: AgentState, config: RunnableConfig) -> AgentState:
     """LLM decides whether to call a tool or not"""
     # check if we have grading feedback to provide
     grading_feedback = state.get("grading_feedback", "")
 
-    # get the active prompt and set it as the system message
-    PROMPTS_DIR = os.path.join(os.path.dirname(__file__), "./system_prompts")
-    with open(f"{PROMPTS_DIR}/active.txt", encoding="utf-8") as f:
-        prompt_name = f.read()
-    with open(f"{PROMPTS_DIR}/{prompt_name}.md", encoding="utf-8") as f:
-        template = f.read()
-    system_content = template.format(today=datetime.now().strftime("%Y-%m-%d"))
+    # the prompt mode of this request, resolved from the templates held in memory
+    prompt_mode = config.get("configurable", {}).get("prompt_mode")
+    system_content = prompt_manager.render(prompt_mode)
+
+    # let the LLM know which aggregates are already materialized
+    summaries = summary_manager.describe()
+    if summaries:
+        system_content += f"\n\n{summaries}"
+
+    # past questions like this one, with the query that answered them
+    examples = state.get("few_shot_examples", "")
+    if examples:
+        system_content += f"\n\n{examples}"
 
     # add grading feedback if present
     if grading_feedback:
@@ -161,8 +198,21 @@ def call_llm_node(state: AgentState, config: RunnableConfig) -> AgentState:
 
     messages = [SystemMessage(content=system_content)] + state["messages"]
 
-    with get_openai_callback() as cb:
-        result = llm_with_tools.invoke(messages)
+    # route the turn to the fast or the strong model
+    routing = []
+    usage = {model: dict(tokens) for model, tokens in state.get("model_usage", {}).items()}
+    tier, reason = choose_tier(state)
+
+    result = await _invoke_model(tier, messages, usage)
+
+    # the fast model only explores, its final SQL or answer is redone by the strong model
+    if tier == FAST and needs_escalation(result):
+        routing.append({"tier": tier, "model": MODELS[tier], "reason": reason, "escalated": True})
+        tier, reason = STRONG, "escalated_draft"
+        result = await _invoke_model(tier, messages, usage)
+
+    routing.append({"tier": tier, "model": MODELS[tier], "reason": reason, "escalated": False})
+    log_llm_decision("MODEL_ROUTING", f"{MODELS[tier]} ({tier}, {reason})")
 
     # log LLM response details
     if hasattr(result, "tool_calls") and getattr(result, "tool_calls", None):
@@ -176,18 +226,45 @@ def call_llm_node(state: AgentState, config: RunnableConfig) -> AgentState:
     else:
         log_llm_response(result.content)
 
+    # only the new message is returned, add_messages appends it to the history
     return {
-        **state,
-        "messages": state["messages"] + [result],
+        "messages": [result],
+        "model_routing": routing,
+        "model_usage": usage,
     }
 
 
+async def _invoke_model(tier: str, messages, usage: dict):
+    """Call the model of the given tier, recording its span and token usage"""
+    model = MODELS[tier]
+    with span("llm", **{"llm.model": model, "llm.tier": tier}) as llm_span:
+        # async so that cancelling the run aborts the pending HTTP request
+        with get_openai_callback() as cb:
+            result = await get_llm_with_tools(tier).ainvoke(messages)
+        tokens = _record_model_usage(usage, model, result)
+        if llm_span is not None:
+            llm_span.set(**{f"llm.{kind}": count for kind, count in tokens.items()})
+    return result
+
+
+def _record_model_usage(usage: dict, model: str, result) -> dict:
+    """Accumulate the tokens used per model, in the state and in the metrics"""
+    tokens = token_usage(result)
+    totals = usage.setdefault(model, {"input_tokens": 0, "output_tokens": 0, "calls": 0})
+    totals["calls"] += 1
+    for kind, count in tokens.items():
+        totals[kind] += count
+        metrics.inc("llm_tokens_total", count, model=model, kind=kind)
+    return tokens
+
+
+@traced("node call_tools")
 def call_tools_node(state: AgentState, config: RunnableConfig) -> AgentState:
     """Execute tool calls from the LLM response"""
     last_message = state["messages"][-1]
 
     if not hasattr(last_message, "tool_calls") or not last_message.tool_calls:
-        return state
+        return {}
 
     tool_results = []
     executed_query = state.get("executed_query", "")
@@ -195,35 +272,43 @@ def call_tools_node(state: AgentState, config: RunnableConfig) -> AgentState:
     query_ready_for_grading = False
 
     for tool_call in last_message.tool_calls:
+        # skip the remaining tools once the client is gone
+        check_cancelled()
         tool_name = tool_call["name"]
         tool = tools_by_name[tool_name]
-        result = tool.invoke(tool_call)
+        tool_attributes = {"tool.name": tool_name, "tool.args": str(tool_call.get("args", {}))}
+        with span(f"tool {tool_name}", **tool_attributes):
+            result = tool.invoke(tool_call)
         tool_results.append(result)
 
         # CRITICAL: Set flag when ExecuteQuery is called
         if tool_call["name"] == "ExecuteQuery":
             args = tool_call.get("args", {})
-            executed_query = args.get("query", "")
+            executed_query = args.get("sql_statement", "")
             query_result = str(result)
             query_ready_for_grading = True
 
     return {
-        **state,
-        "messages": state["messages"] + tool_results,
+        "messages": tool_results,
         "executed_query": executed_query,
         "query_result": query_result,
         "query_ready_for_grading": query_ready_for_grading,
     }
 
 
+@traced("node extract_question")
 def extract_user_question_node(state: AgentState, config: RunnableConfig) -> AgentState:
-    """Extract and store the user question from the first message"""
+    """Extract and store the user question from the first message, and retrieve similar past questions"""
     messages = state["messages"]
     user_question = ""
     if messages and isinstance(messages[0], HumanMessage):
         user_question = messages[0].content
 
-    return {"user_question": user_question}
+    # the examples are looked up once per run, for the question being asked now
+    humans = [m for m in messages if isinstance(m, HumanMessage)]
+    examples = example_manager.describe(message_text(humans[-1])) if humans else ""
+
+    return {"user_question": user_question, "few_shot_examples": examples}
 
 
 def should_continue_tools(state: AgentState) -> str:
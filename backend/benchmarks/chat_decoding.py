@@ -0,0 +1,64 @@
+"""Parse and convert cost of chat request bodies, full Pydantic models versus the text-only fast path.
+
+Run from the backend folder:
+    python benchmarks/chat_decoding.py --sizes 2 20 200
+"""
+
+import argparse
+import json
+import os
+import sys
+import timeit
+
+# the backend modules are imported from the backend folder, wherever the script is run from
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from add_langgraph_route import ChatRequest, convert_to_langchain_messages, decode_chat_request
+
+
+ANSWER = (
+    "Paris has the highest average price per square meter at 10,512 EUR, followed by Nice "
+    "(5,930 EUR) and Lyon (5,120 EUR). Prices rose 4.2% over the last year. "
+)
+
+
+def build_body(size: int) -> bytes:
+    """Body of a conversation of `size` messages, as the frontend sends it"""
+    messages = []
+    for i in range(size):
+        if i % 2 == 0:
+            text = f"What is the average price per square meter in the top {i + 3} cities?"
+            messages.append({"role": "user", "content": [{"type": "text", "text": text}]})
+        else:
+            messages.append({"role": "assistant", "content": [{"type": "text", "text": ANSWER * 3}]})
+    body = {"system": "You are a helpful assistant for SQL queries.", "tools": [], "messages": messages}
+    return json.dumps(body).encode("utf-8")
+
+
+def decode_full(body: bytes):
+    request = ChatRequest.model_validate(json.loads(body))
+    return convert_to_langchain_messages(request.messages)
+
+
+def per_call_us(fn, number: int) -> float:
+    return min(timeit.repeat(fn, number=number, repeat=5)) / number * 1e6
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[2, 20, 200])
+    parser.add_argument("--number", type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"{'messages':>9} {'KB':>8} {'full':>10} {'fast':>10} {'full/KB':>9} {'fast/KB':>9} {'speedup':>8}  (us)")
+    for size in args.sizes:
+        body = build_body(size)
+        # both paths must build the same messages
+        assert decode_full(body) == decode_chat_request(body)[1]
+        kb = len(body) / 1024
+        full = per_call_us(lambda: decode_full(body), args.number)
+        fast = per_call_us(lambda: decode_chat_request(body), args.number)
+        print(
+            f"{size:>9} {kb:>8.1f} {full:>10.1f} {fast:>10.1f} {full / kb:>9.2f} {fast / kb:>9.2f} {full / fast:>7.1f}x"
+        )
@@ -0,0 +1,373 @@
+"""Offline evaluation of the agent on chinook.sqlite: execution accuracy, LLM turns, tool calls, tokens and time.
+
+The LLM responses are replayed from cassettes, so the suite runs without network access.
+Record them once, with a real API key, whenever the prompts or the tools change:
+    python benchmarks/eval_chinook.py --record --update-baseline
+Then, from the backend folder:
+    python benchmarks/eval_chinook.py
+
+Cassettes and baselines are kept per system prompt, under benchmarks/eval/.
+
+Exits with a non-zero status when a question regresses against the baseline: an answer that
+was correct no longer is, it takes more LLM turns than before, or its cassette no longer matches
+the requests the agent sends (prompt or tool changes, re-record them). A question without a
+cassette, a missing baseline, or a run that evaluated no question at all also fails the run;
+--allow-missing only skips the questions without a cassette.
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import Counter
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+EVAL_DIR = os.path.join(BACKEND_DIR, "benchmarks", "eval")
+QUESTIONS_PATH = os.path.join(EVAL_DIR, "questions.json")
+CASSETTES_DIR = os.path.join(EVAL_DIR, "cassettes")
+CHINOOK_PATH = "prototyping/chinook.sqlite"
+UPSTREAM_URL = os.getenv("EVAL_UPSTREAM_URL", "https://api.openai.com/v1")
+
+
+# -------------------------- Cassettes --------------------------
+
+
+def fingerprint(body: dict) -> str:
+    """Hash of a completion request, ignoring the date injected in the system prompt"""
+    text = json.dumps(body, sort_keys=True)
+    text = text.replace(datetime.now().strftime("%Y-%m-%d"), "<today>")
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+
+class Cassette:
+    """Ordered LLM exchanges of one question"""
+
+    def __init__(self, path: str, recording: bool):
+        self.path = path
+        self.recording = recording
+        self.entries = []
+        if not recording and os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self.entries = json.load(f)["exchanges"]
+        self.position = 0
+        self.mismatch = None
+        self.tokens = Counter()
+        self.llm_seconds = 0.0
+
+    @property
+    def missing(self) -> bool:
+        return not self.recording and not os.path.exists(self.path)
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump({"exchanges": self.entries}, f, indent=1, ensure_ascii=False)
+
+    def account(self, response: dict, seconds: float):
+        usage = response.get("usage") or {}
+        self.tokens["input_tokens"] += usage.get("prompt_tokens", 0)
+        self.tokens["output_tokens"] += usage.get("completion_tokens", 0)
+        self.llm_seconds += seconds
+
+
+class CassetteServer:
+    """OpenAI-compatible endpoint replaying (or recording) the exchanges of the current cassette"""
+
+    def __init__(self, replay_latency: bool):
+        self.cassette = None
+        self.replay_latency = replay_latency
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.base_url = f"http://127.0.0.1:{self.server.server_address[1]}/v1"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def _handler(self):
+        owner = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _reply(self, status: int, payload: dict):
+                body = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                raw = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                status, payload = owner.exchange(
+                    self.path, raw, self.headers.get("Authorization", "")
+                )
+                self._reply(status, payload)
+
+        return Handler
+
+    def exchange(self, path: str, raw: bytes, authorization: str):
+        cassette = self.cassette
+        key = fingerprint(json.loads(raw or b"{}"))
+        if cassette.recording:
+            start = time.perf_counter()
+            status, response = self._forward(path, raw, authorization)
+            seconds = time.perf_counter() - start
+            if status == 200:
+                cassette.entries.append(
+                    {"fingerprint": key, "seconds": round(seconds, 3), "response": response}
+                )
+                cassette.account(response, seconds)
+            return status, response
+
+        # 400 is not retried by the clients, the run stops right away
+        if cassette.position >= len(cassette.entries):
+            cassette.mismatch = f"the agent made more than {len(cassette.entries)} LLM calls"
+            return 400, {"error": {"message": "Cassette exhausted", "type": "cassette"}}
+        entry = cassette.entries[cassette.position]
+        if entry["fingerprint"] != key:
+            cassette.mismatch = f"LLM call {cassette.position + 1} differs from the recording"
+            return 400, {"error": {"message": "Cassette mismatch", "type": "cassette"}}
+        cassette.position += 1
+        if self.replay_latency:
+            time.sleep(entry["seconds"])
+        cassette.account(entry["response"], entry["seconds"])
+        return 200, entry["response"]
+
+    def _forward(self, path: str, raw: bytes, authorization: str):
+        request = urllib.request.Request(
+            UPSTREAM_URL + path.removeprefix("/v1"),
+            data=raw,
+            headers={"Content-Type": "application/json", "Authorization": authorization},
+            method="POST",
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=120) as response:
+                return response.status, json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            return e.code, json.loads(e.read() or b"{}")
+
+
+# -------------------------- Execution accuracy --------------------------
+
+
+def _normalize(value):
+    if isinstance(value, float) or isinstance(value, int) and not isinstance(value, bool):
+        return round(float(value), 2)
+    if isinstance(value, str):
+        return value.strip()
+    return value
+
+
+def results_match(gold_rows, predicted_rows) -> bool:
+    """Same rows as the gold result, ignoring row order, column order and extra predicted columns"""
+    if len(gold_rows) != len(predicted_rows):
+        return False
+    if not gold_rows:
+        return True
+    gold = [tuple(_normalize(v) for v in row) for row in gold_rows]
+    predicted = [tuple(_normalize(v) for v in row) for row in predicted_rows]
+
+    def column_key(rows, index):
+        return sorted(map(repr, (row[index] for row in rows)))
+
+    # pair each gold column with an unused predicted column holding the same values
+    available = {i: column_key(predicted, i) for i in range(len(predicted[0]))}
+    projection = []
+    for j in range(len(gold[0])):
+        key = column_key(gold, j)
+        match = next((i for i, values in available.items() if values == key), None)
+        if match is None:
+            return False
+        projection.append(match)
+        del available[match]
+    projected = [tuple(row[i] for i in projection) for row in predicted]
+    return Counter(gold) == Counter(projected)
+
+
+def run_sql(sql: str):
+    conn = sqlite3.connect(f"file:{os.path.join(BACKEND_DIR, CHINOOK_PATH)}?mode=ro", uri=True)
+    try:
+        return conn.execute(sql).fetchall()
+    finally:
+        conn.close()
+
+
+# -------------------------- Agent runs --------------------------
+
+
+def configure_environment(base_url: str, recording: bool):
+    """Point the agent at chinook and at the cassette server, before it gets imported"""
+    os.chdir(BACKEND_DIR)
+    sys.path.insert(0, BACKEND_DIR)
+    os.environ["DATABASES"] = f"chinook={CHINOOK_PATH}"
+    os.environ["DEFAULT_DATABASE"] = ""
+    os.environ["OPENAI_BASE_URL"] = base_url
+    os.environ["TRACE_EXPORTER"] = "none"
+    # materialized summaries would change the system prompt from one run to the next
+    os.environ["SUMMARY_PROMOTION_THRESHOLD"] = str(10**9)
+    # so would few-shot examples recorded by the server from earlier conversations
+    os.environ["EXAMPLES_TOP_K"] = "0"
+    if not recording:
+        os.environ["API_KEY"] = "cassette"
+
+
+async def evaluate_question(graph, question: dict, cassette: Cassette, prompt_mode: str) -> dict:
+    from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+
+    report = {"id": question["id"], "correct": False, "error": None}
+    start = time.perf_counter()
+    try:
+        state = await graph.ainvoke(
+            {"messages": [HumanMessage(content=question["question"])]},
+            {"configurable": {"prompt_mode": prompt_mode}},
+        )
+    except Exception as e:
+        state = None
+        report["error"] = cassette.mismatch or f"{type(e).__name__}: {e}"
+    report["seconds"] = round(time.perf_counter() - start, 3)
+    report["llm_seconds"] = round(cassette.llm_seconds, 3)
+    report["llm_turns"] = len(cassette.entries) if cassette.recording else cassette.position
+    report.update(cassette.tokens)
+
+    messages = state["messages"] if state else []
+    tool_calls = [tc for m in messages if isinstance(m, AIMessage) for tc in m.tool_calls]
+    report["tool_calls"] = len(tool_calls)
+
+    # the answer is judged on the last query the agent ran successfully
+    results = {m.tool_call_id: m.content for m in messages if isinstance(m, ToolMessage)}
+    queries = [
+        tc["args"].get("sql_statement", "")
+        for tc in tool_calls
+        if tc["name"] == "ExecuteQuery" and not str(results.get(tc["id"], "")).startswith("Error")
+    ]
+    report["sql"] = queries[-1] if queries else None
+    if report["sql"] and state:
+        try:
+            report["correct"] = results_match(run_sql(question["gold_sql"]), run_sql(report["sql"]))
+        except sqlite3.Error as e:
+            report["error"] = f"Predicted SQL failed: {e}"
+    return report
+
+
+def regressions(reports, baseline: dict, turn_slack: int, allow_missing: bool):
+    failures = []
+    if not any(not r.get("skipped") for r in reports):
+        failures.append("no question was evaluated, record the cassettes with --record")
+    for report in reports:
+        previous = baseline.get(report["id"])
+        if report.get("skipped"):
+            if not allow_missing:
+                failures.append(f"{report['id']}: no cassette, record it with --record")
+            continue
+        if report["error"] and report["error"].startswith(("LLM call", "the agent made")):
+            failures.append(f"{report['id']}: {report['error']}, re-record with --record")
+        if previous is None:
+            continue
+        if previous["correct"] and not report["correct"]:
+            failures.append(f"{report['id']}: answer is no longer correct")
+        if report["llm_turns"] > previous["llm_turns"] + turn_slack:
+            failures.append(
+                f"{report['id']}: {report['llm_turns']} LLM turns, {previous['llm_turns']} in the baseline"
+            )
+    return failures
+
+
+def print_table(reports):
+    header = f"{'question':<32} {'ok':>3} {'turns':>5} {'tools':>5} {'in tok':>7} {'out tok':>7} {'time s':>7} {'llm s':>7}"
+    print(header)
+    print("-" * len(header))
+    for r in reports:
+        print(
+            f"{r['id']:<32} {'yes' if r['correct'] else 'no':>3} {r['llm_turns']:>5} {r['tool_calls']:>5} "
+            f"{r.get('input_tokens', 0):>7} {r.get('output_tokens', 0):>7} {r['seconds']:>7.2f} {r['llm_seconds']:>7.2f}"
+            + (f"  {r['error']}" if r["error"] else "")
+        )
+    skipped = sum(bool(r.get("skipped")) for r in reports)
+    reports = [r for r in reports if not r.get("skipped")]
+    correct = sum(r["correct"] for r in reports)
+    print("-" * len(header))
+    print(
+        f"execution accuracy {correct}/{len(reports)} ({correct / max(len(reports), 1):.0%}), "
+        f"{sum(r['llm_turns'] for r in reports)} LLM turns, {sum(r['tool_calls'] for r in reports)} tool calls"
+        + (f", {skipped} questions skipped without a cassette (record them with --record)" if skipped else "")
+    )
+
+
+async def main(args) -> int:
+    server = CassetteServer(args.replay_latency)
+    configure_environment(server.base_url, args.record)
+
+    from agent import graph
+    from managers.prompt_manager import prompt_manager
+
+    with open(QUESTIONS_PATH, encoding="utf-8") as f:
+        questions = json.load(f)
+    if args.only:
+        questions = [q for q in questions if q["id"] in args.only]
+    prompt_name = prompt_manager.resolve(args.prompt)
+    print(f"prompt: {prompt_name}, mode: {'record' if args.record else 'replay'}\n")
+
+    reports = []
+    for question in questions:
+        path = os.path.join(CASSETTES_DIR, prompt_name, f"{question['id']}.json")
+        server.cassette = Cassette(path, args.record)
+        if server.cassette.missing:
+            reports.append(
+                {"id": question["id"], "correct": False, "error": "No cassette, skipped", "llm_turns": 0,
+                 "tool_calls": 0, "seconds": 0.0, "llm_seconds": 0.0, "skipped": True}
+            )
+            continue
+        reports.append(await evaluate_question(graph, question, server.cassette, prompt_name))
+        if args.record:
+            server.cassette.save()
+    server.server.shutdown()
+
+    print_table(reports)
+
+    baseline_path = os.path.join(EVAL_DIR, f"baseline_{prompt_name}.json")
+    baseline = {}
+    if os.path.exists(baseline_path):
+        with open(baseline_path, encoding="utf-8") as f:
+            baseline = json.load(f)
+    failures = regressions(reports, baseline, args.turn_slack, args.allow_missing)
+    if not baseline and not args.update_baseline:
+        failures.append(f"no baseline at {os.path.relpath(baseline_path, BACKEND_DIR)}, write it with --update-baseline")
+    if args.update_baseline:
+        baseline.update(
+            {
+                r["id"]: {"correct": r["correct"], "llm_turns": r["llm_turns"]}
+                for r in reports
+                if not r.get("skipped")
+            }
+        )
+        with open(baseline_path, "w", encoding="utf-8") as f:
+            json.dump(baseline, f, indent=2)
+        print(f"\nbaseline written to {os.path.relpath(baseline_path, BACKEND_DIR)}")
+        return 0 if any(not r.get("skipped") for r in reports) else 1
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--record", action="store_true", help="call the real API and record the cassettes")
+    parser.add_argument("--update-baseline", action="store_true", help="accept the current results as the baseline")
+    parser.add_argument("--replay-latency", action="store_true", help="wait the recorded LLM latency when replaying")
+    parser.add_argument("--allow-missing", action="store_true", help="skip the questions without a cassette")
+    parser.add_argument("--turn-slack", type=int, default=0, help="extra LLM turns tolerated per question")
+    parser.add_argument("--only", nargs="*", help="question IDs to run")
+    parser.add_argument("--prompt", help="prompt mode to evaluate, the default mode otherwise")
+    sys.exit(asyncio.run(main(parser.parse_args())))
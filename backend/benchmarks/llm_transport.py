@@ -0,0 +1,139 @@
+"""Check of the LLM transport against the mock OpenAI server: retries, hedging and event loops.
+
+Starts the mock server in-process with rate limit errors and a slow tail, then sends
+completions through the per-model transport from one event loop, then from several
+loops at once. Run from the backend folder:
+    python benchmarks/llm_transport.py --requests 200 --error-rate 0.1 --slow-rate 0.02
+
+Exits with a non-zero status when a request fails, no retry or hedge happened, or the
+slowest requests were not cut short by hedging.
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import threading
+import time
+from http.server import ThreadingHTTPServer
+
+# the backend modules are imported from the backend folder, wherever the script is run from
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, os.path.join(BACKEND_DIR, "benchmarks"))
+
+MODEL = "mock-model"
+
+
+class QuietServer(ThreadingHTTPServer):
+    def handle_error(self, request, client_address):
+        # hedged copies are abandoned mid-response, their broken pipes are expected
+        pass
+
+
+async def send_all(transport, base_url: str, count: int, concurrency: int):
+    """Send `count` completions, at most `concurrency` at once; returns (statuses, latencies)"""
+    import httpx
+
+    statuses, latencies = [], []
+    gate = asyncio.Semaphore(concurrency)
+    async with httpx.AsyncClient(transport=transport, base_url=base_url, timeout=30) as client:
+
+        async def one(i: int):
+            async with gate:
+                start = time.perf_counter()
+                response = await client.post(
+                    "/chat/completions",
+                    json={"model": MODEL, "messages": [{"role": "user", "content": f"question {i}"}]},
+                )
+                latencies.append(time.perf_counter() - start)
+                statuses.append(response.status_code)
+
+        await asyncio.gather(*(one(i) for i in range(count)))
+    return statuses, latencies
+
+
+def run_in_loops(transport, base_url: str, loops: int, count: int, concurrency: int):
+    """Run `send_all` in `loops` event loops at once, one per thread"""
+    results, errors = [], []
+
+    def worker():
+        try:
+            results.append(asyncio.run(send_all(transport, base_url, count, concurrency)))
+        except Exception as e:
+            errors.append(f"{type(e).__name__}: {e}")
+
+    threads = [threading.Thread(target=worker) for _ in range(loops)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    statuses = [s for r in results for s in r[0]]
+    return statuses, errors
+
+
+def percentile(values, fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--loops", type=int, default=4, help="event loops sending at once in the second phase")
+    parser.add_argument("--latency", type=float, default=0.02)
+    # below 5%, the slow tail stays above the p95 that triggers the hedges
+    parser.add_argument("--slow-rate", type=float, default=0.02)
+    parser.add_argument("--slow-latency", type=float, default=1.0)
+    parser.add_argument("--error-rate", type=float, default=0.1)
+    args = parser.parse_args()
+
+    # read when the module is imported
+    os.environ["LLM_HEDGE"] = "1"
+    from managers.llm_manager import _model_transport
+    from mock_openai_server import build_handler
+    from utils.metrics import metrics
+
+    server = QuietServer(
+        ("127.0.0.1", 0),
+        build_handler(args.latency, args.slow_rate, args.slow_latency, args.error_rate),
+    )
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    transport = _model_transport(MODEL)
+
+    failures = []
+    statuses, latencies = asyncio.run(send_all(transport, base_url, args.requests, args.concurrency))
+    retries = metrics.get("llm_retries_total", model=MODEL)
+    hedged = metrics.get("llm_hedged_requests_total", model=MODEL)
+    # the first requests only feed the latency window, hedging starts after them
+    hedged_latencies = latencies[args.requests // 2 :]
+    print(f"one loop:   {len(statuses)} requests, {statuses.count(200)} ok, {retries:g} retries, {hedged:g} hedged")
+    print(
+        f"            latency median {statistics.median(latencies) * 1000:.0f} ms, "
+        f"p99 of the second half {percentile(hedged_latencies, 0.99) * 1000:.0f} ms "
+        f"(slow tail {args.slow_latency * 1000:.0f} ms)"
+    )
+    if statuses.count(200) != len(statuses):
+        failures.append(f"{len(statuses) - statuses.count(200)} requests failed despite the retries")
+    if args.error_rate > 0 and retries == 0:
+        failures.append("no request was retried")
+    if args.slow_rate > 0 and hedged == 0:
+        failures.append("no request was hedged")
+    if args.slow_rate > 0 and percentile(hedged_latencies, 0.99) >= args.slow_latency:
+        failures.append("hedging did not cut the slow tail")
+
+    loop_statuses, errors = run_in_loops(
+        transport, base_url, args.loops, args.requests // args.loops, args.concurrency
+    )
+    print(f"{args.loops} loops:    {len(loop_statuses)} requests, {loop_statuses.count(200)} ok, {len(errors)} errors")
+    failures += [f"event loop failed: {error}" for error in errors]
+    if loop_statuses.count(200) != len(loop_statuses):
+        failures.append(f"{len(loop_statuses) - loop_statuses.count(200)} requests failed across loops")
+
+    server.shutdown()
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
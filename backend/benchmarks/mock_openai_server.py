@@ -0,0 +1,81 @@
+"""Minimal stand-in for the OpenAI chat completions API, to exercise the LLM clients locally.
+
+Usage:
+    python benchmarks/mock_openai_server.py --port 8100 --latency 0.2 --slow-rate 0.05 --error-rate 0.1
+    OPENAI_BASE_URL=http://127.0.0.1:8100/v1 API_KEY=test python server.py
+"""
+
+import argparse
+import json
+import random
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def build_handler(latency: float, slow_rate: float, slow_latency: float, error_rate: float):
+    class MockOpenAIHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _reply(self, status: int, payload: dict, headers=None):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length) or b"{}")
+
+            if random.random() < error_rate:
+                self._reply(
+                    429,
+                    {"error": {"message": "Rate limit reached", "type": "rate_limit"}},
+                    {"Retry-After": "0.1"},
+                )
+                return
+
+            time.sleep(slow_latency if random.random() < slow_rate else latency)
+            self._reply(
+                200,
+                {
+                    "id": f"chatcmpl-{uuid.uuid4().hex}",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": request.get("model", "mock"),
+                    "choices": [
+                        {
+                            "index": 0,
+                            "message": {"role": "assistant", "content": "This is a mock answer."},
+                            "finish_reason": "stop",
+                        }
+                    ],
+                    "usage": {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15},
+                },
+            )
+
+    return MockOpenAIHandler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--latency", type=float, default=0.2, help="usual response time in seconds")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="share of requests hitting the slow tail")
+    parser.add_argument("--slow-latency", type=float, default=5.0, help="response time of slow requests")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered with a 429")
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(
+        ("127.0.0.1", args.port),
+        build_handler(args.latency, args.slow_rate, args.slow_latency, args.error_rate),
+    )
+    print(f"Mock OpenAI API listening on http://127.0.0.1:{args.port}/v1")
+    server.serve_forever()
@@ -0,0 +1,75 @@
+"""Cold start benchmark: import time of the server and time to serve the first requests.
+
+Each measurement runs in a fresh interpreter, from the backend folder:
+    python benchmarks/startup.py --runs 5 --import-budget 1.5 --first-request-budget 0.5
+
+Exits with a non-zero status when the median of a measurement exceeds its budget.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# runs in the child interpreter, prints the timings as JSON
+PROBE = r"""
+import json, time
+start = time.perf_counter()
+import server
+imported = time.perf_counter()
+
+from fastapi.testclient import TestClient
+client = TestClient(server.app)
+client.options("/api/chat")
+first_request = time.perf_counter()
+
+from tools.db_tools import list_tables_tool
+list_tables_tool.invoke({})
+first_tool = time.perf_counter()
+
+print(json.dumps({
+    "import_seconds": imported - start,
+    "first_request_seconds": first_request - imported,
+    "first_tool_call_seconds": first_tool - first_request,
+}))
+"""
+
+
+def measure_once() -> dict:
+    result = subprocess.run(
+        [sys.executable, "-c", PROBE],
+        cwd=BACKEND_DIR,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--import-budget", type=float, default=None, help="seconds")
+    parser.add_argument("--first-request-budget", type=float, default=None, help="seconds")
+    args = parser.parse_args()
+
+    samples = [measure_once() for _ in range(args.runs)]
+    medians = {key: statistics.median(s[key] for s in samples) for key in samples[0]}
+    for key, value in medians.items():
+        print(f"{key:<28} median {value * 1000:8.1f} ms  (max {max(s[key] for s in samples) * 1000:.1f} ms)")
+
+    budgets = {
+        "import_seconds": args.import_budget,
+        "first_request_seconds": args.first_request_budget,
+    }
+    over_budget = [
+        key for key, budget in budgets.items() if budget is not None and medians[key] > budget
+    ]
+    for key in over_budget:
+        print(f"FAIL: {key} exceeds its budget of {budgets[key]:.3f} s")
+    sys.exit(1 if over_budget else 0)
@@ -0,0 +1,73 @@
+"""Per-turn overhead of the messages reducer, full-history updates versus delta updates.
+
+Run from the backend folder:
+    python benchmarks/state_updates.py --sizes 10 100 1000
+"""
+
+import argparse
+import os
+import sys
+import timeit
+
+# the backend modules are imported from the backend folder, wherever the script is run from
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+from langgraph.graph import END, START, StateGraph
+from langgraph.graph.message import add_messages
+
+from agent import AgentState
+
+
+def build_history(size: int):
+    messages = [HumanMessage(content="How many listings per city?")]
+    while len(messages) < size:
+        call_id = f"call_{len(messages)}"
+        messages.append(
+            AIMessage(
+                content="",
+                tool_calls=[{"id": call_id, "name": "GetSampleRows", "args": {"selected_table": "listings"}}],
+            )
+        )
+        messages.append(ToolMessage(content="[(1, 'Paris', 350000.0)]", tool_call_id=call_id))
+    # ids are assigned by the reducer, as they are in a running graph
+    return add_messages([], messages[:size])
+
+
+def build_graph(delta: bool):
+    def turn(state):
+        new_message = AIMessage(content="answer")
+        if delta:
+            return {"messages": [new_message]}
+        return {**state, "messages": state["messages"] + [new_message]}
+
+    workflow = StateGraph(AgentState)
+    workflow.add_node("turn", turn)
+    workflow.add_edge(START, "turn")
+    workflow.add_edge("turn", END)
+    return workflow.compile()
+
+
+def per_call_ms(fn, number: int) -> float:
+    return min(timeit.repeat(fn, number=number, repeat=5)) / number * 1000
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--number", type=int, default=50)
+    args = parser.parse_args()
+
+    full_graph = build_graph(delta=False)
+    delta_graph = build_graph(delta=True)
+
+    print(f"{'messages':>9} {'reducer full':>14} {'reducer delta':>14} {'turn full':>11} {'turn delta':>11}  (ms)")
+    for size in args.sizes:
+        history = build_history(size)
+        new_message = AIMessage(content="answer")
+        reducer_full = per_call_ms(lambda: add_messages(history, history + [new_message]), args.number)
+        reducer_delta = per_call_ms(lambda: add_messages(history, [new_message]), args.number)
+        turn_full = per_call_ms(lambda: full_graph.invoke({"messages": history}), args.number)
+        turn_delta = per_call_ms(lambda: delta_graph.invoke({"messages": history}), args.number)
+        print(f"{size:>9} {reducer_full:>14.3f} {reducer_delta:>14.3f} {turn_full:>11.3f} {turn_delta:>11.3f}")
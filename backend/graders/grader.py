@@ -1,9 +1,10 @@
 import os
 from pydantic import BaseModel, Field
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_openai import ChatOpenAI
 from dotenv import load_dotenv
 
+from managers.llm_manager import get_llm
+
 # -------------------------- Setup --------------------------
 
 
@@ -11,6 +12,7 @@ load_dotenv()
 
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 AZURE_ENDPOINT = os.getenv("AZURE_ENDPOINT")
+GRADER_MODEL = os.getenv("GRADER_MODEL", "gpt-3.5-turbo")
 
 
 # -------------------------- SQL Query Sense Grader --------------------------
@@ -50,7 +52,8 @@ If the query makes sense and reflects sound logic in structure and intention, re
         ]
     )
 
-    llm = ChatOpenAI(
+    llm = get_llm(
+        GRADER_MODEL,
         api_key=OPENAI_API_KEY,
         max_completion_tokens=100,
         temperature=0,
@@ -90,7 +93,8 @@ Give a binary score 'yes' or 'no'. 'Yes' means the result appears plausible and
         ]
     )
 
-    llm = ChatOpenAI(
+    llm = get_llm(
+        GRADER_MODEL,
         api_key=OPENAI_API_KEY,
         max_completion_tokens=100,
         temperature=0,
@@ -131,7 +135,8 @@ Give a binary score 'yes' or 'no'. 'Yes' means the answer is consistent with the
         ]
     )
 
-    llm = ChatOpenAI(
+    llm = get_llm(
+        GRADER_MODEL,
         api_key=OPENAI_API_KEY,
         max_completion_tokens=100,
         temperature=0,
@@ -172,7 +177,8 @@ Give a binary score 'yes' or 'no'. 'Yes' means the answer addresses the question
         ]
     )
 
-    llm = ChatOpenAI(
+    llm = get_llm(
+        GRADER_MODEL,
         api_key=OPENAI_API_KEY,
         max_completion_tokens=100,
         temperature=0,
@@ -0,0 +1,23 @@
+"""Multi-worker serving, from the backend folder:
+    gunicorn server:app
+
+The app is imported once before forking (prompts, graph, database registry), so the
+workers share that memory copy-on-write. Connections, HTTP pools and locks are created
+lazily, each worker opening its own after the fork. Files written while serving are per
+worker too: materialized summaries in `database/summaries_<pid>.db`, traces in
+`traces/traces_<date>_<pid>.jsonl`.
+"""
+
+import multiprocessing
+import os
+
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+workers = int(os.getenv("WEB_CONCURRENCY", str(multiprocessing.cpu_count())))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+
+# a chat run can take a while, the disconnect polling cancels abandoned ones
+timeout = int(os.getenv("WORKER_TIMEOUT", "300"))
+graceful_timeout = 30
+keepalive = 5
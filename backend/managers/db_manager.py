@@ -1,6 +1,276 @@
-from langchain_community.utilities import SQLDatabase
+import os
+import signal
+import sqlite3
+import threading
+import time
 
+from managers.federation import FederationError, run_federated
+from utils.cancellation import track_connection, untrack_connection
+from utils.logger import log_other
+from utils.metrics import metrics
+from utils.tracing import capture_plans, span
 
-uri = f"sqlite:///database/real_estate.db"
 
-db = SQLDatabase.from_uri(uri)
+# all databases served by the agent, as "name=path" pairs, e.g.
+# DATABASES="north=database/north.db,south=database/south.db"
+DATABASES = os.getenv("DATABASES", "real_estate=database/real_estate.db")
+
+# "*" makes the federated view over every database the default target
+DEFAULT_DATABASE = os.getenv("DEFAULT_DATABASE", "")
+
+FEDERATED = "*"
+
+# longest text value returned to the LLM by `run_no_throw`, as `SQLDatabase.run` truncates them
+MAX_STRING_LENGTH = 300
+
+# snapshot mode: database files are never modified in place, the ETL job publishes a new
+# version by renaming a complete file over the old one (os.replace), then optionally sends SIGHUP
+SNAPSHOT_MODE = os.getenv("DB_SNAPSHOTS", "0") == "1"
+SNAPSHOT_MMAP_BYTES = int(os.getenv("DB_SNAPSHOT_MMAP_BYTES", str(1024**3)))
+# how often the files are checked for a new snapshot, 0 to only refresh on SIGHUP
+SNAPSHOT_POLL_SECONDS = float(os.getenv("DB_SNAPSHOT_POLL_SECONDS", "10"))
+
+
+class Database:
+    """A single SQLite file with its own connections"""
+
+    def __init__(self, name: str, path: str):
+        self.name = name
+        self.path = path
+        self._lock = threading.Lock()
+        # snapshot currently served, bumped each time a new file is swapped in
+        self.generation = 0
+        self._file_identity = None
+
+    def _open(self) -> sqlite3.Connection:
+        if not SNAPSHOT_MODE:
+            return sqlite3.connect(
+                f"file:{os.path.abspath(self.path)}?mode=ro",
+                uri=True,
+                check_same_thread=False,
+            )
+        # immutable: no locks and no change detection, the file is read through a shared mapping
+        conn = sqlite3.connect(
+            f"file:{os.path.abspath(self.path)}?mode=ro&immutable=1",
+            uri=True,
+            check_same_thread=False,
+        )
+        conn.execute(f"PRAGMA mmap_size={SNAPSHOT_MMAP_BYTES}")
+        return conn
+
+    def connect(self) -> sqlite3.Connection:
+        """Open a new read-only connection, usable from any thread.
+
+        The connection is interrupted if the run it was opened for gets cancelled.
+        """
+        return track_connection(self._open())
+
+    def file_identity(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def refresh(self) -> bool:
+        """Switch to the file now at `path` if it is a new snapshot; returns whether it was swapped"""
+        identity = self.file_identity()
+        if identity is None:
+            return False
+        with self._lock:
+            if self._file_identity is None:
+                self._file_identity = identity
+                return False
+            if identity == self._file_identity:
+                return False
+            try:
+                # never swap to a file that is not a readable database
+                check = sqlite3.connect(f"file:{os.path.abspath(self.path)}?mode=ro", uri=True)
+                try:
+                    check.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+                finally:
+                    check.close()
+            except sqlite3.Error as e:
+                log_other(f"Ignoring new snapshot of {self.name}: {e}")
+                return False
+
+            self._file_identity = identity
+            self.generation += 1
+        log_other(f"Swapped in snapshot {self.generation} of {self.name}")
+        metrics.set("db_snapshot_generation", self.generation, database=self.name)
+        metrics.inc("db_snapshot_swaps_total", database=self.name)
+        return True
+
+
+class DatabaseRegistry:
+    """Named databases, addressed one at a time or all at once with "*" """
+
+    def __init__(self, spec: str, default: str = ""):
+        self.databases = {}
+        for entry in spec.split(","):
+            if not entry.strip():
+                continue
+            name, _, path = entry.partition("=")
+            self.databases[name.strip()] = Database(name.strip(), path.strip())
+        if not self.databases:
+            raise ValueError("No database configured, set DATABASES to name=path pairs.")
+        self.default = default or next(iter(self.databases))
+        self._swap_callbacks = []
+        # threads do not survive a fork, each worker process starts its own watcher
+        self._watcher_pid = None
+        self._watcher_lock = threading.Lock()
+
+    def names(self):
+        return list(self.databases)
+
+    # -------------------------- Snapshots --------------------------
+
+    def on_swap(self, callback):
+        """Call `callback(database)` whenever a new snapshot of a database is swapped in"""
+        self._swap_callbacks.append(callback)
+
+    def refresh(self):
+        """Swap in the new snapshots, then invalidate the caches scoped to the previous ones"""
+        for database in self.databases.values():
+            if database.refresh():
+                for callback in self._swap_callbacks:
+                    callback(database)
+
+    def watch(self):
+        """Start polling the files for new snapshots, once per process"""
+        if not SNAPSHOT_MODE or self._watcher_pid == os.getpid():
+            return
+        with self._watcher_lock:
+            if self._watcher_pid == os.getpid():
+                return
+            self._watcher_pid = os.getpid()
+            for database in self.databases.values():
+                database.refresh()
+            if SNAPSHOT_POLL_SECONDS > 0:
+                threading.Thread(target=self._poll, daemon=True).start()
+
+    def _poll(self):
+        while True:
+            time.sleep(SNAPSHOT_POLL_SECONDS)
+            try:
+                self.refresh()
+            except Exception as e:
+                log_other(f"Snapshot refresh failed: {e}")
+
+    def install_refresh_signal(self):
+        """Refresh the snapshots on SIGHUP, e.g. right after the ETL job published a new file"""
+        if not SNAPSHOT_MODE or not hasattr(signal, "SIGHUP"):
+            return
+        # the refresh takes locks, it must not run inside the handler on the main thread
+        signal.signal(
+            signal.SIGHUP,
+            lambda signum, frame: threading.Thread(target=self.refresh, daemon=True).start(),
+        )
+
+    def resolve(self, name: str = ""):
+        """Return the databases targeted by `name`: one database, or all of them for "*" """
+        self.watch()
+        name = name or self.default
+        if name == FEDERATED:
+            return list(self.databases.values())
+        if name not in self.databases:
+            raise ValueError(
+                f"Unknown database '{name}'. Available databases: {', '.join(self.names())}"
+            )
+        return [self.databases[name]]
+
+    def get(self, name: str = "") -> Database:
+        """Return a single database; the federated view resolves to its first member"""
+        return self.resolve(name)[0]
+
+    def explain(self, query: str, database: str = "") -> str:
+        """Compact EXPLAIN QUERY PLAN of `query` on the (first) targeted database, empty if it cannot be planned"""
+        try:
+            conn = self.get(database).connect()
+        except ValueError:
+            return ""
+        try:
+            rows = conn.execute(f"EXPLAIN QUERY PLAN {query}").fetchall()
+        except sqlite3.Error:
+            return ""
+        finally:
+            untrack_connection(conn)
+            conn.close()
+        return "; ".join(str(row[-1]) for row in rows)
+
+    def execute(self, query: str, database: str = ""):
+        """Run `query` and return (column names, row iterator).
+
+        Rows of a single database are streamed from the cursor, the connection being
+        closed once they are exhausted. Raises ValueError or sqlite3.Error.
+        """
+        targets = self.resolve(database)
+        if len(targets) > 1:
+            columns, rows = run_federated(targets, query)
+            return columns, iter(rows)
+
+        conn = targets[0].connect()
+        try:
+            cursor = conn.execute(query)
+        except Exception:
+            untrack_connection(conn)
+            conn.close()
+            raise
+        columns = [d[0] for d in cursor.description] if cursor.description else []
+        return columns, _iter_cursor(conn, cursor)
+
+    def run_no_throw(self, query: str, database: str = "", include_columns: bool = False) -> str:
+        """Same contract as `SQLDatabase.run_no_throw`, fanning out when several databases are targeted.
+
+        Statements run on connections of their own, interrupted if the run gets cancelled.
+        """
+        try:
+            targets = self.resolve(database)
+        except ValueError as e:
+            return f"Error: {e}"
+
+        with span("sql", **{"db.name": database or self.default, "db.statement": query}) as sql_span:
+            if sql_span is not None and capture_plans():
+                sql_span.set(**{"db.plan": self.explain(query, database)})
+            try:
+                if len(targets) == 1:
+                    columns, rows = self.execute(query, targets[0].name)
+                    rows = list(rows)
+                else:
+                    columns, rows = run_federated(targets, query)
+            except (FederationError, sqlite3.Error) as e:
+                return f"Error: {e}"
+            if sql_span is not None:
+                sql_span.set(**{"db.rows": len(rows)})
+        if not rows:
+            return ""
+        rows = [tuple(_truncate(v) for v in row) for row in rows]
+        if include_columns:
+            return str([dict(zip(columns, row)) for row in rows])
+        return str(rows)
+
+
+def _truncate(value, suffix: str = "..."):
+    """Shorten long text at a word boundary, as `SQLDatabase.run` does"""
+    if not isinstance(value, str) or len(value) <= MAX_STRING_LENGTH:
+        return value
+    return value[: MAX_STRING_LENGTH - len(suffix)].rsplit(" ", 1)[0] + suffix
+
+
+def _iter_cursor(conn: sqlite3.Connection, cursor: sqlite3.Cursor, batch_size: int = 1_000):
+    try:
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield from rows
+    finally:
+        untrack_connection(conn)
+        conn.close()
+
+
+registry = DatabaseRegistry(DATABASES, DEFAULT_DATABASE)
+
+# the default database, kept for single-database callers; read without resolving the name,
+# which would start the snapshot watcher before a preloading server forks its workers
+DB_PATH = registry.databases.get(registry.default, next(iter(registry.databases.values()))).path
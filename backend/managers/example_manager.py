@@ -0,0 +1,244 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+
+from utils.logger import log_other
+
+
+EXAMPLES_DB_PATH = "database/examples.db"
+
+# examples shown to the LLM for each question
+EXAMPLES_TOP_K = int(os.getenv("EXAMPLES_TOP_K", "3"))
+# confirmed examples kept, the least recently used are evicted first
+MAX_EXAMPLES = int(os.getenv("EXAMPLES_MAX", "2000"))
+# answers waiting for the user's next message to be confirmed
+MAX_PENDING_EXAMPLES = 1_000
+PENDING_TTL_SECONDS = 24 * 3600
+MAX_EXAMPLE_SQL_CHARS = 2_000
+
+# a follow-up message like these means the previous answer was wrong
+CORRECTION = re.compile(
+    r"^\s*(no\b|nope\b|wrong\b)|\b(not (right|correct|what i)|incorrect|wrong|mistake|"
+    r"should (be|have)|doesn'?t (look|seem) right|that'?s not|try again)\b",
+    re.IGNORECASE,
+)
+WORD = re.compile(r"\w+")
+# words every question shares, matching on them alone would retrieve unrelated examples
+STOPWORDS = frozenset(
+    "a an and are by can de did do does for from give how i in is it list me my of on or per "
+    "please show tell than that the their there this to was what when which who with".split()
+)
+
+
+def message_text(message) -> str:
+    """Text of a message, whether its content is a string or a list of parts"""
+    content = message.content
+    if isinstance(content, str):
+        return content
+    return " ".join(p.get("text", "") for p in content if isinstance(p, dict)).strip()
+
+
+def _exchange_key(question: str, answer: str) -> str:
+    # the frontend only sends the texts back, they identify the exchange in the next request
+    return hashlib.sha1(f"{question.strip()}\0{answer.strip()}".encode("utf-8")).hexdigest()
+
+
+def _normalize_question(question: str) -> str:
+    return " ".join(WORD.findall(question.lower()))
+
+
+class ExampleManager:
+    """Past question -> SQL pairs that were answered correctly, retrieved as few-shot examples.
+
+    An answer becomes an example when the grader accepted its query, or when the user's next
+    message in the conversation is not a correction. Questions are indexed with FTS5 and
+    retrieved by BM25 similarity. The store is a side SQLite file shared by the workers.
+    """
+
+    def __init__(self, path: str, top_k: int, max_examples: int):
+        self.path = path
+        self.top_k = top_k
+        self.max_examples = max_examples
+        self._lock = threading.Lock()
+        self._conn = None
+        self._conn_pid = None
+
+    def _connect(self) -> sqlite3.Connection:
+        # connections do not survive a fork, each worker opens its own
+        if self._conn is None or self._conn_pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, timeout=5)
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS examples (
+                    id INTEGER PRIMARY KEY,
+                    question TEXT NOT NULL,
+                    normalized TEXT NOT NULL UNIQUE,
+                    sql TEXT NOT NULL,
+                    database TEXT NOT NULL,
+                    last_used REAL NOT NULL
+                );
+                CREATE VIRTUAL TABLE IF NOT EXISTS example_index USING fts5(
+                    question, content = 'examples', content_rowid = 'id', tokenize = 'porter unicode61'
+                );
+                CREATE TRIGGER IF NOT EXISTS examples_insert AFTER INSERT ON examples BEGIN
+                    INSERT INTO example_index (rowid, question) VALUES (new.id, new.question);
+                END;
+                CREATE TRIGGER IF NOT EXISTS examples_delete AFTER DELETE ON examples BEGIN
+                    INSERT INTO example_index (example_index, rowid, question)
+                    VALUES ('delete', old.id, old.question);
+                END;
+                CREATE TABLE IF NOT EXISTS pending_examples (
+                    key TEXT PRIMARY KEY,
+                    question TEXT NOT NULL,
+                    sql TEXT NOT NULL,
+                    database TEXT NOT NULL,
+                    created REAL NOT NULL
+                );
+                """
+            )
+            self._conn = conn
+            self._conn_pid = os.getpid()
+        return self._conn
+
+    # -------------------------- Recording --------------------------
+
+    def _add(self, conn: sqlite3.Connection, question: str, sql: str, database: str):
+        conn.execute(
+            "INSERT INTO examples (question, normalized, sql, database, last_used) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (normalized) DO UPDATE SET sql = excluded.sql, database = excluded.database, "
+            "last_used = excluded.last_used",
+            (question, _normalize_question(question), sql, database, time.time()),
+        )
+        conn.execute(
+            "DELETE FROM examples WHERE id IN (SELECT id FROM examples ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+            (self.max_examples,),
+        )
+
+    def review(self, messages):
+        """Confirm or drop the pending example answered just before the latest user message"""
+        humans = [i for i, m in enumerate(messages) if isinstance(m, HumanMessage)]
+        if len(humans) < 2:
+            return
+        previous, latest = humans[-2], humans[-1]
+        answers = [m for m in messages[previous + 1 : latest] if isinstance(m, AIMessage)]
+        if not answers:
+            return
+        key = _exchange_key(message_text(messages[previous]), message_text(answers[-1]))
+        corrected = bool(CORRECTION.search(message_text(messages[latest])))
+
+        with self._lock:
+            try:
+                conn = self._connect()
+                with conn:
+                    pending = conn.execute(
+                        "SELECT question, sql, database FROM pending_examples WHERE key = ?", (key,)
+                    ).fetchone()
+                    conn.execute("DELETE FROM pending_examples WHERE key = ?", (key,))
+                    if pending is not None and not corrected:
+                        self._add(conn, *pending)
+            except sqlite3.Error as e:
+                log_other(f"Could not review the pending example: {e}")
+                return
+        if pending is not None:
+            log_other(f"Example {'dropped after a correction' if corrected else 'confirmed'}: {pending[0]}")
+
+    def record(self, messages, run_start: int, answer: str, grade: str = ""):
+        """Keep the last successful query of a run with its question.
+
+        Stored right away when the grader accepted it, else pending until the user's next message.
+        """
+        humans = [m for m in messages[:run_start] if isinstance(m, HumanMessage)]
+        if not humans or not answer or grade == "no":
+            return
+        question = message_text(humans[-1])
+
+        # results of the ExecuteQuery calls made during this run, by tool call ID
+        results = {m.tool_call_id: str(m.content) for m in messages[run_start:] if isinstance(m, ToolMessage)}
+        query = None
+        for message in messages[run_start:]:
+            if not isinstance(message, AIMessage):
+                continue
+            for tool_call in message.tool_calls:
+                args = tool_call.get("args", {})
+                if (
+                    tool_call["name"] == "ExecuteQuery"
+                    and not args.get("approximate")
+                    and not results.get(tool_call["id"], "Error").startswith("Error")
+                ):
+                    query = args
+        if query is None or not query.get("sql_statement"):
+            return
+        sql = query["sql_statement"].strip()[:MAX_EXAMPLE_SQL_CHARS]
+        database = query.get("database", "")
+
+        with self._lock:
+            try:
+                conn = self._connect()
+                with conn:
+                    if grade == "yes":
+                        self._add(conn, question, sql, database)
+                        return
+                    conn.execute(
+                        "INSERT OR REPLACE INTO pending_examples VALUES (?, ?, ?, ?, ?)",
+                        (_exchange_key(question, answer), question, sql, database, time.time()),
+                    )
+                    conn.execute(
+                        "DELETE FROM pending_examples WHERE created < ? OR key IN ("
+                        "SELECT key FROM pending_examples ORDER BY created DESC LIMIT -1 OFFSET ?)",
+                        (time.time() - PENDING_TTL_SECONDS, MAX_PENDING_EXAMPLES),
+                    )
+            except sqlite3.Error as e:
+                log_other(f"Could not record the example: {e}")
+
+    # -------------------------- Retrieval --------------------------
+
+    def similar(self, question: str):
+        """Return up to top_k (question, sql, database) examples most similar to `question`"""
+        words = set(WORD.findall(question.lower())) - STOPWORDS
+        if not words or self.top_k <= 0:
+            return []
+        match = " OR ".join(f'"{word}"' for word in sorted(words))
+        with self._lock:
+            try:
+                conn = self._connect()
+                rows = conn.execute(
+                    "SELECT e.id, e.question, e.sql, e.database FROM example_index "
+                    "JOIN examples AS e ON e.id = example_index.rowid "
+                    "WHERE example_index MATCH ? ORDER BY bm25(example_index) LIMIT ?",
+                    (match, self.top_k),
+                ).fetchall()
+                if rows:
+                    with conn:
+                        conn.executemany(
+                            "UPDATE examples SET last_used = ? WHERE id = ?",
+                            [(time.time(), row[0]) for row in rows],
+                        )
+            except sqlite3.Error as e:
+                log_other(f"Could not retrieve examples: {e}")
+                return []
+        return [row[1:] for row in rows]
+
+    def describe(self, question: str) -> str:
+        """Text for the system prompt with the examples similar to `question`"""
+        examples = self.similar(question)
+        if not examples:
+            return ""
+        blocks = []
+        for past_question, sql, database in examples:
+            target = f" (database: {database})" if database else ""
+            blocks.append(f"Question: {past_question}\nSQL{target}:\n{sql}")
+        return (
+            "Similar questions answered correctly before, with the query that answered them. "
+            "Reuse them when they fit the current question instead of exploring from scratch, "
+            "after checking they answer it exactly:\n\n" + "\n\n".join(blocks)
+        )
+
+
+example_manager = ExampleManager(EXAMPLES_DB_PATH, EXAMPLES_TOP_K, MAX_EXAMPLES)
@@ -0,0 +1,423 @@
+import contextvars
+import re
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.cancellation import untrack_connection
+from utils.tracing import span
+
+
+class FederationError(ValueError):
+    """Raised when a query cannot be split into per-shard queries plus a merge step"""
+
+
+# aggregate -> how the partial results of each shard are combined
+MERGE_FUNCTIONS = {
+    "SUM": "SUM",
+    "TOTAL": "TOTAL",
+    "COUNT": "SUM",
+    "MIN": "MIN",
+    "MAX": "MAX",
+}
+ANY_AGGREGATE = re.compile(
+    r"\b(SUM|TOTAL|COUNT|MIN|MAX|AVG|GROUP_CONCAT|STRING_AGG)\s*\(", re.IGNORECASE
+)
+ALIAS = re.compile(r"^(.*?)\s+(?:AS\s+)?(\"[^\"]+\"|`[^`]+`|\[[^\]]+\]|\w+)$", re.IGNORECASE | re.DOTALL)
+NOT_ALIASES = {"END", "NULL", "ASC", "DESC", "TRUE", "FALSE"}
+TRAILING_OPERATOR = re.compile(
+    r"\b(AND|OR|NOT|IS|IN|LIKE|GLOB|BETWEEN|CASE|WHEN|THEN|ELSE|ESCAPE|COLLATE)$", re.IGNORECASE
+)
+CLAUSES = ["SELECT", "FROM", "WHERE", "GROUP BY", "HAVING", "ORDER BY", "LIMIT"]
+LITERALS = re.compile(r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|`[^`]*`|\[[^\]]*\]")
+MIN_MAX_CALL = re.compile(r"\b(MIN|MAX)\s*\(", re.IGNORECASE)
+NESTED_QUERY = re.compile(r"\(\s*(SELECT|WITH)\b", re.IGNORECASE)
+# computed over the rows of one shard only, a nested query using them differs on the union
+SHARD_LOCAL = re.compile(r"\bDISTINCT\b|\bGROUP\s+BY\b|\bLIMIT\b", re.IGNORECASE)
+
+
+# -------------------------- Parsing --------------------------
+
+
+def _top_level_positions(sql: str, keywords):
+    """Yield (position, keyword) for keywords outside of parentheses, strings and identifiers"""
+    depth = 0
+    quote = None
+    i = 0
+    upper = sql.upper()
+    while i < len(sql):
+        c = sql[i]
+        if quote:
+            if c == quote:
+                quote = None
+        elif c in ("'", '"', "`"):
+            quote = c
+        elif c == "[":
+            quote = "]"
+        elif c == "(":
+            depth += 1
+        elif c == ")":
+            depth -= 1
+        elif depth == 0 and (i == 0 or not (sql[i - 1].isalnum() or sql[i - 1] == "_")):
+            for keyword in keywords:
+                pattern = keyword.replace(" ", r"\s+") + r"\b"
+                match = re.match(pattern, upper[i:])
+                if match:
+                    yield i, keyword, match.end()
+                    break
+        i += 1
+
+
+def split_top_level(text: str, separator: str = ","):
+    parts = []
+    depth = 0
+    quote = None
+    start = 0
+    for i, c in enumerate(text):
+        if quote:
+            if c == quote:
+                quote = None
+        elif c in ("'", '"', "`"):
+            quote = c
+        elif c == "[":
+            quote = "]"
+        elif c == "(":
+            depth += 1
+        elif c == ")":
+            depth -= 1
+        elif c == separator and depth == 0:
+            parts.append(text[start:i].strip())
+            start = i + 1
+    parts.append(text[start:].strip())
+    return [p for p in parts if p]
+
+
+def parse_select(sql: str) -> dict:
+    """Split a single SELECT statement into its top-level clauses"""
+    sql = sql.strip().rstrip(";").strip()
+    if ";" in sql:
+        raise FederationError("Only a single statement can be federated.")
+
+    positions = list(
+        _top_level_positions(sql, ["WITH"] + CLAUSES + ["UNION", "INTERSECT", "EXCEPT"])
+    )
+    if any(k in ("UNION", "INTERSECT", "EXCEPT") for _, k, _ in positions):
+        raise FederationError("Compound SELECT statements cannot be federated.")
+
+    select = [p for p in positions if p[1] == "SELECT"]
+    if not select:
+        raise FederationError("Only SELECT statements can be federated.")
+    # with a leading WITH clause, CTE bodies are parenthesized so the first top-level SELECT is the main one
+    main_start = select[0][0]
+    clauses = {"PREFIX": sql[:main_start].strip()}
+    ordered = [p for p in positions if p[0] >= main_start and p[1] in CLAUSES]
+    for index, (pos, keyword, length) in enumerate(ordered):
+        end = ordered[index + 1][0] if index + 1 < len(ordered) else len(sql)
+        if keyword in clauses:
+            raise FederationError(f"Unexpected repeated {keyword} clause.")
+        clauses[keyword] = sql[pos + length : end].strip()
+    return clauses
+
+
+def _parenthesized(code: str, start: int) -> str:
+    """Text from `start`, just past an opening parenthesis, up to its closing one"""
+    depth = 1
+    for end in range(start, len(code)):
+        depth += {"(": 1, ")": -1}.get(code[end], 0)
+        if depth == 0:
+            return code[start:end]
+    return code[start:]
+
+
+def _check_supported(sql: str, clauses: dict):
+    """Reject the shapes whose per-shard results cannot be merged.
+
+    Window functions, scalar MIN/MAX, and nested queries (subqueries, derived tables, CTEs)
+    that aggregate, deduplicate or limit their rows: each shard would compute them on its own rows.
+    """
+    code = LITERALS.sub("''", sql)
+    if re.search(r"\bOVER\b", code, re.IGNORECASE):
+        # windows (ranks, running totals) are computed over each shard's rows, not the union
+        raise FederationError("Window functions (OVER) cannot be federated.")
+    for match in NESTED_QUERY.finditer(code):
+        nested = _parenthesized(code, match.start() + 1)
+        if ANY_AGGREGATE.search(nested) or SHARD_LOCAL.search(nested):
+            raise FederationError(
+                "Subqueries, derived tables and CTEs with aggregates, DISTINCT, GROUP BY or LIMIT "
+                "cannot be federated, query each database on its own."
+            )
+    # elsewhere, e.g. in WHERE, a scalar MIN/MAX is evaluated row by row on the shards just fine
+    code = LITERALS.sub("''", " ".join(clauses.get(k, "") for k in ("SELECT", "HAVING", "ORDER BY")))
+    for match in MIN_MAX_CALL.finditer(code):
+        if len(split_top_level(_parenthesized(code, match.end()))) > 1:
+            raise FederationError(
+                f"{match.group(1).upper()} with several arguments is a scalar function, "
+                "it cannot be federated."
+            )
+
+
+def split_alias(item: str):
+    """Return (expression, alias) for a select list item"""
+    match = ALIAS.match(item)
+    if match:
+        expression, alias = match.group(1).strip(), match.group(2)
+        if (
+            expression
+            and not expression.endswith(tuple(".(+-*/%|=<>,"))
+            and alias.upper() not in NOT_ALIASES
+            and not TRAILING_OPERATOR.search(expression)
+        ):
+            return expression, alias.strip('"`[]')
+    return item.strip(), None
+
+
+def _quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _norm(expression: str) -> str:
+    return re.sub(r"\s+", "", expression).upper()
+
+
+# -------------------------- Decomposition --------------------------
+
+
+def decompose(sql: str) -> dict:
+    """Split a query into a query run on every shard and a merge query run on their union.
+
+    The merge query reads from a table named `partials` holding the concatenated shard results.
+    Decomposable aggregates (SUM, TOTAL, COUNT, MIN, MAX, and AVG as SUM/COUNT) are re-aggregated.
+    """
+    clauses = parse_select(sql)
+    _check_supported(sql, clauses)
+    select_list = clauses["SELECT"]
+    distinct = False
+    if re.match(r"^DISTINCT\b", select_list, re.IGNORECASE):
+        distinct = True
+        select_list = select_list[len("DISTINCT") :].strip()
+    elif re.match(r"^ALL\b", select_list, re.IGNORECASE):
+        select_list = select_list[len("ALL") :].strip()
+
+    items = [split_alias(item) for item in split_top_level(select_list)]
+    is_aggregate = "GROUP BY" in clauses or any(ANY_AGGREGATE.search(e) for e, _ in items)
+
+    limit = clauses.get("LIMIT")
+    if limit and re.search(r"\bOFFSET\b|,", limit, re.IGNORECASE):
+        raise FederationError("LIMIT with OFFSET cannot be federated.")
+
+    if not is_aggregate:
+        # plain rows: UNION ALL of the shards, push the LIMIT down, re-apply ordering on the union
+        shard = sql.strip().rstrip(";")
+        if "ORDER BY" in clauses and not limit:
+            shard = _without_clauses(sql, ["ORDER BY"])
+        output_names = [alias or _output_name(expression) for expression, alias in items]
+        merge = "SELECT DISTINCT * FROM partials" if distinct else "SELECT * FROM partials"
+        if "ORDER BY" in clauses:
+            merge += " ORDER BY " + _rewrite_order_by(clauses["ORDER BY"], items, output_names)
+        if limit:
+            merge += f" LIMIT {limit}"
+        return {"shard": shard, "merge": merge}
+
+    if distinct:
+        raise FederationError("SELECT DISTINCT with aggregates cannot be federated.")
+
+    group_terms = split_top_level(clauses.get("GROUP BY", ""))
+    shard_items = []
+    merge_items = []
+    substitutions = {}  # normalized original expression -> merge expression
+    for index, (expression, alias) in enumerate(items):
+        name = alias or expression
+        function, argument = _aggregate_call(expression)
+        if function in MERGE_FUNCTIONS or function == "AVG":
+            if re.match(r"^DISTINCT\b", argument, re.IGNORECASE) and function not in ("MIN", "MAX"):
+                raise FederationError(f"{function}(DISTINCT ...) cannot be federated.")
+            if function == "AVG":
+                shard_items.append(f"SUM({argument}) AS a{index}_s")
+                shard_items.append(f"COUNT({argument}) AS a{index}_c")
+                merged = f"(TOTAL(a{index}_s) / NULLIF(SUM(a{index}_c), 0))"
+            else:
+                shard_items.append(f"{expression} AS a{index}")
+                merged = f"{MERGE_FUNCTIONS[function]}(a{index})"
+        elif ANY_AGGREGATE.search(expression):
+            raise FederationError(
+                f"'{expression}' cannot be federated, select the aggregate on its own and compute the rest afterwards."
+            )
+        else:
+            shard_items.append(f"{expression} AS g{index}")
+            merged = f"g{index}"
+        merge_items.append(f"{merged} AS {_quote(_output_name(name))}")
+        substitutions[_norm(expression)] = merged
+        if alias:
+            substitutions[_norm(alias)] = merged
+
+    # shard aliases are renamed, so grouping terms are spelled out as expressions on the shards
+    expressions_by_alias = {_norm(a): e for e, a in items if a}
+    shard_group = []
+    merge_group = []
+    for term_index, term in enumerate(group_terms):
+        if term.isdigit() and 0 < int(term) <= len(items):
+            shard_group.append(items[int(term) - 1][0])
+            merge_group.append(f"g{int(term) - 1}")
+        elif _norm(term) in substitutions:
+            shard_group.append(expressions_by_alias.get(_norm(term), term))
+            merge_group.append(substitutions[_norm(term)])
+        else:
+            shard_group.append(term)
+            # grouped but not selected: carry it as a hidden column
+            shard_items.append(f"{term} AS h{term_index}")
+            merge_group.append(f"h{term_index}")
+
+    shard = ""
+    if clauses["PREFIX"]:
+        shard += clauses["PREFIX"] + " "
+    shard += "SELECT " + ", ".join(shard_items)
+    for keyword in ("FROM", "WHERE"):
+        if keyword in clauses:
+            shard += f" {keyword} {clauses[keyword]}"
+    if shard_group:
+        shard += " GROUP BY " + ", ".join(shard_group)
+
+    merge = "SELECT " + ", ".join(merge_items) + " FROM partials"
+    if merge_group:
+        merge += " GROUP BY " + ", ".join(merge_group)
+    if "HAVING" in clauses:
+        merge += " HAVING " + _substitute(clauses["HAVING"], substitutions)
+    if "ORDER BY" in clauses:
+        terms = []
+        for term in split_top_level(clauses["ORDER BY"]):
+            expression, direction = _split_direction(term)
+            if expression.isdigit():
+                terms.append(term)
+            else:
+                terms.append(_substitute(expression, substitutions) + direction)
+        merge += " ORDER BY " + ", ".join(terms)
+    if limit:
+        merge += f" LIMIT {limit}"
+    return {"shard": shard, "merge": merge}
+
+
+def _aggregate_call(expression: str):
+    """Return (FUNCTION, argument) when the whole expression is a single function call"""
+    match = re.match(r"^(\w+)\s*\(", expression.strip())
+    if not match or not expression.strip().endswith(")"):
+        return None, None
+    inner = expression.strip()[match.end() : -1]
+    depth = 0
+    for c in inner:
+        depth += {"(": 1, ")": -1}.get(c, 0)
+        if depth < 0:
+            # the opening parenthesis closes before the end, e.g. SUM(a) + SUM(b)
+            return None, None
+    return match.group(1).upper(), inner.strip()
+
+
+def _without_clauses(sql: str, keywords) -> str:
+    clauses = parse_select(sql)
+    result = (clauses["PREFIX"] + " " if clauses["PREFIX"] else "") + "SELECT " + clauses["SELECT"]
+    for keyword in CLAUSES[1:]:
+        if keyword in clauses and keyword not in keywords:
+            result += f" {keyword} {clauses[keyword]}"
+    return result
+
+
+def _output_name(expression: str) -> str:
+    # SQLite names a bare column reference after the column, anything else after its text
+    match = re.match(r"^(?:\w+\.)?(\"[^\"]+\"|`[^`]+`|\[[^\]]+\]|\w+)$", expression.strip())
+    return match.group(1).strip('"`[]') if match else expression.strip()
+
+
+def _split_direction(term: str):
+    match = re.match(r"^(.*?)(\s+(?:ASC|DESC)(?:\s+NULLS\s+(?:FIRST|LAST))?)?$", term.strip(), re.IGNORECASE | re.DOTALL)
+    return match.group(1).strip(), match.group(2) or ""
+
+
+def _substitute(expression: str, substitutions: dict) -> str:
+    """Replace selected expressions and aliases by their merge expressions"""
+    if _norm(expression) in substitutions:
+        return substitutions[_norm(expression)]
+    result = expression
+    for original, merged in sorted(substitutions.items(), key=lambda s: -len(s[0])):
+        # match the original expression as a whole term, ignoring whitespace differences
+        pattern = r"(?<![\w.])" + r"\s*".join(re.escape(c) for c in original) + r"(?!\w)"
+        result = re.sub(pattern, lambda _: merged, result, flags=re.IGNORECASE)
+    remaining = result
+    for merged in substitutions.values():
+        remaining = remaining.replace(merged, "")
+    if ANY_AGGREGATE.search(remaining):
+        raise FederationError(f"'{expression}' must reference selected columns to be federated.")
+    return result
+
+
+def _rewrite_order_by(order_by: str, items, output_names) -> str:
+    terms = []
+    for term in split_top_level(order_by):
+        expression, direction = _split_direction(term)
+        if expression.isdigit():
+            terms.append(term)
+            continue
+        candidates = {_norm(e): n for (e, _), n in zip(items, output_names)}
+        candidates.update({_norm(n): n for n in output_names})
+        name = candidates.get(_norm(expression)) or candidates.get(_norm(_output_name(expression)))
+        if name is None and any(e.endswith("*") for e, _ in items):
+            # columns expanded from a wildcard are only known once the shards ran
+            name = _output_name(expression)
+        if name is None:
+            raise FederationError(f"ORDER BY '{expression}' must reference a selected column to be federated.")
+        terms.append(_quote(name) + direction)
+    return ", ".join(terms)
+
+
+# -------------------------- Execution --------------------------
+
+
+def _run_shard(database, query: str):
+    with span("sql.shard", **{"db.name": database.name, "db.statement": query}) as shard_span:
+        conn = database.connect()
+        try:
+            cursor = conn.execute(query)
+            columns = [d[0] for d in cursor.description] if cursor.description else []
+            rows = cursor.fetchall()
+        finally:
+            untrack_connection(conn)
+            conn.close()
+        if shard_span is not None:
+            shard_span.set(**{"db.rows": len(rows)})
+        return columns, rows
+
+
+def run_federated(databases, query: str):
+    """Run `query` on every database in parallel and merge the partial results.
+
+    Returns (column names, rows). Raises FederationError or sqlite3.Error.
+    """
+    plan = decompose(query)
+    with ThreadPoolExecutor(max_workers=len(databases)) as executor:
+        # each shard runs in the caller's context so its connection can be cancelled with the run
+        futures = [
+            executor.submit(contextvars.copy_context().run, _run_shard, d, plan["shard"])
+            for d in databases
+        ]
+        partials = [future.result() for future in futures]
+
+    columns = partials[0][0]
+    merge_db = sqlite3.connect(":memory:")
+    try:
+        column_defs = ", ".join(_quote(f"{c}") for c in _unique(columns))
+        merge_db.execute(f"CREATE TABLE partials ({column_defs})")
+        placeholders = ", ".join("?" for _ in columns)
+        for _, rows in partials:
+            merge_db.executemany(f"INSERT INTO partials VALUES ({placeholders})", rows)
+        cursor = merge_db.execute(plan["merge"])
+        merged_columns = [d[0] for d in cursor.description]
+        return merged_columns, cursor.fetchall()
+    finally:
+        merge_db.close()
+
+
+def _unique(columns):
+    seen = {}
+    result = []
+    for column in columns:
+        count = seen.get(column, 0)
+        seen[column] = count + 1
+        result.append(column if count == 0 else f"{column}_{count}")
+    return result
@@ -1,15 +1,266 @@
+import asyncio
 import os
+import random
+import threading
+import time
+import weakref
+from collections import deque
 
+import httpx
 from dotenv import load_dotenv
-from langchain_openai import ChatOpenAI
+
+from utils.metrics import metrics
 
 
 load_dotenv()
 
 API_KEY = os.getenv("API_KEY")
+# point the clients at another server, e.g. a local mock of the OpenAI API
+BASE_URL = os.getenv("OPENAI_BASE_URL") or None
+
+DEFAULT_MODEL = "gpt-4.1-mini-2025-04-14"
+
+# model cascade: a small model explores the schema, a stronger one writes the final SQL and answer
+FAST_MODEL = os.getenv("FAST_MODEL", "gpt-4.1-nano-2025-04-14")
+STRONG_MODEL = os.getenv("STRONG_MODEL", DEFAULT_MODEL)
+
+# shared connection pool used by every model
+MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "100"))
+MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", "20"))
+KEEPALIVE_EXPIRY_SECONDS = 60.0
+REQUEST_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "60"))
+
+# per-model resilience settings
+MODEL_CONCURRENCY = int(os.getenv("LLM_MODEL_CONCURRENCY", "16"))
+MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+RETRY_BASE_SECONDS = 0.5
+RETRY_MAX_SECONDS = 8.0
+RETRY_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+# hedging: send a duplicate request once the first one is slower than the observed p95
+HEDGE_REQUESTS = os.getenv("LLM_HEDGE", "0") == "1"
+HEDGE_PERCENTILE = 0.95
+HEDGE_MIN_SAMPLES = 20
+LATENCY_WINDOW = 200
 
-llm = ChatOpenAI(
-    api_key=API_KEY,
-    temperature=0,
-    model="gpt-4.1-mini-2025-04-14",
+
+_limits = httpx.Limits(
+    max_connections=MAX_CONNECTIONS,
+    max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+    keepalive_expiry=KEEPALIVE_EXPIRY_SECONDS,
 )
+_pool_lock = threading.Lock()
+_sync_pool = None
+# asyncio connections belong to the loop that opened them, each event loop gets its own pool
+_async_pools = weakref.WeakKeyDictionary()
+
+
+def _shared_sync_pool() -> httpx.HTTPTransport:
+    global _sync_pool
+    with _pool_lock:
+        if _sync_pool is None:
+            _sync_pool = httpx.HTTPTransport(limits=_limits)
+        return _sync_pool
+
+
+def _shared_async_pool() -> httpx.AsyncHTTPTransport:
+    loop = asyncio.get_running_loop()
+    with _pool_lock:
+        if loop not in _async_pools:
+            _async_pools[loop] = httpx.AsyncHTTPTransport(limits=_limits)
+        return _async_pools[loop]
+
+
+class _LatencyTracker:
+    """Rolling window of successful request latencies for one model"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._samples = deque(maxlen=LATENCY_WINDOW)
+
+    def record(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def hedge_delay(self):
+        """Latency after which a duplicate request is sent, None until enough samples"""
+        with self._lock:
+            if len(self._samples) < HEDGE_MIN_SAMPLES:
+                return None
+            ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * HEDGE_PERCENTILE))]
+
+
+def _backoff_seconds(attempt: int, response=None) -> float:
+    """Exponential backoff with full jitter, honoring a numeric Retry-After header"""
+    if response is not None:
+        retry_after = response.headers.get("retry-after")
+        if retry_after:
+            try:
+                return min(float(retry_after), RETRY_MAX_SECONDS)
+            except ValueError:
+                pass
+    return random.uniform(0, min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * 2**attempt))
+
+
+def _should_read_body(response) -> bool:
+    # streamed completions are consumed by the caller, everything else is read while holding the slot
+    return "text/event-stream" not in response.headers.get("content-type", "")
+
+
+class _ModelTransport(httpx.BaseTransport, httpx.AsyncBaseTransport):
+    """Per-model layer over the shared pool: concurrency cap, retries and hedging.
+
+    The async cap is enforced per event loop, an asyncio semaphore being bound to one loop.
+    """
+
+    def __init__(self, model: str):
+        self.model = model
+        self.latency = _LatencyTracker()
+        self._sync_slots = threading.BoundedSemaphore(MODEL_CONCURRENCY)
+        self._slots_lock = threading.Lock()
+        self._async_slots = weakref.WeakKeyDictionary()
+
+    def _loop_slots(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        with self._slots_lock:
+            if loop not in self._async_slots:
+                self._async_slots[loop] = asyncio.Semaphore(MODEL_CONCURRENCY)
+            return self._async_slots[loop]
+
+    # -------------------------- sync --------------------------
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        for attempt in range(MAX_RETRIES + 1):
+            # the slot is released while backing off, other requests use it meanwhile
+            with self._sync_slots:
+                start = time.monotonic()
+                try:
+                    response = _shared_sync_pool().handle_request(request)
+                    if _should_read_body(response):
+                        response.read()
+                except httpx.TransportError:
+                    if attempt == MAX_RETRIES:
+                        metrics.inc("llm_requests_total", model=self.model, status="error")
+                        raise
+                    delay = _backoff_seconds(attempt)
+                else:
+                    if response.status_code not in RETRY_STATUS_CODES or attempt == MAX_RETRIES:
+                        return self._done(response, time.monotonic() - start)
+                    response.close()
+                    delay = _backoff_seconds(attempt, response)
+            metrics.inc("llm_retries_total", model=self.model)
+            time.sleep(delay)
+
+    # -------------------------- async --------------------------
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        for attempt in range(MAX_RETRIES + 1):
+            # the slot is released while backing off, other requests use it meanwhile
+            async with self._loop_slots():
+                start = time.monotonic()
+                try:
+                    response = await self._send_hedged(request)
+                except httpx.TransportError:
+                    if attempt == MAX_RETRIES:
+                        metrics.inc("llm_requests_total", model=self.model, status="error")
+                        raise
+                    delay = _backoff_seconds(attempt)
+                else:
+                    if response.status_code not in RETRY_STATUS_CODES or attempt == MAX_RETRIES:
+                        return self._done(response, time.monotonic() - start)
+                    await response.aclose()
+                    delay = _backoff_seconds(attempt, response)
+            metrics.inc("llm_retries_total", model=self.model)
+            await asyncio.sleep(delay)
+
+    async def _send(self, request: httpx.Request) -> httpx.Response:
+        response = await _shared_async_pool().handle_async_request(request)
+        if _should_read_body(response):
+            await response.aread()
+        return response
+
+    async def _send_hedged(self, request: httpx.Request) -> httpx.Response:
+        delay = self.latency.hedge_delay() if HEDGE_REQUESTS else None
+        if delay is None:
+            return await self._send(request)
+
+        first = asyncio.create_task(self._send(request))
+        tasks = {first}
+        winner = None
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if done:
+                winner = first
+                return first.result()
+
+            metrics.inc("llm_hedged_requests_total", model=self.model)
+            tasks.add(asyncio.create_task(self._send(request)))
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                # both copies may finish together, a failed one must not hide the other's response
+                for task in done:
+                    if task.exception() is None:
+                        winner = task
+                        return task.result()
+            # every copy failed
+            raise next(iter(done)).exception()
+        finally:
+            # the slower copy is abandoned, cancelling it closes its connection
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+                elif not task.cancelled() and task.exception() is None and task is not winner:
+                    # both copies succeeded together, the unused response is released
+                    await task.result().aclose()
+
+    def _done(self, response: httpx.Response, seconds: float) -> httpx.Response:
+        metrics.inc("llm_requests_total", model=self.model, status=str(response.status_code))
+        if response.status_code < 400:
+            self.latency.record(seconds)
+            metrics.observe("llm_request_seconds", seconds, model=self.model)
+        return response
+
+    def close(self):
+        # the shared pool outlives the clients built on top of it
+        pass
+
+    async def aclose(self):
+        pass
+
+
+_transports = {}
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def _model_transport(model: str) -> _ModelTransport:
+    if model not in _transports:
+        _transports[model] = _ModelTransport(model)
+    return _transports[model]
+
+
+def get_llm(model: str = DEFAULT_MODEL, api_key: str = None, **kwargs):
+    """Return the chat model for these settings, built once and sharing the pooled HTTP transport"""
+    # imported here: the OpenAI SDK is slow to import and only needed once a model is used
+    from langchain_openai import ChatOpenAI
+
+    api_key = api_key or API_KEY
+    key = (model, api_key, tuple(sorted(kwargs.items())))
+    with _clients_lock:
+        if key not in _clients:
+            transport = _model_transport(model)
+            kwargs.setdefault("timeout", REQUEST_TIMEOUT_SECONDS)
+            _clients[key] = ChatOpenAI(
+                api_key=api_key,
+                model=model,
+                base_url=BASE_URL,
+                # retries are handled by the transport, with jitter and the shared concurrency cap
+                max_retries=0,
+                http_client=httpx.Client(transport=transport),
+                http_async_client=httpx.AsyncClient(transport=transport),
+                **kwargs,
+            )
+        return _clients[key]
+
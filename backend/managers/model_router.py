@@ -0,0 +1,69 @@
+import os
+
+from langchain_core.messages import AIMessage, ToolMessage
+
+from managers.llm_manager import FAST_MODEL, STRONG_MODEL
+
+
+FAST = "fast"
+STRONG = "strong"
+MODELS = {FAST: FAST_MODEL, STRONG: STRONG_MODEL}
+
+CASCADE_ENABLED = os.getenv("MODEL_CASCADE", "1") == "1"
+# exploration turns allowed on the fast model before every turn escalates
+MAX_FAST_TURNS = int(os.getenv("MAX_FAST_TURNS", "6"))
+
+EXPLORATION_TOOLS = {
+    "ListTablesTool",
+    "DescribeTables",
+    "GetSampleRows",
+    "GetUniqueColumnValues",
+    "SearchValues",
+}
+
+
+def _latest_tool_results(messages):
+    """Tool messages answering the most recent LLM turn"""
+    results = []
+    for message in reversed(messages):
+        if not isinstance(message, ToolMessage):
+            break
+        results.append(message)
+    return results
+
+
+def choose_tier(state) -> tuple:
+    """Pick the model tier for the next LLM turn, returns (tier, reason)"""
+    if not CASCADE_ENABLED:
+        return STRONG, "cascade_disabled"
+    if state.get("grading_feedback"):
+        return STRONG, "grader_failure"
+
+    latest = _latest_tool_results(state["messages"])
+    queries = [m for m in latest if m.name == "ExecuteQuery"]
+    if any(str(m.content).startswith("Error") for m in queries):
+        return STRONG, "sql_error"
+    if queries:
+        return STRONG, "final_answer"
+
+    fast_turns = sum(1 for d in state.get("model_routing", []) if d["tier"] == FAST)
+    if fast_turns >= MAX_FAST_TURNS:
+        return STRONG, "exploration_budget"
+    return FAST, "exploration"
+
+
+def needs_escalation(result: AIMessage) -> bool:
+    """A fast turn is only kept when it keeps exploring the schema"""
+    tool_calls = getattr(result, "tool_calls", None) or []
+    if not tool_calls:
+        # final answer
+        return True
+    return any(tc["name"] not in EXPLORATION_TOOLS for tc in tool_calls)
+
+
+def token_usage(result: AIMessage) -> dict:
+    usage = getattr(result, "usage_metadata", None) or {}
+    return {
+        "input_tokens": usage.get("input_tokens", 0),
+        "output_tokens": usage.get("output_tokens", 0),
+    }
@@ -0,0 +1,43 @@
+import os
+from datetime import datetime
+
+
+PROMPTS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "system_prompts")
+PROMPT_MODES = ("business", "technical")
+DEFAULT_PROMPT_MODE = os.getenv("DEFAULT_PROMPT_MODE", "business")
+
+# cookie remembering the mode picked by a browser session, so any worker can serve it
+PROMPT_MODE_COOKIE = "prompt_mode"
+
+
+class PromptManager:
+    """System prompt templates, read once and shared by every request"""
+
+    def __init__(self, prompts_dir: str, modes, default: str):
+        if default not in modes:
+            raise ValueError(f"DEFAULT_PROMPT_MODE must be one of: {', '.join(modes)}")
+        self.prompts_dir = prompts_dir
+        self.modes = tuple(modes)
+        self.default = default
+        self._templates = {}
+
+    def load(self):
+        """Read every template; called at import so preloaded workers share them"""
+        for mode in self.modes:
+            with open(os.path.join(self.prompts_dir, f"{mode}.md"), encoding="utf-8") as f:
+                self._templates[mode] = f.read()
+
+    def resolve(self, *candidates) -> str:
+        """First valid mode among the candidates (request, session...), else the default"""
+        for mode in candidates:
+            if mode in self.modes:
+                return mode
+        return self.default
+
+    def render(self, mode: str) -> str:
+        template = self._templates[self.resolve(mode)]
+        return template.format(today=datetime.now().strftime("%Y-%m-%d"))
+
+
+prompt_manager = PromptManager(PROMPTS_DIR, PROMPT_MODES, DEFAULT_PROMPT_MODE)
+prompt_manager.load()
@@ -0,0 +1,45 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+# executed queries are kept around so their full result can be fetched again later
+QUERY_TTL_SECONDS = 60 * 60
+MAX_QUERIES = 1_000
+
+
+class QueryManager:
+    """Remembers the SQL executed at each conversation step, keyed by the tool call ID"""
+
+    def __init__(self, ttl: float, max_queries: int):
+        self.ttl = ttl
+        self.max_queries = max_queries
+        self._lock = threading.Lock()
+        self._queries = OrderedDict()
+
+    def register(self, query_id: str, sql: str, database: str = ""):
+        if not query_id:
+            return
+        with self._lock:
+            self._queries[query_id] = {
+                "sql": sql,
+                "database": database,
+                "created": time.monotonic(),
+            }
+            self._queries.move_to_end(query_id)
+            while len(self._queries) > self.max_queries:
+                self._queries.popitem(last=False)
+
+    def get(self, query_id: str):
+        """Return the registered query, or None if unknown or expired"""
+        with self._lock:
+            query = self._queries.get(query_id)
+            if query is None:
+                return None
+            if time.monotonic() - query["created"] > self.ttl:
+                del self._queries[query_id]
+                return None
+            return query
+
+
+query_manager = QueryManager(QUERY_TTL_SECONDS, MAX_QUERIES)
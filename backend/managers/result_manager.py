@@ -0,0 +1,307 @@
+import itertools
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from managers.db_manager import registry
+from utils.cancellation import untrack_connection
+from utils.timeseries import MAX_SERIES_ROWS, SERIES_CHUNK_ROWS, downsample
+from utils.worker_files import remove_stale_worker_files, worker_path
+
+
+RESULT_TTL_SECONDS = 15 * 60
+# rows of a single result kept in memory, larger results are spilled to a side file when browsed
+MAX_RESULT_BYTES = 8 * 1024 * 1024
+SPILL_PATH = "database/results.db"
+SPILL_CHUNK_ROWS = 5_000
+# rows kept in memory across all results, least recently used results are evicted first
+MAX_TOTAL_BYTES = 128 * 1024 * 1024
+MAX_PAGE_ROWS = 1_000
+
+
+def _row_size(row) -> int:
+    # rough footprint: tuple overhead plus payload of each value
+    return 56 + sum(len(v) if isinstance(v, (str, bytes)) else 16 for v in row)
+
+
+class _SpillStore:
+    """Results too large for memory, copied once into a side SQLite file of this worker.
+
+    Each result gets a table whose rowids are the row positions, so any page is a range
+    lookup instead of re-running the query and skipping its prefix.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = None
+        self._conn_pid = None
+        self._ids = itertools.count()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None or self._conn_pid != os.getpid():
+            # a forked worker starts afresh, the tables it inherited live in its parent's file
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            remove_stale_worker_files(self.path)
+            path = worker_path(self.path, os.getpid())
+            if os.path.exists(path):
+                os.remove(path)
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=OFF")
+            self._conn.execute("PRAGMA synchronous=OFF")
+            self._conn_pid = os.getpid()
+        return self._conn
+
+    def spill(self, database, sql: str) -> str:
+        """Run `sql` once on `database` and copy its rows into a new table, returns the table name"""
+        table = f"result_{next(self._ids)}"
+        source = database.connect()
+        try:
+            cursor = source.execute(sql)
+            width = len(cursor.description)
+            insert = f"INSERT INTO {table} VALUES ({', '.join('?' for _ in range(width))})"
+            with self._lock:
+                conn = self._connect()
+                conn.execute(f"CREATE TABLE {table} ({', '.join(f'c{i}' for i in range(width))})")
+            try:
+                while True:
+                    rows = cursor.fetchmany(SPILL_CHUNK_ROWS)
+                    if not rows:
+                        break
+                    with self._lock:
+                        conn.executemany(insert, rows)
+                with self._lock:
+                    conn.commit()
+            except Exception:
+                self.drop(table)
+                raise
+        finally:
+            untrack_connection(source)
+            source.close()
+        return table
+
+    def page(self, table: str, offset: int, limit: int):
+        with self._lock:
+            try:
+                return self._connect().execute(
+                    f"SELECT * FROM {table} WHERE rowid > ? ORDER BY rowid LIMIT ?", (offset, limit)
+                ).fetchall()
+            except sqlite3.OperationalError:
+                # dropped meanwhile, the result expired
+                return []
+
+    def drop(self, table: str):
+        with self._lock:
+            if self._conn is not None and self._conn_pid == os.getpid():
+                self._conn.execute(f"DROP TABLE IF EXISTS {table}")
+                self._conn.commit()
+
+
+spill_store = _SpillStore(SPILL_PATH)
+
+
+class ResultHandle:
+    """A query result browsable by pages, held in memory or spilled to a side file.
+
+    The rows past the memory budget are copied to the spill store the first time they are
+    browsed, running the query once; no connection to the source stays open between pages.
+    """
+
+    def __init__(self, query_id: str, sql: str, databases, columns):
+        self.query_id = query_id
+        self.sql = sql.strip().rstrip(";")
+        self.databases = databases
+        self.columns = columns
+        self.rows = []
+        self.total = 0
+        self.nbytes = 0
+        self.complete = True
+        # time and value columns when the result is a time series, see `utils.timeseries`
+        self.series = None
+        self.last_access = time.monotonic()
+        # serializes the spill, pages wait for it instead of running the query again
+        self._lock = threading.Lock()
+        self._spill_table = None
+        self._closed = False
+
+    def page(self, offset: int, limit: int):
+        self.last_access = time.monotonic()
+        if offset + limit <= len(self.rows) or self.complete:
+            return self.rows[offset : offset + limit]
+        return self._page_from_source(offset, limit)
+
+    def _page_from_source(self, offset: int, limit: int):
+        if len(self.databases) > 1:
+            if offset < len(self.rows):
+                return self.rows[offset : offset + limit]
+            raise ValueError(self._federated_limit())
+
+        with self._lock:
+            if self._spill_table is None and not self._closed:
+                self._spill_table = spill_store.spill(self.databases[0], self.sql)
+                if self._closed:
+                    # discarded while spilling
+                    spill_store.drop(self._spill_table)
+            table = self._spill_table
+        if self._closed:
+            return []
+        return spill_store.page(table, offset, limit)
+
+    def _federated_limit(self) -> str:
+        # re-running every shard and merging for each page would cost the whole query each time
+        return (
+            f"Only the first {len(self.rows)} rows of this result are browsable, "
+            "it was merged from several databases"
+        )
+
+    def iter_chunks(self, size: int):
+        """Yield the whole result in lists of `size` rows, without holding more than one chunk"""
+        self.last_access = time.monotonic()
+        if self.complete:
+            for start in range(0, len(self.rows), size):
+                yield self.rows[start : start + size]
+            return
+        if len(self.databases) > 1:
+            raise ValueError(self._federated_limit())
+        if self._spill_table is not None:
+            for start in range(0, self.total, size):
+                yield spill_store.page(self._spill_table, start, size)
+            return
+        # a connection of its own, closed as soon as the result has been read
+        conn = self.databases[0].connect()
+        try:
+            cursor = conn.execute(self.sql)
+            while True:
+                rows = cursor.fetchmany(size)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            untrack_connection(conn)
+            conn.close()
+
+    def close(self):
+        """Drop the spilled rows, if any; a spill in progress drops them once done"""
+        self._closed = True
+        if self._spill_table is not None:
+            spill_store.drop(self._spill_table)
+
+
+class ResultManager:
+    """Result handles keyed by query ID, bounded by a TTL and a memory budget"""
+
+    def __init__(self, ttl: float, max_result_bytes: int, max_total_bytes: int):
+        self.ttl = ttl
+        self.max_result_bytes = max_result_bytes
+        self.max_total_bytes = max_total_bytes
+        self._lock = threading.Lock()
+        self._handles = OrderedDict()
+        self._nbytes = 0
+
+    def register(self, query_id: str, sql: str, databases, columns, rows, preview_rows: int):
+        """Consume `rows`, keeping what fits in the budget, and return (preview, total row count)"""
+        handle = ResultHandle(query_id, sql, databases, columns)
+        preview = []
+        for row in rows:
+            if handle.total < preview_rows:
+                preview.append(row)
+            if handle.complete:
+                size = _row_size(row)
+                if handle.nbytes + size > self.max_result_bytes:
+                    # too large to keep, later pages are read from the database
+                    handle.complete = False
+                else:
+                    handle.rows.append(row)
+                    handle.nbytes += size
+            handle.total += 1
+
+        self._store(handle)
+        return preview, handle.total
+
+    def register_unread(self, query_id: str, sql: str, databases, columns, total: int):
+        """Register a result known only by its row count, every page being read from the database"""
+        handle = ResultHandle(query_id, sql, databases, columns)
+        handle.total = total
+        handle.complete = False
+        self._store(handle)
+
+    def _store(self, handle: ResultHandle):
+        if not handle.query_id:
+            return
+        with self._lock:
+            previous = self._handles.pop(handle.query_id, None)
+            if previous is not None:
+                self._discard(previous)
+            self._handles[handle.query_id] = handle
+            self._nbytes += handle.nbytes
+            self._evict()
+
+    def get(self, query_id: str):
+        with self._lock:
+            self._evict()
+            handle = self._handles.get(query_id)
+            if handle is not None:
+                self._handles.move_to_end(query_id)
+            return handle
+
+    def page(self, query_id: str, offset: int, limit: int):
+        """Return a page of the result as a dict, or None if the handle is unknown or expired.
+
+        Raises ValueError past the rows kept in memory of a result merged from several databases.
+        """
+        handle = self.get(query_id)
+        if handle is None:
+            return None
+        limit = max(0, min(limit, MAX_PAGE_ROWS))
+        rows = handle.page(max(0, offset), limit)
+        return {
+            "queryId": query_id,
+            "columns": handle.columns,
+            "rows": [list(row) for row in rows],
+            "offset": offset,
+            "total": handle.total,
+        }
+
+    def series(self, query_id: str, points: int, method: str):
+        """Return the result downsampled for a chart, or None if the handle is unknown or expired.
+
+        Raises ValueError when the result is not a time series, too large to plot,
+        or merged from several databases and too large to be kept in memory.
+        """
+        handle = self.get(query_id)
+        if handle is None:
+            return None
+        if handle.series is None:
+            raise ValueError("This result is not a time series")
+        if handle.total > MAX_SERIES_ROWS:
+            raise ValueError(f"Results of more than {MAX_SERIES_ROWS} rows cannot be plotted")
+        chunks = handle.iter_chunks(SERIES_CHUNK_ROWS)
+        return {"queryId": query_id, **downsample(chunks, handle.series, points, method)}
+
+    def on_snapshot_swap(self, database):
+        """Drop the results read from the previous snapshot, their pages would mix both versions"""
+        with self._lock:
+            for query_id, handle in list(self._handles.items()):
+                if database in handle.databases:
+                    del self._handles[query_id]
+                    self._discard(handle)
+
+    def _discard(self, handle: ResultHandle):
+        self._nbytes -= handle.nbytes
+        handle.close()
+
+    def _evict(self):
+        now = time.monotonic()
+        for query_id, handle in list(self._handles.items()):
+            expired = now - handle.last_access > self.ttl
+            if expired or self._nbytes > self.max_total_bytes:
+                del self._handles[query_id]
+                self._discard(handle)
+            else:
+                break
+
+
+result_manager = ResultManager(RESULT_TTL_SECONDS, MAX_RESULT_BYTES, MAX_TOTAL_BYTES)
+registry.on_swap(result_manager.on_snapshot_swap)
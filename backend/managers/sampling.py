@@ -0,0 +1,263 @@
+import math
+import os
+import re
+import sqlite3
+
+from managers.federation import (
+    ANY_AGGREGATE,
+    FederationError,
+    _aggregate_call,
+    _output_name,
+    _quote,
+    _rewrite_order_by,
+    _split_direction,
+    parse_select,
+    split_alias,
+    split_top_level,
+)
+from utils.cancellation import untrack_connection
+
+
+class ApproximationError(ValueError):
+    """Raised when a query cannot be estimated from a sample"""
+
+
+# rowids drawn at random from a table, the sample holds at most that many rows
+SAMPLE_ROWS = int(os.getenv("APPROX_SAMPLE_ROWS", "20000"))
+# below that many rows, the exact query is cheap enough
+MIN_APPROXIMATE_ROWS = int(os.getenv("APPROX_MIN_ROWS", "100000"))
+# precomputed (e.g. stratified) sample of table T: table T_sample, each row carrying its weight
+SAMPLE_TABLE_SUFFIX = "_sample"
+WEIGHT_COLUMN = "sample_weight"
+Z_95 = 1.96
+
+TABLE_REFERENCE = re.compile(
+    r"^(\"[^\"]+\"|`[^`]+`|\[[^\]]+\]|\w+)(?:\s+(?:AS\s+)?(\w+))?$", re.IGNORECASE
+)
+
+
+def _source_table(clauses: dict):
+    """Return (table, alias) of a query reading a single table"""
+    if clauses.get("PREFIX"):
+        raise ApproximationError("Approximate mode does not support WITH clauses.")
+    match = TABLE_REFERENCE.match(clauses.get("FROM", "").strip())
+    if not match:
+        raise ApproximationError("Approximate mode only supports queries reading a single table, without joins.")
+    return match.group(1).strip('"`[]'), match.group(2)
+
+
+def _sampled_source(conn: sqlite3.Connection, table: str):
+    """Return (source SQL with a weight column, description of the sample), or None for small tables"""
+    tables = {
+        row[0].lower(): row[0]
+        for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+    }
+    sample_table = tables.get((table + SAMPLE_TABLE_SUFFIX).lower())
+    if sample_table is not None:
+        columns = [row[1] for row in conn.execute(f"PRAGMA table_info({_quote(sample_table)})")]
+        if WEIGHT_COLUMN in columns:
+            sample_rows = conn.execute(f"SELECT COUNT(*) FROM {_quote(sample_table)}").fetchone()[0]
+            return (
+                f"SELECT * FROM {_quote(sample_table)}",
+                f"the precomputed sample table {sample_table} ({sample_rows} rows)",
+            )
+
+    try:
+        low, high = conn.execute(f"SELECT MIN(rowid), MAX(rowid) FROM {_quote(table)}").fetchone()
+    except sqlite3.Error:
+        raise ApproximationError(f"Table {table} has no rowid to sample from.")
+    if low is None or high - low + 1 <= MIN_APPROXIMATE_ROWS:
+        return None
+
+    # draws with replacement, so each rowid is sampled with probability 1 - (1 - 1/R)^k
+    span = high - low + 1
+    probability = 1 - (1 - 1 / span) ** SAMPLE_ROWS
+    source = (
+        f"WITH RECURSIVE draws(n, id) AS ("
+        f"SELECT 1, {low} + abs(random()) % {span} UNION ALL "
+        f"SELECT n + 1, {low} + abs(random()) % {span} FROM draws WHERE n < {SAMPLE_ROWS}) "
+        f"SELECT *, {1 / probability!r} AS {WEIGHT_COLUMN} FROM {_quote(table)} "
+        f"WHERE rowid IN (SELECT id FROM draws)"
+    )
+    return source, f"a random sample of {probability:.2%} of the {span} rowids of {table}"
+
+
+def _plan(clauses: dict):
+    """Translate the select list into sample moments.
+
+    Returns (select items, sample items, estimators, group terms).
+    """
+    select_list = clauses["SELECT"]
+    if re.match(r"^DISTINCT\b", select_list, re.IGNORECASE):
+        raise ApproximationError("SELECT DISTINCT cannot be approximated.")
+    if "HAVING" in clauses:
+        raise ApproximationError("HAVING cannot be approximated, filter the estimates afterwards.")
+    items = [split_alias(item) for item in split_top_level(select_list)]
+
+    weight = WEIGHT_COLUMN
+    sample_items = ["COUNT(*) AS n"]
+    estimators = []
+    for index, (expression, alias) in enumerate(items):
+        function, argument = _aggregate_call(expression)
+        if function is None and not ANY_AGGREGATE.search(expression):
+            sample_items.append(f"{expression} AS g{index}")
+            estimators.append(("group", index))
+            continue
+        if function not in ("COUNT", "SUM", "TOTAL", "AVG", "MIN", "MAX") or re.match(
+            r"^DISTINCT\b", argument, re.IGNORECASE
+        ):
+            raise ApproximationError(
+                f"'{expression}' cannot be approximated, only COUNT, SUM, AVG, MIN and MAX of plain expressions."
+            )
+        if function == "COUNT":
+            value = "1" if argument == "*" else f"CASE WHEN ({argument}) IS NOT NULL THEN 1 END"
+        else:
+            value = f"({argument})"
+        if function in ("MIN", "MAX"):
+            # extremes of the sample only bound the true ones
+            sample_items.append(f"{function}({argument}) AS a{index}")
+            estimators.append(("extreme", index))
+        elif function == "AVG":
+            sample_items += [
+                f"SUM(CASE WHEN {value} IS NOT NULL THEN {weight} END) AS a{index}_w",
+                f"SUM({weight} * {value}) AS a{index}_s",
+                f"SUM({weight} * {value} * {value}) AS a{index}_ss",
+                f"COUNT({value}) AS a{index}_n",
+            ]
+            estimators.append(("mean", index))
+        else:
+            # Horvitz-Thompson estimate of the total and of its variance
+            sample_items += [
+                f"SUM({weight} * {value}) AS a{index}_s",
+                f"SUM({weight} * ({weight} - 1) * {value} * {value}) AS a{index}_v",
+            ]
+            estimators.append(("count" if function == "COUNT" else "total", index))
+
+    expressions_by_alias = {alias.upper(): e for e, alias in items if alias}
+    group_terms = []
+    for term in split_top_level(clauses.get("GROUP BY", "")):
+        if term.isdigit() and 0 < int(term) <= len(items):
+            group_terms.append(items[int(term) - 1][0])
+        else:
+            group_terms.append(expressions_by_alias.get(term.strip('"`[]').upper(), term))
+    return items, sample_items, estimators, group_terms
+
+
+def _significant(value, digits: int = 6):
+    # the sampling error dwarfs the digits beyond that, they only cost tokens
+    return float(f"{value:.{digits}g}") if isinstance(value, float) else value
+
+
+def _estimate(row: dict, kind: str, index: int):
+    """Return (estimate, low, high) of an aggregate from the sample moments of its group"""
+    if kind == "extreme":
+        return row[f"a{index}"], None, None
+    if kind == "mean":
+        weights, total, squares, count = (row[f"a{index}_{k}"] for k in ("w", "s", "ss", "n"))
+        if not weights:
+            return None, None, None
+        mean = total / weights
+        variance = max(squares / weights - mean * mean, 0.0)
+        margin = Z_95 * math.sqrt(variance / count) if count > 1 else None
+    else:
+        estimate, variance = row[f"a{index}_s"] or 0.0, row[f"a{index}_v"] or 0.0
+        mean = round(estimate) if kind == "count" else estimate
+        margin = Z_95 * math.sqrt(variance)
+    if margin is None:
+        return _significant(mean), None, None
+    if kind == "count":
+        return mean, max(0, math.floor(mean - margin)), math.ceil(mean + margin)
+    return _significant(mean), _significant(mean - margin), _significant(mean + margin)
+
+
+def run_approximate(database, sql: str):
+    """Estimate the result of an aggregate query from a sample of its table.
+
+    Returns (columns, rows, note) where each estimated aggregate is followed by the bounds of its
+    95% confidence interval, or None when the table is small enough to run the exact query.
+    Raises ApproximationError or sqlite3.Error.
+    """
+    try:
+        clauses = parse_select(sql)
+    except FederationError as e:
+        raise ApproximationError(str(e))
+    table, alias = _source_table(clauses)
+    items, sample_items, estimators, group_terms = _plan(clauses)
+    if not any(kind != "group" for kind, _ in estimators):
+        raise ApproximationError("Approximate mode only applies to aggregate queries.")
+    limit = clauses.get("LIMIT")
+    if limit and re.search(r"\bOFFSET\b|,", limit, re.IGNORECASE):
+        raise ApproximationError("LIMIT with OFFSET cannot be approximated.")
+
+    conn = database.connect()
+    try:
+        sampled = _sampled_source(conn, table)
+        if sampled is None:
+            return None
+        source, description = sampled
+        query = f"SELECT {', '.join(sample_items)} FROM ({source}) AS {_quote(alias or table)}"
+        if "WHERE" in clauses:
+            query += f" WHERE {clauses['WHERE']}"
+        if group_terms:
+            query += " GROUP BY " + ", ".join(group_terms)
+        cursor = conn.execute(query)
+        names = [d[0] for d in cursor.description]
+        groups = [dict(zip(names, row)) for row in cursor.fetchall()]
+    finally:
+        untrack_connection(conn)
+        conn.close()
+
+    output_names = [alias or _output_name(expression) for expression, alias in items]
+    columns = []
+    for (kind, index), name in zip(estimators, output_names):
+        columns.append(name)
+        if kind in ("count", "total", "mean"):
+            columns += [f"{name}_ci_low", f"{name}_ci_high"]
+    rows = []
+    for group in groups:
+        row = []
+        for kind, index in estimators:
+            if kind == "group":
+                row.append(group[f"g{index}"])
+                continue
+            estimate, low, high = _estimate(group, kind, index)
+            row.append(estimate)
+            if kind != "extreme":
+                row += [low, high]
+        rows.append(tuple(row))
+
+    # ordering and limit apply to the estimates
+    if "ORDER BY" in clauses or limit:
+        merge_db = sqlite3.connect(":memory:")
+        try:
+            merge_db.execute(f"CREATE TABLE estimates ({', '.join(_quote(c) for c in columns)})")
+            merge_db.executemany(
+                f"INSERT INTO estimates VALUES ({', '.join('?' for _ in columns)})", rows
+            )
+            merge = "SELECT * FROM estimates"
+            if "ORDER BY" in clauses:
+                # positions refer to the select list, the estimates add interval columns between them
+                order_by = []
+                for term in split_top_level(clauses["ORDER BY"]):
+                    expression, direction = _split_direction(term)
+                    if expression.isdigit() and 0 < int(expression) <= len(output_names):
+                        term = _quote(output_names[int(expression) - 1]) + direction
+                    order_by.append(term)
+                try:
+                    merge += " ORDER BY " + _rewrite_order_by(", ".join(order_by), items, output_names)
+                except FederationError as e:
+                    raise ApproximationError(str(e))
+            if limit:
+                merge += f" LIMIT {limit}"
+            rows = merge_db.execute(merge).fetchall()
+        finally:
+            merge_db.close()
+
+    sample_size = sum(group["n"] for group in groups)
+    note = (
+        f"APPROXIMATE RESULT estimated from {description}, {sample_size} sampled rows matched. "
+        "Columns ending in _ci_low/_ci_high bound each estimate with 95% confidence; MIN/MAX are "
+        "those of the sample and groups too rare to be sampled are missing. "
+        "Tell the user these figures are estimates."
+    )
+    return columns, rows, note
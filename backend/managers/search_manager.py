@@ -0,0 +1,276 @@
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # no file locks on Windows, where a single worker process serves
+    fcntl = None
+
+from managers.db_manager import FEDERATED, registry
+from utils.logger import log_other
+
+
+SEARCH_INDEX_DIR = "database/search"
+# columns to index as table.column pairs, all text columns when empty
+SEARCH_COLUMNS = [c.strip() for c in os.getenv("SEARCH_COLUMNS", "").split(",") if c.strip()]
+# columns with more distinct values hold free text rather than entity names, they are skipped
+MAX_DISTINCT_VALUES = int(os.getenv("SEARCH_MAX_DISTINCT", "200000"))
+MAX_SEARCH_RESULTS = 20
+# the trigram tokenizer only uses its index for terms of at least that many characters
+MIN_INDEXED_TERM = 3
+# a failed build is retried after that many seconds, doubling up to MAX_RETRY_SECONDS
+RETRY_SECONDS = float(os.getenv("SEARCH_RETRY_SECONDS", "30"))
+MAX_RETRY_SECONDS = 600
+
+TEXT_TYPES = ("CHAR", "CLOB", "TEXT", "STRING")
+
+
+def _quote(identifier: str) -> str:
+    return '"' + identifier.replace('"', '""') + '"'
+
+
+@contextmanager
+def _build_lock(path: str):
+    """Held while an index is built, so the worker processes of a host build it only once"""
+    if fcntl is None:
+        yield
+        return
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(f"{path}.lock", "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+class SearchIndex:
+    """FTS5 trigram index of the distinct values of the text columns of one database, in a side file.
+
+    Each row holds a value with the table and column it comes from and its number of occurrences.
+    The index is rebuilt into a temporary file then renamed over the previous one, so searches
+    never see a partial index.
+    """
+
+    def __init__(self, database, index_dir: str):
+        self.database = database
+        self.path = os.path.join(index_dir, f"{database.name}.db")
+
+    def _source_identity(self) -> str:
+        stat = os.stat(self.database.path)
+        return f"{stat.st_ino}:{stat.st_size}:{stat.st_mtime_ns}"
+
+    def is_current(self) -> bool:
+        """True when the index was built from the current version of the source file"""
+        if not os.path.exists(self.path):
+            return False
+        try:
+            conn = self.connect()
+            try:
+                built_from = conn.execute("SELECT value FROM index_meta WHERE key = 'source'").fetchone()
+            finally:
+                conn.close()
+        except sqlite3.Error:
+            return False
+        return built_from is not None and built_from[0] == self._source_identity()
+
+    def connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(f"file:{os.path.abspath(self.path)}?mode=ro", uri=True)
+
+    def _columns(self, conn: sqlite3.Connection):
+        tables = [
+            row[0]
+            for row in conn.execute(
+                "SELECT name FROM src.sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'"
+            )
+        ]
+        selected = {c.lower() for c in SEARCH_COLUMNS}
+        for table in tables:
+            for _, column, declared_type, *_ in conn.execute(f"PRAGMA src.table_info({_quote(table)})"):
+                if selected:
+                    if f"{table}.{column}".lower() in selected:
+                        yield table, column
+                elif any(t in (declared_type or "").upper() for t in TEXT_TYPES):
+                    yield table, column
+
+    def build(self):
+        """Index the distinct values of the selected columns, replacing the previous index"""
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        identity = self._source_identity()
+        temporary = f"{self.path}.{os.getpid()}.tmp"
+        if os.path.exists(temporary):
+            os.remove(temporary)
+
+        conn = sqlite3.connect(temporary)
+        try:
+            conn.execute(
+                "ATTACH DATABASE ? AS src",
+                (f"file:{os.path.abspath(self.database.path)}?mode=ro",),
+            )
+            conn.execute(
+                "CREATE VIRTUAL TABLE value_index USING fts5("
+                "value, table_name UNINDEXED, column_name UNINDEXED, occurrences UNINDEXED, "
+                "tokenize = 'trigram')"
+            )
+            conn.execute("CREATE TABLE index_meta (key TEXT PRIMARY KEY, value TEXT)")
+            indexed = 0
+            for table, column in list(self._columns(conn)):
+                source = f"src.{_quote(table)}"
+                distinct = conn.execute(
+                    f"SELECT COUNT(DISTINCT {_quote(column)}) FROM {source}"
+                ).fetchone()[0]
+                if distinct > MAX_DISTINCT_VALUES:
+                    log_other(f"Search index skips {table}.{column}: {distinct} distinct values")
+                    continue
+                conn.execute(
+                    f"INSERT INTO value_index (value, table_name, column_name, occurrences) "
+                    f"SELECT CAST({_quote(column)} AS TEXT), ?, ?, COUNT(*) FROM {source} "
+                    f"WHERE {_quote(column)} IS NOT NULL GROUP BY {_quote(column)}",
+                    (table, column),
+                )
+                indexed += 1
+            conn.execute("INSERT INTO value_index (value_index) VALUES ('optimize')")
+            conn.execute("INSERT INTO index_meta VALUES ('source', ?)", (identity,))
+            conn.commit()
+            conn.execute("DETACH DATABASE src")
+        except Exception:
+            conn.close()
+            os.remove(temporary)
+            raise
+        conn.close()
+        os.replace(temporary, self.path)
+        log_other(f"Built search index of {self.database.name} ({indexed} columns)")
+
+    def search(self, term: str, limit: int):
+        """Return (table, column, value, occurrences) rows matching `term`, best matches first"""
+        conn = self.connect()
+        try:
+            if len(term) >= MIN_INDEXED_TERM:
+                # a quoted phrase matches the term as a substring, case-insensitively
+                condition, argument = "value_index MATCH ?", '"' + term.replace('"', '""') + '"'
+            else:
+                condition, argument = "value LIKE ?", f"%{term}%"
+            return conn.execute(
+                f"SELECT table_name, column_name, value, occurrences FROM value_index "
+                f"WHERE {condition} "
+                f"ORDER BY lower(value) = lower(?) DESC, lower(value) LIKE lower(?) || '%' DESC, "
+                f"length(value), occurrences DESC LIMIT ?",
+                (argument, term, term, limit),
+            ).fetchall()
+        finally:
+            conn.close()
+
+
+class SearchManager:
+    """Keeps a search index per database, built in the background when missing or stale.
+
+    The index files are shared by the worker processes of a host: the first worker to
+    take the build lock of an index builds it, the others find it current once they get the lock.
+    """
+
+    def __init__(self, index_dir: str):
+        self.indexes = {
+            name: SearchIndex(database, index_dir) for name, database in registry.databases.items()
+        }
+        self._lock = threading.Lock()
+        self._building = set()
+        # swapped while being built, the build in progress may have read the previous file
+        self._stale = set()
+        self._ready = set()
+        self._failed = {}  # name -> error of the last build, until one succeeds
+        self._retries = {}  # name -> consecutive failed builds
+        # threads do not survive a fork, each worker process checks the indexes itself
+        self._started_pid = None
+
+    def start(self):
+        """Build the missing or stale indexes in the background, once per process"""
+        if self._started_pid == os.getpid():
+            return
+        with self._lock:
+            if self._started_pid == os.getpid():
+                return
+            self._started_pid = os.getpid()
+            self._building.clear()
+            self._stale.clear()
+            self._ready.clear()
+            self._failed.clear()
+            self._retries.clear()
+        for name in self.indexes:
+            self._schedule(name)
+
+    def _schedule(self, name: str):
+        with self._lock:
+            if name in self._building:
+                self._stale.add(name)
+                return
+            self._building.add(name)
+        threading.Thread(target=self._refresh, args=(name,), daemon=True).start()
+
+    def _refresh(self, name: str):
+        index = self.indexes[name]
+        while True:
+            failed = False
+            try:
+                with _build_lock(index.path):
+                    # another worker may have built it while this one waited for the lock
+                    if not index.is_current():
+                        index.build()
+                with self._lock:
+                    self._failed.pop(name, None)
+                    self._retries.pop(name, None)
+                    if name not in self._stale:
+                        self._ready.add(name)
+            except Exception as e:
+                log_other(f"Could not build the search index of {name}: {e}")
+                failed = True
+                with self._lock:
+                    self._failed[name] = str(e)
+                    self._retries[name] = self._retries.get(name, 0) + 1
+                    delay = min(RETRY_SECONDS * 2 ** (self._retries[name] - 1), MAX_RETRY_SECONDS)
+            with self._lock:
+                if name not in self._stale:
+                    self._building.discard(name)
+                    break
+                self._stale.discard(name)
+        if failed:
+            retry = threading.Timer(delay, self._schedule, args=(name,))
+            retry.daemon = True
+            retry.start()
+
+    def on_snapshot_swap(self, database):
+        """Reindex a database once a new snapshot of it is served"""
+        if database.name in self.indexes:
+            with self._lock:
+                self._ready.discard(database.name)
+            self._schedule(database.name)
+
+    def search(self, term: str, database: str = "", limit: int = MAX_SEARCH_RESULTS):
+        """Return (database, table, column, value, occurrences) rows matching `term`.
+
+        Raises ValueError for unknown databases and LookupError while the indexes are being built
+        or after their build failed.
+        """
+        self.start()
+        names = [d.name for d in registry.resolve(database)]
+        with self._lock:
+            missing = [name for name in names if name not in self._ready]
+            failed = {name: self._failed[name] for name in missing if name in self._failed}
+        if failed:
+            errors = "; ".join(f"{name}: {error}" for name, error in failed.items())
+            raise LookupError(f"The search index could not be built ({errors}), it is retried in the background.")
+        if missing:
+            raise LookupError(f"The search index of {', '.join(missing)} is still being built.")
+
+        results = []
+        for name in names:
+            results += [(name, *row) for row in self.indexes[name].search(term, limit)]
+        if database == FEDERATED:
+            # databases share their schema, keep the best matches across all of them
+            results.sort(key=lambda r: (r[3].lower() != term.lower(), len(r[3]), -r[4]))
+        return results[:limit]
+
+
+search_manager = SearchManager(SEARCH_INDEX_DIR)
+registry.on_swap(search_manager.on_snapshot_swap)
@@ -0,0 +1,235 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+from collections import OrderedDict
+
+from managers.db_manager import DB_PATH, registry
+from utils.logger import log_other
+from utils.worker_files import remove_stale_worker_files, worker_path
+
+
+SUMMARY_DB_PATH = "database/summaries.db"
+
+# number of executions of the same aggregate shape before it gets materialized
+PROMOTION_THRESHOLD = int(os.getenv("SUMMARY_PROMOTION_THRESHOLD", "3"))
+MAX_SUMMARIES = 50
+MAX_SUMMARY_ROWS = 10_000
+MAX_TRACKED_SHAPES = 1_000
+
+NON_DETERMINISTIC = re.compile(
+    r"random\s*\(|'now'|current_(date|time|timestamp)|changes\s*\(|last_insert_rowid",
+    re.IGNORECASE,
+)
+
+
+def normalize_query(sql: str) -> str:
+    """Collapse whitespace and trailing semicolons so equivalent statements share a shape"""
+    return re.sub(r"\s+", " ", sql).strip().rstrip(";").strip()
+
+
+def is_aggregate_shape(sql: str) -> bool:
+    """Only single read-only statements grouping their results are worth materializing"""
+    upper = sql.upper()
+    if not re.match(r"^(SELECT|WITH)\b", upper):
+        return False
+    if ";" in sql or "GROUP BY" not in upper:
+        return False
+    return not NON_DETERMINISTIC.search(sql)
+
+
+class SummaryManager:
+    """Maintains summary tables for recurring GROUP BY queries in a side SQLite database.
+
+    A summary is built with a single `CREATE TABLE ... AS <query>` on a private connection
+    attaching the source read-only, outside the lock, then its (few) rows are copied in.
+    Summaries are dropped and rebuilt lazily whenever the source `data_version` changes.
+    Each worker process keeps its summaries in its own file, `<summary_path>_<pid>`, so
+    workers never drop or evict the tables another one is reading.
+    """
+
+    def __init__(self, source_path: str, summary_path: str, threshold: int):
+        self.source_path = source_path
+        self.summary_path = summary_path
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        self._conn = None
+        self._conn_pid = None
+        self._data_version = None
+        self._hits = OrderedDict()  # shape -> number of executions
+        self._rejected = set()
+        self._summaries = OrderedDict()  # shape -> summary table name
+        self._building = set()  # shapes being materialized, their other callers query the source
+        # bumped whenever the summaries are dropped, a build started before is not kept
+        self._epoch = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None or self._conn_pid != os.getpid():
+            # a forked worker starts afresh, the summaries it inherited live in its parent's file
+            self._summaries.clear()
+            self._data_version = None
+            self._epoch += 1
+            os.makedirs(os.path.dirname(self.summary_path) or ".", exist_ok=True)
+            remove_stale_worker_files(self.summary_path)
+            conn = sqlite3.connect(
+                worker_path(self.summary_path, os.getpid()), check_same_thread=False, uri=True
+            )
+            conn.execute(
+                "ATTACH DATABASE ? AS src",
+                (f"file:{os.path.abspath(self.source_path)}?mode=ro",),
+            )
+            # summaries do not survive restarts, data_version is only meaningful per connection
+            tables = conn.execute(
+                "SELECT name FROM main.sqlite_master WHERE type='table' AND name LIKE 'summary_%'"
+            ).fetchall()
+            for (name,) in tables:
+                conn.execute(f"DROP TABLE main.{name}")
+            conn.commit()
+            self._conn = conn
+            self._conn_pid = os.getpid()
+        return self._conn
+
+    def _check_data_version(self, conn: sqlite3.Connection):
+        version = conn.execute("PRAGMA src.data_version").fetchone()[0]
+        if self._data_version is not None and version != self._data_version:
+            log_other("Source data changed, invalidating materialized summaries")
+            self._drop_all(conn)
+        self._data_version = version
+
+    def _drop_all(self, conn: sqlite3.Connection):
+        for table in self._summaries.values():
+            conn.execute(f"DROP TABLE IF EXISTS main.{table}")
+        conn.commit()
+        self._summaries.clear()
+        self._epoch += 1
+
+    def _build(self, shape: str, table: str):
+        """Run `shape` against the source on a connection of its own.
+
+        Returns (create statement, columns, rows), or None if it fails or has too many rows.
+        """
+        # an anonymous temporary database, spilled to disk if the statement needs it
+        conn = sqlite3.connect("")
+        try:
+            conn.execute(
+                "ATTACH DATABASE ? AS src",
+                (f"file:{os.path.abspath(self.source_path)}?mode=ro",),
+            )
+            conn.execute(f"CREATE TABLE main.{table} AS {shape}")
+            row_count = conn.execute(f"SELECT COUNT(*) FROM main.{table}").fetchone()[0]
+            if row_count > MAX_SUMMARY_ROWS:
+                return None
+            create = conn.execute(
+                "SELECT sql FROM main.sqlite_master WHERE name = ?", (table,)
+            ).fetchone()[0]
+            cursor = conn.execute(f"SELECT * FROM main.{table} ORDER BY rowid")
+            return create, [d[0] for d in cursor.description], cursor.fetchall()
+        except sqlite3.Error as e:
+            log_other(f"Could not materialize summary for query: {e}")
+            return None
+        finally:
+            conn.close()
+
+    def _store(self, conn: sqlite3.Connection, shape: str, table: str, create: str, rows):
+        try:
+            conn.execute(f"DROP TABLE IF EXISTS main.{table}")
+            conn.execute(create)
+            if rows:
+                placeholders = ", ".join("?" for _ in rows[0])
+                conn.executemany(f"INSERT INTO main.{table} VALUES ({placeholders})", rows)
+            conn.commit()
+        except sqlite3.Error as e:
+            conn.rollback()
+            log_other(f"Could not store summary {table}: {e}")
+            return
+        self._summaries[shape] = table
+        if len(self._summaries) > MAX_SUMMARIES:
+            _, evicted = self._summaries.popitem(last=False)
+            conn.execute(f"DROP TABLE IF EXISTS main.{evicted}")
+            conn.commit()
+        log_other(f"Materialized summary {table} ({len(rows)} rows) for: {shape}")
+
+    def run(self, sql: str):
+        """Return (columns, rows) for `sql` from a summary table, or None if the query should hit the source"""
+        shape = normalize_query(sql)
+        if shape in self._rejected or not is_aggregate_shape(shape):
+            return None
+
+        with self._lock:
+            try:
+                conn = self._connect()
+                self._check_data_version(conn)
+            except sqlite3.Error as e:
+                log_other(f"Summary database unavailable: {e}")
+                return None
+
+            table = self._summaries.get(shape)
+            if table is not None:
+                self._summaries.move_to_end(shape)
+                try:
+                    cursor = conn.execute(f"SELECT * FROM main.{table} ORDER BY rowid")
+                    return [d[0] for d in cursor.description], cursor.fetchall()
+                except sqlite3.Error as e:
+                    # the summary is gone or unreadable, forget it and let the caller query the source
+                    log_other(f"Could not read summary {table}: {e}")
+                    self._summaries.pop(shape, None)
+                    return None
+
+            self._hits[shape] = self._hits.pop(shape, 0) + 1
+            if len(self._hits) > MAX_TRACKED_SHAPES:
+                self._hits.popitem(last=False)
+            if self._hits[shape] < self.threshold or shape in self._building:
+                return None
+            self._building.add(shape)
+            epoch = self._epoch
+
+        # the aggregation scans the source, other queries keep using the summaries meanwhile
+        table = "summary_" + hashlib.sha1(shape.encode("utf-8")).hexdigest()[:16]
+        built = self._build(shape, table)
+
+        with self._lock:
+            self._building.discard(shape)
+            if built is None:
+                self._rejected.add(shape)
+                return None
+            create, columns, rows = built
+            if epoch != self._epoch:
+                # the source changed while building, the rows may predate it
+                return None
+            try:
+                self._store(self._connect(), shape, table, create, rows)
+            except sqlite3.Error as e:
+                log_other(f"Summary database unavailable: {e}")
+        return columns, rows
+
+    def on_snapshot_swap(self, database):
+        """Forget the summaries of the previous snapshot, they are rebuilt from the new one"""
+        if os.path.abspath(database.path) != os.path.abspath(self.source_path):
+            return
+        with self._lock:
+            if self._conn is not None and self._conn_pid == os.getpid():
+                self._conn.close()
+            # the next query reconnects, attaching the new file and dropping the stale tables
+            self._conn = None
+            self._data_version = None
+            self._epoch += 1
+            self._summaries.clear()
+            self._rejected.clear()
+
+    def describe(self) -> str:
+        """Text for the system prompt listing the queries that are served from summaries"""
+        with self._lock:
+            shapes = list(self._summaries)
+        if not shapes:
+            return ""
+        lines = "\n".join(f"- {shape}" for shape in shapes)
+        return (
+            "The following aggregate queries are pre-computed and answered instantly by ExecuteQuery "
+            "when executed exactly as written. Prefer reusing them when they answer the question:\n"
+            f"{lines}"
+        )
+
+
+summary_manager = SummaryManager(DB_PATH, SUMMARY_DB_PATH, PROMOTION_THRESHOLD)
+registry.on_swap(summary_manager.on_snapshot_swap)
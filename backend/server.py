@@ -1,11 +1,17 @@
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import FileResponse
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import FileResponse, PlainTextResponse
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
 import os
 from agent import graph
 from add_langgraph_route import add_langgraph_route
+from add_export_route import add_export_route
+from add_results_route import add_results_route
+from managers.prompt_manager import PROMPT_MODE_COOKIE, prompt_manager
+from managers.search_manager import search_manager
+from utils.metrics import metrics
+from utils.profiling import is_authorized, profiler
 
 app = FastAPI()
 
@@ -13,6 +19,9 @@ app = FastAPI()
 class PromptModeRequest(BaseModel):
     mode: str
 
+class ProfileArmRequest(BaseModel):
+    requests: int = 1
+
 # cors
 app.add_middleware(
     CORSMiddleware,
@@ -20,36 +29,66 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # readable by the frontend: how long to back off, which request to look up or profile
+    expose_headers=["Retry-After", "X-Request-ID", "X-Profiled"],
 )
 
 add_langgraph_route(app, graph, "/api/chat")
+add_export_route(app, "/api/export")
+add_results_route(app, "/api/results")
+
+@app.on_event("startup")
+async def build_search_indexes():
+    """Build the value search indexes in the background, in each worker after the fork"""
+    search_manager.start()
+
+@app.get("/api/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Expose server metrics in the Prometheus text format"""
+    return metrics.render()
+
+def require_profile_token(request: Request):
+    # profiles expose code paths and timings, only operators holding PROFILE_TOKEN get them
+    if not is_authorized(request.headers.get("x-profile-token", "")):
+        raise HTTPException(status_code=403, detail="Invalid or missing X-Profile-Token")
+
+@app.post("/api/profiles/arm")
+async def arm_profiling(arm: ProfileArmRequest, request: Request):
+    """Profile the next chat requests handled by this worker"""
+    require_profile_token(request)
+    return {"armed": profiler.arm(arm.requests), "pid": os.getpid()}
+
+@app.get("/api/profiles/{request_id}", response_class=PlainTextResponse)
+async def get_profile(request_id: str, request: Request):
+    """Folded stacks of a profiled request, for flamegraph.pl or speedscope"""
+    require_profile_token(request)
+    folded = profiler.load(request_id)
+    if folded is None:
+        raise HTTPException(status_code=404, detail="No profile for this request")
+    return folded
 
 @app.get("/api/prompt-mode")
-async def get_prompt_mode():
-    """Get the current prompt mode (business or technical)"""
-    try:
-        with open("system_prompts/active.txt", "r") as f:
-            mode = f.read().strip()
-        return {"mode": mode}
-    except FileNotFoundError:
-        # Default to technical if file doesn't exist
-        return {"mode": "technical"}
+async def get_prompt_mode(request: Request):
+    """Get the prompt mode of this session (business or technical)"""
+    mode = prompt_manager.resolve(request.cookies.get(PROMPT_MODE_COOKIE))
+    return {"mode": mode, "modes": list(prompt_manager.modes)}
 
 @app.post("/api/prompt-mode")
-async def set_prompt_mode(request: PromptModeRequest):
-    """Set the prompt mode to business or technical"""
-    if request.mode not in ["business", "technical"]:
+async def set_prompt_mode(request: PromptModeRequest, response: Response):
+    """Set the prompt mode of this session to business or technical"""
+    if request.mode not in prompt_manager.modes:
         raise HTTPException(status_code=400, detail="Mode must be 'business' or 'technical'")
-    
-    try:
-        with open("system_prompts/active.txt", "w") as f:
-            f.write(request.mode)
-        return {"success": True, "mode": request.mode}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to update prompt mode: {str(e)}")
+
+    # kept by the client, so every worker serves the session with the same mode
+    response.set_cookie(PROMPT_MODE_COOKIE, request.mode, max_age=365 * 24 * 3600, samesite="lax")
+    return {"success": True, "mode": request.mode}
 
 
 if __name__ == "__main__":
     import uvicorn
-    
+
+    from managers.db_manager import registry
+
+    registry.install_refresh_signal()
+
     uvicorn.run(app)
\ No newline at end of file
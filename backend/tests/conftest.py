@@ -0,0 +1,44 @@
+import os
+import shutil
+import sqlite3
+import sys
+
+import pytest
+
+# the backend modules are imported from the backend folder, wherever pytest is run from
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+CHINOOK_PATH = os.path.join(BACKEND_DIR, "prototyping", "chinook.sqlite")
+
+
+class Shard:
+    """Stand-in for `managers.db_manager.Database`, a name and a file to connect to"""
+
+    def __init__(self, name: str, path: str):
+        self.name = name
+        self.path = path
+
+    def connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+
+
+@pytest.fixture(scope="session")
+def chinook_shards(tmp_path_factory):
+    """Chinook split in two shards by invoice, with the reference data copied in both"""
+    shards = []
+    for index, name in enumerate(("even", "odd")):
+        path = str(tmp_path_factory.mktemp("shards") / f"{name}.sqlite")
+        shutil.copy(CHINOOK_PATH, path)
+        conn = sqlite3.connect(path)
+        conn.execute("DELETE FROM InvoiceLine WHERE InvoiceId % 2 != ?", (index,))
+        conn.execute("DELETE FROM Invoice WHERE InvoiceId % 2 != ?", (index,))
+        conn.commit()
+        conn.close()
+        shards.append(Shard(name, path))
+    return shards
+
+
+@pytest.fixture(scope="session")
+def chinook():
+    return Shard("chinook", CHINOOK_PATH)
@@ -0,0 +1,27 @@
+from starlette.requests import Request
+
+import add_langgraph_route as route
+
+
+def request(host: str, **headers) -> Request:
+    return Request(
+        {
+            "type": "http",
+            "client": (host, 50000),
+            "headers": [(k.replace("_", "-").encode(), v.encode()) for k, v in headers.items()],
+        }
+    )
+
+
+def test_headers_ignored_from_clients(monkeypatch):
+    monkeypatch.setattr(route, "TRUSTED_PROXIES", {"10.0.0.5"})
+    assert route.client_id(request("203.0.113.7", x_user_id="someone-else")) == "203.0.113.7"
+    assert route.client_id(request("203.0.113.7", x_forwarded_for="198.51.100.1")) == "203.0.113.7"
+
+
+def test_headers_trusted_from_proxies(monkeypatch):
+    monkeypatch.setattr(route, "TRUSTED_PROXIES", {"10.0.0.5", "10.0.0.6"})
+    assert route.client_id(request("10.0.0.5", x_user_id="alice")) == "alice"
+    forwarded = request("10.0.0.5", x_forwarded_for="198.51.100.1, 203.0.113.7, 10.0.0.6")
+    assert route.client_id(forwarded) == "203.0.113.7"
+    assert route.client_id(request("10.0.0.5")) == "10.0.0.5"
@@ -0,0 +1,43 @@
+import sqlite3
+
+import pytest
+
+from conftest import Shard
+from utils import export
+
+pa = pytest.importorskip("pyarrow")
+
+
+@pytest.fixture
+def prices(tmp_path):
+    """A NUMERIC column holding whole numbers only until its last rows"""
+    path = str(tmp_path / "prices.sqlite")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE prices (id INTEGER PRIMARY KEY, price NUMERIC(10,2), label TEXT)")
+    conn.executemany(
+        "INSERT INTO prices VALUES (?, ?, ?)",
+        [(i, i if i < 25 else i + 0.5, f"item {i}") for i in range(30)],
+    )
+    conn.commit()
+    conn.close()
+    return Shard("prices", path)
+
+
+def read_stream(query_export):
+    return pa.ipc.open_stream(b"".join(query_export.chunks())).read_all()
+
+
+def test_numeric_column_widened_up_front(prices, monkeypatch):
+    monkeypatch.setattr(export, "CHUNK_ROWS", 10)
+    table = read_stream(export.QueryExport([prices], "SELECT id, price, label FROM prices", "arrow"))
+    assert table.schema.field("id").type == pa.int64()
+    assert table.schema.field("price").type == pa.float64()
+    assert table.column("price").to_pylist()[-1] == 29.5
+    assert table.num_rows == 30
+
+
+def test_expressions_widened_up_front(prices, monkeypatch):
+    monkeypatch.setattr(export, "CHUNK_ROWS", 10)
+    table = read_stream(export.QueryExport([prices], "SELECT id, price * 2 AS doubled FROM prices;", "arrow"))
+    assert table.schema.field("doubled").type == pa.float64()
+    assert table.column("doubled").to_pylist()[-1] == 59.0
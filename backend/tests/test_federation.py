@@ -0,0 +1,59 @@
+import pytest
+
+from managers.federation import FederationError, decompose, run_federated
+
+
+def run_single(database, sql: str):
+    conn = database.connect()
+    try:
+        return conn.execute(sql).fetchall()
+    finally:
+        conn.close()
+
+
+@pytest.mark.parametrize(
+    "sql",
+    [
+        # scalar subquery in WHERE
+        "SELECT InvoiceId, Total FROM Invoice WHERE Total = (SELECT MAX(Total) FROM Invoice)",
+        # derived table with DISTINCT
+        "SELECT COUNT(*) FROM (SELECT DISTINCT CustomerId FROM Invoice)",
+        # CTE aggregating before the outer aggregate
+        "WITH totals AS (SELECT CustomerId, SUM(Total) AS spent FROM Invoice GROUP BY CustomerId) "
+        "SELECT MAX(spent) FROM totals",
+        # subquery in the select list
+        "SELECT CustomerId, (SELECT COUNT(*) FROM Invoice i WHERE i.CustomerId = c.CustomerId) FROM Customer c",
+        # subquery in HAVING
+        "SELECT BillingCountry, SUM(Total) FROM Invoice GROUP BY BillingCountry "
+        "HAVING SUM(Total) > (SELECT AVG(Total) FROM Invoice)",
+        # derived table with LIMIT
+        "SELECT AVG(Total) FROM (SELECT Total FROM Invoice ORDER BY Total DESC LIMIT 10)",
+        "SELECT CustomerId, RANK() OVER (ORDER BY Total DESC) FROM Invoice",
+        "SELECT MAX(Total, 5) FROM Invoice",
+    ],
+)
+def test_shapes_computed_per_shard_are_rejected(sql):
+    with pytest.raises(FederationError):
+        decompose(sql)
+
+
+@pytest.mark.parametrize(
+    "sql",
+    [
+        "SELECT BillingCountry, COUNT(*), SUM(Total), AVG(Total) FROM Invoice "
+        "GROUP BY BillingCountry ORDER BY BillingCountry",
+        "SELECT InvoiceId FROM Invoice WHERE CustomerId IN (SELECT CustomerId FROM Customer WHERE Country = 'France') "
+        "ORDER BY InvoiceId",
+        "SELECT MIN(Total), MAX(Total) FROM Invoice WHERE BillingCity = 'Paris'",
+    ],
+)
+def test_merged_result_matches_the_single_database(sql, chinook, chinook_shards):
+    _, rows = run_federated(chinook_shards, sql)
+    expected = run_single(chinook, sql)
+    assert [tuple(round(v, 6) if isinstance(v, float) else v for v in row) for row in rows] == [
+        tuple(round(v, 6) if isinstance(v, float) else v for v in row) for row in expected
+    ]
+
+
+def test_literals_do_not_trigger_rejection():
+    decompose("SELECT COUNT(*) FROM Invoice WHERE BillingAddress = '(SELECT MAX(x) over'")
@@ -0,0 +1,49 @@
+import asyncio
+
+import httpx
+
+from managers import llm_manager
+
+REQUEST = httpx.Request("POST", "http://llm.test/v1/chat/completions")
+
+
+def test_hedged_copy_failing_with_the_winner(monkeypatch):
+    monkeypatch.setattr(llm_manager, "HEDGE_REQUESTS", True)
+    transport = llm_manager._ModelTransport("hedged")
+    transport.latency.hedge_delay = lambda: 0.01
+
+    async def hedged():
+        both_sent = asyncio.Event()
+        copies = 0
+
+        async def send(request):
+            nonlocal copies
+            copy, copies = copies, copies + 1
+            if copies == 2:
+                both_sent.set()
+            # the copies finish in the same loop iteration, the first one failing
+            await both_sent.wait()
+            if copy == 0:
+                raise httpx.ConnectError("reset")
+            return httpx.Response(200)
+
+        transport._send = send
+        return await transport._send_hedged(REQUEST)
+
+    async def run():
+        return [await hedged() for _ in range(20)]
+
+    assert all(response.status_code == 200 for response in asyncio.run(run()))
+
+
+def test_backoff_releases_the_slot(monkeypatch):
+    statuses = iter([429, 429, 200])
+    pool = httpx.MockTransport(lambda request: httpx.Response(next(statuses)))
+    monkeypatch.setattr(llm_manager, "_shared_sync_pool", lambda: pool)
+    monkeypatch.setattr(llm_manager, "_backoff_seconds", lambda attempt, response=None: 0)
+    transport = llm_manager._ModelTransport("backoff")
+    free_slots = []
+    monkeypatch.setattr(llm_manager.time, "sleep", lambda seconds: free_slots.append(transport._sync_slots._value))
+
+    assert transport.handle_request(REQUEST).status_code == 200
+    assert free_slots == [llm_manager.MODEL_CONCURRENCY] * 2
@@ -0,0 +1,31 @@
+import pytest
+from langchain_core.messages import AIMessage
+
+from managers.model_router import needs_escalation
+
+
+def turn(*tools):
+    return AIMessage(
+        content="",
+        tool_calls=[{"name": name, "args": {}, "id": f"call_{i}"} for i, name in enumerate(tools)],
+    )
+
+
+@pytest.mark.parametrize(
+    "tools",
+    [
+        ("ListTablesTool",),
+        ("DescribeTables",),
+        ("ListTablesTool", "DescribeTables"),
+        ("GetSampleRows", "GetUniqueColumnValues"),
+        ("SearchValues",),
+    ],
+)
+def test_exploration_turns_stay_on_the_fast_model(tools):
+    assert not needs_escalation(turn(*tools))
+
+
+def test_queries_and_answers_escalate():
+    assert needs_escalation(turn("ExecuteQuery"))
+    assert needs_escalation(turn("DescribeTables", "ExecuteQuery"))
+    assert needs_escalation(AIMessage(content="There are 275 artists."))
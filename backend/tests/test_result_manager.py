@@ -0,0 +1,61 @@
+import sqlite3
+
+import pytest
+
+from conftest import Shard
+from managers import result_manager as results
+from utils.cancellation import CancelScope, current_scope
+
+
+class CountingShard(Shard):
+    def __init__(self, name: str, path: str):
+        super().__init__(name, path)
+        self.connections = 0
+
+    def connect(self) -> sqlite3.Connection:
+        self.connections += 1
+        conn = super().connect()
+        scope = current_scope.get()
+        if scope is not None:
+            scope.track(conn)
+        return conn
+
+
+@pytest.fixture
+def manager(tmp_path, monkeypatch):
+    monkeypatch.setattr(results, "spill_store", results._SpillStore(str(tmp_path / "results.db")))
+    # room for a few hundred rows only
+    return results.ResultManager(60, 20_000, 10**9)
+
+
+def test_deep_pages_run_the_query_once(manager, chinook):
+    shard = CountingShard("chinook", chinook.path)
+    sql = "SELECT TrackId, Name, Milliseconds FROM Track ORDER BY Milliseconds DESC"
+    rows = shard.connect().execute(sql).fetchall()
+    shard.connections = 0
+    scope = CancelScope()
+    token = current_scope.set(scope)
+    try:
+        _, total = manager.register("q", sql, [shard], ["TrackId", "Name", "Milliseconds"], iter(rows), 5)
+        pages = [manager.page("q", offset, 100)["rows"] for offset in (0, 1000, 3400, 3500)]
+    finally:
+        current_scope.reset(token)
+
+    assert total == len(rows) == 3503
+    assert [[tuple(r) for r in page] for page in pages] == [
+        rows[0:100], rows[1000:1100], rows[3400:3500], rows[3500:3503]
+    ]
+    assert shard.connections == 1
+    # the connection was untracked before being closed
+    assert scope._connections == []
+
+
+def test_discarded_result_drops_its_spill(manager, chinook):
+    sql = "SELECT TrackId FROM Track"
+    rows = chinook.connect().execute(sql).fetchall()
+    manager.register("q", sql, [chinook], ["TrackId"], iter(rows), 0)
+    manager.page("q", 3000, 10)
+    table = manager.get("q")._spill_table
+    manager.register("q", sql, [chinook], ["TrackId"], iter([]), 0)
+
+    assert results.spill_store.page(table, 0, 10) == []
@@ -0,0 +1,23 @@
+import sqlite3
+
+from conftest import Shard
+from managers import sampling
+
+
+def test_positional_order_by_sorts_on_the_selected_column(tmp_path, monkeypatch):
+    path = str(tmp_path / "sales.sqlite")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE sales (g TEXT, x REAL)")
+    # many small sales in a, few large ones in c: the counts and the sums rank the groups oppositely
+    rows = [("a", 1.0)] * 3000 + [("b", 10.0)] * 1000 + [("c", 100.0)] * 300
+    conn.executemany("INSERT INTO sales VALUES (?, ?)", rows)
+    conn.commit()
+    conn.close()
+    monkeypatch.setattr(sampling, "MIN_APPROXIMATE_ROWS", 0)
+
+    columns, rows, _ = sampling.run_approximate(
+        Shard("sales", path), "SELECT g, COUNT(*) c, SUM(x) s FROM sales GROUP BY g ORDER BY 3 DESC"
+    )
+
+    assert columns[0] == "g" and "s" in columns
+    assert [row[0] for row in rows] == ["c", "b", "a"]
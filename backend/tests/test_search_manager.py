@@ -0,0 +1,41 @@
+import time
+
+import pytest
+
+from managers import search_manager as search
+from managers.db_manager import DatabaseRegistry
+
+
+class FlakyIndex(search.SearchIndex):
+    """Fails its first build"""
+
+    def __init__(self, database, index_dir: str):
+        super().__init__(database, index_dir)
+        self.builds = 0
+
+    def build(self):
+        self.builds += 1
+        if self.builds == 1:
+            raise OSError("disk full")
+        super().build()
+
+
+def test_failed_build_is_reported_then_retried(tmp_path, chinook, monkeypatch):
+    registry = DatabaseRegistry(f"chinook={chinook.path}")
+    monkeypatch.setattr(search, "registry", registry)
+    monkeypatch.setattr(search, "RETRY_SECONDS", 0.2)
+    manager = search.SearchManager(str(tmp_path))
+    index = manager.indexes["chinook"] = FlakyIndex(registry.get("chinook"), str(tmp_path))
+
+    manager._started_pid = search.os.getpid()
+    manager._schedule("chinook")
+    deadline = time.monotonic() + 10
+    while "chinook" not in manager._failed and time.monotonic() < deadline:
+        time.sleep(0.01)
+    with pytest.raises(LookupError, match="disk full"):
+        manager.search("Queen")
+
+    while "chinook" not in manager._ready and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert index.builds == 2
+    assert ("chinook", "Artist", "Name", "Queen", 1) in manager.search("Queen")
@@ -0,0 +1,45 @@
+import sqlite3
+import threading
+
+import pytest
+
+from managers.summary_manager import SummaryManager
+
+GENRES = "SELECT GenreId, COUNT(*) FROM Track GROUP BY GenreId"
+ALBUMS = "SELECT AlbumId, SUM(Milliseconds) FROM Track GROUP BY AlbumId"
+
+
+@pytest.fixture
+def manager(tmp_path, chinook):
+    return SummaryManager(chinook.path, str(tmp_path / "summaries.db"), 1)
+
+
+def test_summary_matches_the_source(manager, chinook):
+    expected = sqlite3.connect(chinook.path).execute(GENRES).fetchall()
+    assert manager.run(GENRES)[1] == expected
+    assert GENRES in manager._summaries
+    assert manager.run(GENRES)[1] == expected
+
+
+def test_build_does_not_hold_the_lock(manager, monkeypatch):
+    manager.run(GENRES)
+    started, release = threading.Event(), threading.Event()
+    build = manager._build
+
+    def slow_build(shape, table):
+        started.set()
+        release.wait(10)
+        return build(shape, table)
+
+    monkeypatch.setattr(manager, "_build", slow_build)
+    builder = threading.Thread(target=manager.run, args=(ALBUMS,))
+    builder.start()
+    try:
+        assert started.wait(10)
+        # served while the other summary is being built, the same shape goes to the source
+        assert manager.run(GENRES) is not None
+        assert manager.run(ALBUMS) is None
+    finally:
+        release.set()
+        builder.join()
+    assert ALBUMS in manager._summaries
@@ -1,36 +1,207 @@
 import ast
+import sqlite3
+from typing import Annotated
 
 from langchain_community.tools import tool
+from langchain_core.tools import InjectedToolCallId
 
-from managers.db_manager import db
+from managers.db_manager import FEDERATED, registry
+from managers.query_manager import query_manager
+from managers.result_manager import result_manager
+from managers.sampling import ApproximationError, run_approximate
+from managers.search_manager import search_manager
+from managers.summary_manager import summary_manager
+from utils.cancellation import untrack_connection
 from utils.helpers import is_query_risky, can_query_yield_large_results
 from utils.logger import log_tool_result
+from utils.result_profile import format_profile, profile_query, profile_rows
+from utils.timeseries import (
+    MAX_SERIES_ROWS,
+    MIN_SERIES_POINTS,
+    SERIES_CHUNK_ROWS,
+    detect_series,
+    summarize,
+)
+from utils.tracing import capture_plans, span
+
+
+# rows of a result shown to the LLM, the rest is only browsable through the result handle
+PREVIEW_ROWS = 50
+MAX_STRING_LENGTH = 300
+
+# bounds of a DescribeTables response
+MAX_DESCRIBED_TABLES = 10
+DESCRIBE_SAMPLE_ROWS = 3
+DESCRIBE_VALUE_LENGTH = 60
+MAX_DESCRIBE_CHARS = 8_000
 
 
 @tool("ListTablesTool")
 def list_tables_tool():
     """Use this tool to get all the available table names, to then choose those that might be relevant to the user's question.
+    When several databases are available, it also tells in which databases each table exists.
     Returns:
         str: The list of the tables available for querying
     """
     query = f"""
         SELECT name FROM sqlite_master WHERE type='table';
     """
-    results = db.run_no_throw(query)
-    if not results:
+    names = registry.names()
+    if len(names) == 1:
+        results = registry.run_no_throw(query)
+        if not results:
+            return f"No tables found."
+        return results
+
+    tables_by_database = {}
+    for name in names:
+        rows = registry.run_no_throw(query, database=name)
+        try:
+            tables_by_database[name] = [row[0] for row in ast.literal_eval(rows)] if rows else []
+        except Exception:
+            tables_by_database[name] = []
+
+    federated = set.intersection(*(set(t) for t in tables_by_database.values()))
+    partial = {}
+    for name, tables in tables_by_database.items():
+        for table in tables:
+            if table not in federated:
+                partial.setdefault(table, []).append(name)
+
+    if not federated and not partial:
         return f"No tables found."
-    return results
+    return (
+        f"Databases: {', '.join(names)} (default: {registry.default}).\n"
+        f"Tables present in every database, queried across all of them at once with database='{FEDERATED}': "
+        f"{sorted(federated)}\n"
+        f"Tables only present in some databases: {partial}"
+    )
+
+
+@tool("DescribeTables")
+def describe_tables(table_names: list[str], database: str = ""):
+    """Use this tool once the relevant tables have been selected, to get their structure in a single call.
+    Pass every table you need at once (up to 10), rather than calling the tool once per table.
+    From there, build the query to answer the user's question.
+
+    Args:
+        table_names: Names of the tables to describe
+        database: Name of the database holding the tables, '*' for all of them, empty for the default one
+
+    Returns:
+        str: For each table, its columns with their types and keys, an estimate of its row count and a few sample rows
+    """
+    names = list(dict.fromkeys(table_names))
+    if not names:
+        return "No table name provided."
+    skipped = names[MAX_DESCRIBED_TABLES:]
+    names = names[:MAX_DESCRIBED_TABLES]
+
+    # all databases of the federated view share their schema, the first one describes it
+    try:
+        target = registry.get(database)
+    except ValueError as e:
+        return f"Error: {e}"
+
+    conn = target.connect()
+    try:
+        # one read transaction, so every table is described from the same snapshot
+        conn.execute("BEGIN")
+        existing = {
+            row[0].lower(): row[0]
+            for row in conn.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'view')")
+        }
+        has_stats = "sqlite_stat1" in existing
+        sections = []
+        for name in names:
+            table = existing.get(name.lower())
+            if table is None:
+                sections.append(f"Table {name}: does not exist.")
+            else:
+                sections.append(_describe_table(conn, table, has_stats))
+        conn.execute("COMMIT")
+    except sqlite3.Error as e:
+        return f"Error: {e}"
+    finally:
+        untrack_connection(conn)
+        conn.close()
+
+    # keep the response bounded, whole tables at a time
+    output = []
+    size = 0
+    for name, section in zip(names, sections):
+        if output and size + len(section) > MAX_DESCRIBE_CHARS:
+            skipped = names[len(output) :] + skipped
+            break
+        output.append(section)
+        size += len(section)
+    if skipped:
+        output.append(f"Not described to keep this response short, ask for them separately: {skipped}")
+    return "\n\n".join(output)
+
+
+def _describe_table(conn: sqlite3.Connection, table: str, has_stats: bool) -> str:
+    quoted = '"' + table.replace('"', '""') + '"'
+    columns = conn.execute(f"PRAGMA table_info({quoted})").fetchall()
+    foreign_keys = {
+        row[3]: f"{row[2]}.{row[4]}" for row in conn.execute(f"PRAGMA foreign_key_list({quoted})")
+    }
+
+    # PRAGMA table_info rows: (cid, name, type, notnull, dflt_value, pk)
+    described = []
+    for _, column, data_type, not_null, _, pk in columns:
+        parts = [column, data_type or "ANY"]
+        if pk:
+            parts.append("PK")
+        if not_null and not pk:
+            parts.append("NOT NULL")
+        if column in foreign_keys:
+            parts.append(f"-> {foreign_keys[column]}")
+        described.append(" ".join(parts))
+
+    rows = conn.execute(f"SELECT * FROM {quoted} LIMIT {DESCRIBE_SAMPLE_ROWS}").fetchall()
+    samples = [
+        str(
+            tuple(
+                v[:DESCRIBE_VALUE_LENGTH] + "..." if isinstance(v, str) and len(v) > DESCRIBE_VALUE_LENGTH else v
+                for v in row
+            )
+        )
+        for row in rows
+    ]
+
+    estimate = _estimate_row_count(conn, table, quoted, has_stats)
+    count = f"~{estimate} rows" if estimate is not None else "row count unknown"
+    lines = [f"Table {table} ({count})", f"Columns: {', '.join(described)}", "Sample rows:"]
+    lines += samples or ["(empty)"]
+    return "\n".join(lines)
+
+
+def _estimate_row_count(conn: sqlite3.Connection, table: str, quoted: str, has_stats: bool):
+    """Row count from the ANALYZE statistics, else from the largest rowid, both without scanning the table"""
+    if has_stats:
+        row = conn.execute(
+            "SELECT stat FROM sqlite_stat1 WHERE tbl = ? AND idx IS NULL", (table,)
+        ).fetchone() or conn.execute("SELECT stat FROM sqlite_stat1 WHERE tbl = ?", (table,)).fetchone()
+        if row and row[0]:
+            return int(row[0].split()[0])
+    try:
+        row = conn.execute(f"SELECT MAX(rowid) FROM {quoted}").fetchone()
+    except sqlite3.Error:
+        # views and WITHOUT ROWID tables
+        return None
+    return row[0] or 0
 
 
 @tool("GetSampleRows")
-def get_sample_rows(selected_table):
-    """Use this tool once the relevant tables have been selected, to get sample rows the tables.
-    This tool takes only one table as argument.
-    For several tables, call the tool several times.
+def get_sample_rows(selected_table, database: str = ""):
+    """Use this tool to get sample rows of a single table.
+    To explore several tables, prefer DescribeTables which describes all of them in one call.
     From there, build the query to answer the user's question.
 
     Args:
         selected_table: Name of a table in the database
+        database: Name of the database holding the table, '*' for all of them, empty for the default one
 
     Returns:
         str: A few sample rows from the table (including column names)
@@ -41,13 +212,15 @@ def get_sample_rows(selected_table):
         LIMIT 2
     """
 
-    results = db.run_no_throw(query, include_columns=True)
+    results = registry.run_no_throw(query, database=database, include_columns=True)
 
     return results
 
 
 @tool("GetUniqueColumnValues")
-def get_unique_column_values(schema_name: str, table_name: str, column_name: str):
+def get_unique_column_values(
+    schema_name: str, table_name: str, column_name: str, database: str = ""
+):
     """
     Retrieve up to 20 unique values for a single TEXT column from a selected table.
     Only one column is supported per call.
@@ -56,6 +229,7 @@ def get_unique_column_values(schema_name: str, table_name: str, column_name: str
         schema_name (str): Schema where the table resides.
         table_name (str): Table name.
         column_name (str): Single column name to retrieve unique values for.
+        database (str): Name of the database holding the table, '*' for all of them, empty for the default one.
 
     Returns:
         str: A list as a string with up to 20 distinct values from the column, or error message.
@@ -71,7 +245,11 @@ def get_unique_column_values(schema_name: str, table_name: str, column_name: str
         log_tool_result("GetUniqueColumnValues", msg)
         return msg
 
-    col_info_str = db.run_no_throw(col_check_query)
+    # all databases of the federated view share their schema, the first one describes it
+    try:
+        col_info_str = registry.run_no_throw(col_check_query, database=registry.get(database).name)
+    except ValueError as e:
+        return str(e)
     try:
         col_info = ast.literal_eval(col_info_str.strip())
     except Exception:
@@ -101,7 +279,7 @@ def get_unique_column_values(schema_name: str, table_name: str, column_name: str
         log_tool_result("GetUniqueColumnValues", msg)
         return msg
 
-    col_results_str = db.run_no_throw(query)
+    col_results_str = registry.run_no_throw(query, database=database)
     try:
         col_results = ast.literal_eval(col_results_str)
     except Exception:
@@ -116,13 +294,54 @@ def get_unique_column_values(schema_name: str, table_name: str, column_name: str
     return str(values)
 
 
+@tool("SearchValues")
+def search_values(term: str, database: str = ""):
+    """Find which tables and columns hold a value, e.g. to resolve a name mentioned by the user.
+    Searches the text columns of every table at once, matching the term anywhere in the values, case-insensitively.
+    Prefer it over queries with LIKE '%...%', then filter with an exact match on the returned column and value.
+
+    Args:
+        term: Text to look for, e.g. part of a name
+        database: Name of the database to search, '*' for all of them, empty for the default one
+
+    Returns:
+        str: Matching values with their table, column and number of rows, best matches first
+    """
+    term = term.strip()
+    if not term:
+        return "Error: provide a term to search for."
+    try:
+        matches = search_manager.search(term, database)
+    except LookupError as e:
+        return f"{e} Use GetUniqueColumnValues or ExecuteQuery meanwhile."
+    except (ValueError, sqlite3.Error) as e:
+        return f"Error: {e}"
+    if not matches:
+        return f"No value matching '{term}' in the indexed columns."
+
+    lines = []
+    for name, table, column, value, occurrences in matches:
+        location = f"{name}.{table}.{column}" if database == FEDERATED else f"{table}.{column}"
+        lines.append(f"{location} = {value!r} ({occurrences} rows)")
+    return "\n".join(lines)
+
+
 @tool("ExecuteQuery")
-def execute_query(sql_statement):
+def execute_query(
+    sql_statement,
+    database: str = "",
+    profile: bool = False,
+    approximate: bool = False,
+    tool_call_id: Annotated[str, InjectedToolCallId] = "",
+):
     """Use this tool once you built the query that will retrieve results answering the user's question.
     Args:
         sql_statement: A correct SQLite SELECT statement that retrieves results answering the user's question
+        database: Name of the database to query, '*' to run the query on all databases and merge the results, empty for the default one
+        profile: True to get a profile of the result instead of its rows: row count, per-column null counts, distinct counts, min/max/avg and most frequent values, plus a few rows. Use it when the result may be large or to learn what the data looks like
+        approximate: True to estimate COUNT/SUM/AVG aggregates over a single large table from a random sample, with 95% confidence intervals. Only for exploratory questions where a rough figure is enough, never for exact figures
     Returns:
-        str: The statement result
+        str: The statement result, or its profile
     """
     # Beware that this tool has safeguards and will reject your query if it could potentially yield large results.
     stmt_upper = sql_statement.strip().upper()
@@ -143,5 +362,142 @@ def execute_query(sql_statement):
     #         "Please include a LIMIT clause (e.g., SELECT * ... LIMIT 100 ...) or use aggregation."
     #     )
 
-    results = db.run_no_throw(sql_statement)
-    return results
+    # remember the statement so its full result can be exported for this conversation step
+    query_manager.register(tool_call_id, sql_statement, database)
+
+    # recurring aggregate shapes of the default database are served from their materialized summary
+    target = database or registry.default
+    summary = None
+    if target in registry.names() and registry.get(target).path == summary_manager.source_path:
+        summary = summary_manager.run(sql_statement)
+        if summary is not None:
+            log_tool_result("ExecuteQuery", "served from materialized summary")
+
+    sql_attributes = {
+        "db.name": target,
+        "db.statement": sql_statement,
+        "db.source": "summary" if summary is not None else "database",
+        "db.profile": profile,
+        "db.approximate": approximate,
+    }
+    with span("sql", **sql_attributes) as sql_span:
+        try:
+            if approximate and summary is None:
+                approximation = _approximate_result(sql_statement, database, tool_call_id)
+                if approximation is not None:
+                    return approximation
+            if profile:
+                result_profile = _profile_result(sql_statement, database, summary, tool_call_id)
+                if sql_span is not None:
+                    sql_span.set(**{"db.rows": result_profile["rows"]})
+                return format_profile(result_profile, tool_call_id)
+            if summary is not None:
+                columns, rows = summary[0], iter(summary[1])
+            else:
+                if sql_span is not None and capture_plans():
+                    sql_span.set(**{"db.plan": registry.explain(sql_statement, database)})
+                columns, rows = registry.execute(sql_statement, database)
+            # the full result stays browsable server-side, the LLM only gets a preview of it
+            preview, total = result_manager.register(
+                tool_call_id,
+                sql_statement,
+                registry.resolve(database),
+                columns,
+                rows,
+                PREVIEW_ROWS,
+            )
+        except (ValueError, sqlite3.Error) as e:
+            if sql_span is not None:
+                sql_span.error = str(e)
+            return f"Error: {e}"
+        if sql_span is not None:
+            sql_span.set(**{"db.rows": total})
+
+    if total > PREVIEW_ROWS and total >= MIN_SERIES_POINTS:
+        series = _series_summary(tool_call_id, columns, preview, total)
+        if series is not None:
+            return series
+    return format_result(preview, total, tool_call_id)
+
+
+def _series_summary(query_id: str, columns, preview, total: int):
+    """Summary statistics of a long time series, which the user gets as a chart, or None"""
+    spec = detect_series(columns, preview)
+    handle = result_manager.get(query_id)
+    if spec is None or handle is None or total > MAX_SERIES_ROWS:
+        return None
+    try:
+        summary = summarize(handle.iter_chunks(SERIES_CHUNK_ROWS), spec)
+    except (ValueError, TypeError, sqlite3.Error):
+        # rows past the ones used for detection do not fit a time series, show it as a table
+        return None
+    handle.series = spec
+    return (
+        f"{summary}\n\nThe user sees this result plotted as a chart (query ID {query_id}), "
+        "answer with the trends and figures above rather than listing points. "
+        "Run another query if you need specific values."
+    )
+
+
+def _approximate_result(sql_statement: str, database: str, query_id: str):
+    """Estimate the result from a sample, None when the table is small enough for the exact query"""
+    targets = registry.resolve(database)
+    if len(targets) > 1:
+        return "Error: approximate mode queries a single database, run it on one database or without approximate."
+    try:
+        approximation = run_approximate(targets[0], sql_statement)
+    except ApproximationError as e:
+        return f"Error: {e} Run the query without approximate."
+    if approximation is None:
+        return None
+
+    columns, rows, note = approximation
+    preview, total = result_manager.register(
+        query_id, sql_statement, targets, columns, iter(rows), PREVIEW_ROWS
+    )
+    return f"{note}\nColumns: {columns}\n{format_result(preview, total, query_id)}"
+
+
+def _profile_result(sql_statement: str, database: str, summary, query_id: str) -> dict:
+    """Profile the result, evaluated by SQLite, keeping it browsable like a regular result"""
+    targets = registry.resolve(database)
+    if summary is None and len(targets) == 1:
+        # only the profile leaves the database, pages are read from it if the user browses the result
+        result_profile = profile_query(targets[0], sql_statement)
+        columns = [column["name"] for column in result_profile["columns"]]
+        result_manager.register_unread(
+            query_id, sql_statement, targets, columns, result_profile["rows"]
+        )
+        return result_profile
+
+    # summaries and federated results are merged in memory first
+    if summary is not None:
+        columns, rows = summary
+    else:
+        columns, rows = registry.execute(sql_statement, database)
+        rows = list(rows)
+    result_manager.register(query_id, sql_statement, targets, columns, iter(rows), 0)
+    return profile_rows(columns, rows)
+
+
+def format_result(preview, total: int, query_id: str) -> str:
+    """Render rows the way `SQLDatabase.run` does, with a note when only a preview is shown"""
+    if not preview:
+        return ""
+    rows = str(
+        [
+            tuple(
+                v[:MAX_STRING_LENGTH] + "..." if isinstance(v, str) and len(v) > MAX_STRING_LENGTH else v
+                for v in row
+            )
+            for row in preview
+        ]
+    )
+    if total <= len(preview):
+        return rows
+    return (
+        f"{rows}\n\nOnly the first {len(preview)} of {total} rows are shown. "
+        f"The user can browse the full result (query ID {query_id}), "
+        "so summarize it or refine the query instead of listing every row. "
+        "Run it again with profile=True to see what the whole result looks like."
+    )
@@ -0,0 +1,136 @@
+import asyncio
+import math
+import os
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+
+from utils.metrics import metrics
+
+
+# limits of each worker process
+MAX_CONCURRENT_RUNS = int(os.getenv("CHAT_MAX_CONCURRENCY", "16"))
+MAX_QUEUED_RUNS = int(os.getenv("CHAT_MAX_QUEUE", "64"))
+MAX_QUEUED_RUNS_PER_USER = int(os.getenv("CHAT_MAX_QUEUE_PER_USER", "4"))
+MAX_QUEUE_WAIT_SECONDS = float(os.getenv("CHAT_QUEUE_TIMEOUT", "30"))
+
+# initial guess of a run duration, refined by an exponential moving average
+INITIAL_RUN_SECONDS = 10.0
+RUN_SECONDS_SMOOTHING = 0.2
+
+
+class AdmissionRejected(Exception):
+    """Raised when a run is not admitted; carries the HTTP status and the Retry-After delay"""
+
+    def __init__(self, status_code: int, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """Caps the runs executing at once, queueing the others with round-robin fairness between users.
+
+    Lives on the event loop of its worker, so it needs no lock.
+    """
+
+    def __init__(self, max_concurrent: int, max_queued: int, max_queued_per_user: int, max_wait: float):
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.max_queued_per_user = max_queued_per_user
+        self.max_wait = max_wait
+        self._running = 0
+        self._waiting = 0
+        # user -> waiting futures; the user at the front is served next, then moves to the back
+        self._queues = OrderedDict()
+        self._run_seconds = INITIAL_RUN_SECONDS
+
+    def retry_after(self) -> int:
+        """Seconds until the queue is likely to have room again"""
+        rounds = (self._waiting + 1) / max(self.max_concurrent, 1)
+        return max(1, min(60, math.ceil(self._run_seconds * rounds)))
+
+    def _reject(self, status_code: int, reason: str):
+        metrics.inc("chat_rejected_total", reason=reason)
+        raise AdmissionRejected(status_code, reason, self.retry_after())
+
+    def _publish(self):
+        metrics.set("chat_queue_depth", self._waiting)
+        metrics.set("chat_runs_running", self._running)
+
+    @asynccontextmanager
+    async def admit(self, user: str):
+        """Hold a run slot for the duration of the block, waiting for it if needed.
+
+        Raises AdmissionRejected when the queue is full or the wait times out.
+        """
+        start = time.monotonic()
+        if self._running < self.max_concurrent and not self._waiting:
+            self._running += 1
+        else:
+            await self._wait_for_slot(user)
+        metrics.observe("chat_queue_wait_seconds", time.monotonic() - start)
+        self._publish()
+
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            elapsed = time.monotonic() - started
+            self._run_seconds += RUN_SECONDS_SMOOTHING * (elapsed - self._run_seconds)
+            self._release()
+
+    async def _wait_for_slot(self, user: str):
+        queue = self._queues.get(user)
+        if queue is not None and len(queue) >= self.max_queued_per_user:
+            # this user already has enough runs waiting, others are unaffected
+            self._reject(429, "user_queue_full")
+        if self._waiting >= self.max_queued:
+            self._reject(503, "queue_full")
+
+        future = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(user, deque()).append(future)
+        self._waiting += 1
+        self._publish()
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout=self.max_wait)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if future.done():
+                # the slot was handed over just as the wait ended, pass it on
+                self._release()
+            else:
+                future.cancel()
+                self._discard(user, future)
+            self._publish()
+            if isinstance(e, asyncio.TimeoutError):
+                self._reject(503, "queue_timeout")
+            raise
+
+    def _discard(self, user: str, future: asyncio.Future):
+        queue = self._queues.get(user)
+        if queue is not None and future in queue:
+            queue.remove(future)
+            self._waiting -= 1
+            if not queue:
+                del self._queues[user]
+
+    def _release(self):
+        """Hand the slot to the next waiting run, taking users in turn"""
+        while self._queues:
+            user, queue = self._queues.popitem(last=False)
+            future = queue.popleft()
+            self._waiting -= 1
+            if queue:
+                self._queues[user] = queue
+            if not future.done():
+                future.set_result(None)
+                self._publish()
+                return
+        self._running -= 1
+        self._publish()
+
+
+admission = AdmissionController(
+    MAX_CONCURRENT_RUNS, MAX_QUEUED_RUNS, MAX_QUEUED_RUNS_PER_USER, MAX_QUEUE_WAIT_SECONDS
+)
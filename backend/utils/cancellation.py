@@ -0,0 +1,68 @@
+import contextvars
+import sqlite3
+import threading
+
+
+class RunCancelled(Exception):
+    """Raised inside a graph run whose client went away"""
+
+
+class CancelScope:
+    """Cancellation state of a single graph run, shared by its nodes, tools and SQL connections"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._event = threading.Event()
+        self._connections = []
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self):
+        """Mark the run as cancelled and abort the SQL statements in flight"""
+        with self._lock:
+            self._event.set()
+            connections = list(self._connections)
+        for conn in connections:
+            try:
+                conn.interrupt()
+            except sqlite3.ProgrammingError:
+                # already closed
+                pass
+
+    def track(self, conn: sqlite3.Connection):
+        with self._lock:
+            self._connections.append(conn)
+        if self.cancelled:
+            conn.interrupt()
+
+    def untrack(self, conn: sqlite3.Connection):
+        with self._lock:
+            if conn in self._connections:
+                self._connections.remove(conn)
+
+
+# scope of the run being executed, propagated to the worker threads running sync nodes
+current_scope = contextvars.ContextVar("current_scope", default=None)
+
+
+def track_connection(conn: sqlite3.Connection):
+    """Let the current run interrupt `conn` when it gets cancelled"""
+    scope = current_scope.get()
+    if scope is not None:
+        scope.track(conn)
+    return conn
+
+
+def untrack_connection(conn: sqlite3.Connection):
+    scope = current_scope.get()
+    if scope is not None:
+        scope.untrack(conn)
+
+
+def check_cancelled():
+    """Stop the current node early if its run has been cancelled"""
+    scope = current_scope.get()
+    if scope is not None and scope.cancelled:
+        raise RunCancelled("The request was cancelled by the client")
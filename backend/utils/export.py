@@ -0,0 +1,233 @@
+import csv
+import io
+import sqlite3
+import threading
+
+from managers.federation import decompose, run_federated
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Arrow and Parquet exports are optional
+    pa = None
+    pq = None
+
+
+CHUNK_ROWS = 5_000
+
+EXPORT_FORMATS = {
+    "csv": ("text/csv", "csv"),
+    "arrow": ("application/vnd.apache.arrow.stream", "arrow"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file object whose content is drained after each chunk"""
+
+    def __init__(self):
+        self._buffer = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._buffer += data
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        return data
+
+
+class QueryExport:
+    """Streams the full result of a query in chunks, reading rows straight from the cursor"""
+
+    def __init__(self, databases, sql: str, export_format: str):
+        if export_format not in EXPORT_FORMATS:
+            raise ValueError(f"Format must be one of: {', '.join(EXPORT_FORMATS)}")
+        if export_format != "csv" and pa is None:
+            raise ValueError(f"Exporting as {export_format} requires pyarrow to be installed")
+        self.databases = databases
+        self.sql = sql
+        self.format = export_format
+        self._lock = threading.Lock()
+        self._conn = None
+        self._cancelled = False
+        # declared type of each result column, read before the first chunk
+        self.declared_types = None
+
+    def cancel(self):
+        """Abort the statement currently running, if any"""
+        with self._lock:
+            self._cancelled = True
+            if self._conn is not None:
+                self._conn.interrupt()
+
+    def _batches(self):
+        """Yield (columns, rows) chunks of at most CHUNK_ROWS rows"""
+        if len(self.databases) == 1:
+            shards, query = self.databases, self.sql
+        else:
+            plan = decompose(self.sql)
+            if plan["merge"] != "SELECT * FROM partials":
+                # merged results need every partial first, they are small once aggregated
+                columns, rows = run_federated(self.databases, self.sql)
+                for start in range(0, max(len(rows), 1), CHUNK_ROWS):
+                    yield columns, rows[start : start + CHUNK_ROWS]
+                return
+            shards, query = self.databases, plan["shard"]
+
+        columns = None
+        yielded = False
+        for database in shards:
+            conn = database.connect()
+            with self._lock:
+                if self._cancelled:
+                    conn.close()
+                    return
+                self._conn = conn
+            try:
+                if self.declared_types is None and self.format != "csv":
+                    self.declared_types = _declared_types(conn, query)
+                cursor = conn.execute(query)
+                columns = [d[0] for d in cursor.description]
+                while not self._cancelled:
+                    rows = cursor.fetchmany(CHUNK_ROWS)
+                    if not rows:
+                        break
+                    yielded = True
+                    yield columns, rows
+            finally:
+                with self._lock:
+                    self._conn = None
+                conn.close()
+
+        if columns is not None and not yielded:
+            # an empty result still carries its header / schema
+            yield columns, []
+
+    def chunks(self):
+        """Yield the encoded export, chunk by chunk"""
+        if self.format == "csv":
+            yield from self._csv_chunks()
+        else:
+            yield from self._arrow_chunks()
+
+    def _csv_chunks(self):
+        header_written = False
+        for columns, rows in self._batches():
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            if not header_written:
+                writer.writerow(columns)
+                header_written = True
+            writer.writerows(rows)
+            yield buffer.getvalue().encode("utf-8")
+
+    def _arrow_chunks(self):
+        sink = _ChunkSink()
+        writer = None
+        schema = None
+        try:
+            for columns, rows in self._batches():
+                values = list(zip(*rows)) if rows else [() for _ in columns]
+                if schema is None:
+                    declared = self.declared_types or [""] * len(columns)
+                    schema = pa.schema(
+                        [
+                            pa.field(name, _arrow_type(column, declared_type))
+                            for name, column, declared_type in zip(columns, values, declared)
+                        ]
+                    )
+                    if self.format == "parquet":
+                        writer = pq.ParquetWriter(sink, schema)
+                    else:
+                        writer = pa.ipc.new_stream(sink, schema)
+                arrays = [
+                    pa.array([_coerce(v, field) for v in column], type=field.type)
+                    for field, column in zip(schema, values)
+                ]
+                batch = pa.RecordBatch.from_arrays(arrays, schema=schema)
+                if self.format == "parquet":
+                    writer.write_table(pa.Table.from_batches([batch]))
+                else:
+                    writer.write_batch(batch)
+                yield sink.drain()
+        finally:
+            if writer is not None:
+                writer.close()
+        yield sink.drain()
+
+
+def _declared_types(conn: sqlite3.Connection, query: str):
+    """Declared type of each column of `query`, "" for expressions; None if it cannot be described"""
+    try:
+        conn.execute(f"CREATE TEMP VIEW export_columns AS {query.strip().rstrip(';')}")
+        try:
+            return [row[2] for row in conn.execute("PRAGMA temp.table_info(export_columns)")]
+        finally:
+            conn.execute("DROP VIEW temp.export_columns")
+    except sqlite3.Error:
+        return None
+
+
+def _affinity(declared_type: str) -> str:
+    """SQLite type affinity of a declared column type"""
+    declared_type = (declared_type or "").upper()
+    if "INT" in declared_type:
+        return "INTEGER"
+    if any(name in declared_type for name in ("CHAR", "CLOB", "TEXT")):
+        return "TEXT"
+    if not declared_type or "BLOB" in declared_type:
+        return "BLOB"
+    if any(name in declared_type for name in ("REAL", "FLOA", "DOUB")):
+        return "REAL"
+    return "NUMERIC"
+
+
+def _arrow_type(values, declared_type: str = ""):
+    """Pick the Arrow type of a column from its declared type and its first chunk.
+
+    The schema of a stream cannot change once written, so later chunks are coerced to it
+    by `_coerce`. Only INTEGER columns are exported as int64: NUMERIC columns and
+    expressions store whole values as integers, and the first fractional one may only
+    come in a later chunk, so their numbers are widened to float64 up front.
+    """
+    kinds = {type(v) for v in values if v is not None}
+    affinity = _affinity(declared_type)
+    if not kinds:
+        # nothing to infer from, the declared type decides
+        return {"INTEGER": pa.int64(), "REAL": pa.float64()}.get(affinity, pa.string())
+    if kinds <= {int, float}:
+        return pa.int64() if kinds == {int} and affinity == "INTEGER" else pa.float64()
+    if kinds == {bytes}:
+        return pa.binary()
+    return pa.string()
+
+
+def _coerce(value, field):
+    """Fit a value into the type of its column, widening numbers, or raise ValueError"""
+    if value is None:
+        return None
+    arrow_type = field.type
+    if arrow_type == pa.string():
+        return value if isinstance(value, str) else str(value)
+    if arrow_type == pa.float64() and isinstance(value, (int, float)):
+        return float(value)
+    if arrow_type == pa.int64():
+        if isinstance(value, int):
+            return value
+        if isinstance(value, float) and value.is_integer():
+            return int(value)
+    if arrow_type == pa.binary():
+        if isinstance(value, bytes):
+            return value
+        if isinstance(value, str):
+            return value.encode("utf-8")
+    # only values defying the declared type of their column get here, e.g. text in an INTEGER column
+    raise ValueError(
+        f"Column {field.name} was exported as {arrow_type}, "
+        f"it cannot hold the later value {value!r}; export as csv instead"
+    )
@@ -2,47 +2,55 @@ import logging
 import os
 from datetime import datetime
 
-# Create logs directory if it doesn't exist
 logs_dir = "logs"
-if not os.path.exists(logs_dir):
-    os.makedirs(logs_dir)
 
-# Create a log file per day using date
-date_str = datetime.now().strftime("%Y%m%d")
-log_filename = f"llm_activity_{date_str}.log"
+logger = logging.getLogger("llm_model")
+_configured = False
 
-# Configure simple file logging for LLM model activity only
-logging.basicConfig(
-    filename=os.path.join(logs_dir, log_filename),
-    level=logging.INFO,
-    format="%(asctime)s - %(message)s",
-    filemode="a",
-)
 
-logger = logging.getLogger("llm_model")
+def _get_logger():
+    """Configure the log file on first use, so importing this module has no side effects"""
+    global _configured
+    if not _configured:
+        # Create logs directory if it doesn't exist
+        os.makedirs(logs_dir, exist_ok=True)
+
+        # Create a log file per day using date
+        date_str = datetime.now().strftime("%Y%m%d")
+        log_filename = f"llm_activity_{date_str}.log"
+
+        # Configure simple file logging for LLM model activity only
+        logging.basicConfig(
+            filename=os.path.join(logs_dir, log_filename),
+            level=logging.INFO,
+            format="%(asctime)s - %(message)s",
+            filemode="a",
+        )
+        _configured = True
+    return logger
 
 
 def log_llm_decision(decision_type, details):
     """Log LLM decisions and actions"""
-    logger.info(f"{decision_type}: {details}")
+    _get_logger().info(f"{decision_type}: {details}")
 
 
 def log_tool_call(tool_name, args):
     """Log tool calls made by LLM"""
-    logger.info(f"TOOL_CALL: {tool_name} with args: {args}")
+    _get_logger().info(f"TOOL_CALL: {tool_name} with args: {args}")
 
 
 def log_tool_result(tool_name, result):
     """Log results from tool executions"""
     result_str = str(result)
-    logger.info(f"TOOL_RESULT: {tool_name} returned: {result_str}")
+    _get_logger().info(f"TOOL_RESULT: {tool_name} returned: {result_str}")
 
 
 def log_llm_response(response):
     """Log final LLM response"""
     response_str = str(response)
-    logger.info(f"LLM_RESPONSE: {response_str}")
+    _get_logger().info(f"LLM_RESPONSE: {response_str}")
 
 def log_other(message):
     """Log other messages or events"""
-    logger.info(f"OTHER: {message}")
\ No newline at end of file
+    _get_logger().info(f"OTHER: {message}")
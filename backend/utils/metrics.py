@@ -0,0 +1,62 @@
+import threading
+
+
+class Metrics:
+    """In-process counters, gauges and summaries rendered in the Prometheus text format"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._summaries = {}
+
+    @staticmethod
+    def _key(name: str, labels: dict):
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels):
+        with self._lock:
+            self._gauges[self._key(name, labels)] = value
+
+    def observe(self, name: str, value: float, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            count, total = self._summaries.get(key, (0, 0.0))
+            self._summaries[key] = (count + 1, total + value)
+
+    def get(self, name: str, **labels) -> float:
+        key = self._key(name, labels)
+        with self._lock:
+            return self._counters.get(key, self._gauges.get(key, 0))
+
+    def render(self) -> str:
+        with self._lock:
+            lines = []
+            for kind, values in (("counter", self._counters), ("gauge", self._gauges)):
+                for name in sorted({n for n, _ in values}):
+                    lines.append(f"# TYPE {name} {kind}")
+                    for (n, labels), value in values.items():
+                        if n == name:
+                            lines.append(f"{name}{_labels(labels)} {value}")
+            for name in sorted({n for n, _ in self._summaries}):
+                lines.append(f"# TYPE {name} summary")
+                for (n, labels), (count, total) in self._summaries.items():
+                    if n == name:
+                        lines.append(f"{name}_count{_labels(labels)} {count}")
+                        lines.append(f"{name}_sum{_labels(labels)} {total}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels) -> str:
+    if not labels:
+        return ""
+    pairs = ",".join(f'{k}="{v}"' for k, v in labels)
+    return "{" + pairs + "}"
+
+
+metrics = Metrics()
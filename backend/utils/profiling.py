@@ -0,0 +1,204 @@
+"""On-demand sampling profiler for single chat requests.
+
+A profiled request has the stacks of the threads working for it sampled every few
+milliseconds while it runs. The samples are written in the folded format read by
+flamegraph.pl, speedscope or inferno:
+    profiles/<request_id>.folded
+
+Nothing runs unless a request is profiled: the sampler thread only lives while at least
+one profiled request is in flight. Threads are attributed to a request while they run
+its spans; the event loop thread is shared, so its samples while the request awaits can
+come from other requests (waits for I/O are left out).
+"""
+
+import contextvars
+import glob
+import hmac
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+
+# shared secret enabling the X-Profile header and the profiling endpoints, disabled when empty
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", "")
+# fraction of the chat requests profiled continuously, whatever their headers
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_INTERVAL_SECONDS = float(os.getenv("PROFILE_INTERVAL_MS", "5")) / 1000
+PROFILES_DIR = "profiles"
+MAX_PROFILES = 200
+MAX_STACK_DEPTH = 128
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _profile_name(request_id: str) -> str:
+    # request IDs may come from the client, they must not escape the profiles folder
+    return re.sub(r"[^A-Za-z0-9_-]", "_", request_id)[:128] + ".folded"
+
+
+def _is_idle(frame) -> bool:
+    # the event loop waiting for I/O, whichever request it then resumes
+    return frame.f_code.co_filename.endswith("selectors.py")
+
+
+class ProfileSession:
+    """Samples of one request, taken from the threads currently running its code"""
+
+    def __init__(self, request_id: str):
+        self.request_id = request_id
+        self.stacks = Counter()
+        self.samples = 0
+        self.started = time.monotonic()
+        # thread ident -> number of nested sections of the request running on it
+        self._threads = {}
+        self._lock = threading.Lock()
+
+    def enter(self, ident: int):
+        with self._lock:
+            self._threads[ident] = self._threads.get(ident, 0) + 1
+
+    def leave(self, ident: int):
+        with self._lock:
+            if self._threads.get(ident, 0) <= 1:
+                self._threads.pop(ident, None)
+            else:
+                self._threads[ident] -= 1
+
+    def sample(self, frames: dict):
+        with self._lock:
+            threads = list(self._threads)
+        for ident in threads:
+            frame = frames.get(ident)
+            if frame is None or _is_idle(frame):
+                continue
+            labels = []
+            while frame is not None and len(labels) < MAX_STACK_DEPTH:
+                labels.append(_frame_label(frame))
+                frame = frame.f_back
+            self.stacks[";".join(reversed(labels))] += 1
+            self.samples += 1
+
+    def folded(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+class Profiler:
+    """Runs the sampler thread while profiled requests are in flight, in this worker process"""
+
+    def __init__(self, interval: float, profiles_dir: str):
+        self.interval = interval
+        self.profiles_dir = profiles_dir
+        self._lock = threading.Lock()
+        self._sessions = set()
+        self._sampler = None
+        # requests to profile, armed through the admin endpoint
+        self._armed = 0
+
+    def arm(self, requests: int) -> int:
+        """Profile the next `requests` chat requests handled by this worker"""
+        with self._lock:
+            self._armed = max(0, requests)
+            return self._armed
+
+    def should_profile(self, headers) -> bool:
+        """Whether to profile a request: asked for with a valid token, armed, or sampled"""
+        if headers.get("x-profile") and is_authorized(headers.get("x-profile-token", "")):
+            return True
+        with self._lock:
+            if self._armed > 0:
+                self._armed -= 1
+                return True
+        return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+    def start(self, session: ProfileSession):
+        with self._lock:
+            self._sessions.add(session)
+            if self._sampler is None or not self._sampler.is_alive():
+                self._sampler = threading.Thread(target=self._run, daemon=True)
+                self._sampler.start()
+
+    def stop(self, session: ProfileSession):
+        with self._lock:
+            self._sessions.discard(session)
+        self._save(session)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                sessions = list(self._sessions)
+                if not sessions:
+                    self._sampler = None
+                    return
+            frames = sys._current_frames()
+            for session in sessions:
+                session.sample(frames)
+            del frames
+            time.sleep(self.interval)
+
+    def _save(self, session: ProfileSession):
+        os.makedirs(self.profiles_dir, exist_ok=True)
+        path = os.path.join(self.profiles_dir, _profile_name(session.request_id))
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(session.folded())
+        # keep the most recent profiles only
+        profiles = sorted(glob.glob(os.path.join(self.profiles_dir, "*.folded")), key=os.path.getmtime)
+        for old in profiles[:-MAX_PROFILES]:
+            try:
+                os.remove(old)
+            except OSError:
+                pass
+
+    def load(self, request_id: str):
+        """Folded stacks of a profiled request, or None if there is no such profile"""
+        path = os.path.join(self.profiles_dir, _profile_name(request_id))
+        if not os.path.exists(path):
+            return None
+        with open(path, encoding="utf-8") as f:
+            return f.read()
+
+
+_current_session = contextvars.ContextVar("current_profile_session", default=None)
+
+
+def is_authorized(token: str) -> bool:
+    return bool(PROFILE_TOKEN) and hmac.compare_digest(token.encode(), PROFILE_TOKEN.encode())
+
+
+@contextmanager
+def profile_request(request_id: str):
+    """Profile the request running in this block, saving its stacks once it completes"""
+    session = ProfileSession(request_id)
+    token = _current_session.set(session)
+    profiler.start(session)
+    try:
+        with profiled_thread():
+            yield session
+    finally:
+        _current_session.reset(token)
+        profiler.stop(session)
+
+
+@contextmanager
+def profiled_thread():
+    """Sample the current thread while it runs this block for a profiled request"""
+    session = _current_session.get()
+    if session is None:
+        yield
+        return
+    ident = threading.get_ident()
+    session.enter(ident)
+    try:
+        yield
+    finally:
+        session.leave(ident)
+
+
+profiler = Profiler(PROFILE_INTERVAL_SECONDS, PROFILES_DIR)
@@ -0,0 +1,130 @@
+import sqlite3
+
+from utils.cancellation import untrack_connection
+
+
+PROFILE_PREVIEW_ROWS = 10
+TOP_VALUES = 5
+PROFILE_VALUE_LENGTH = 60
+
+# MATERIALIZED keeps the query from being re-run once per column when collecting the top values
+_MATERIALIZED = "MATERIALIZED " if sqlite3.sqlite_version_info >= (3, 35, 0) else ""
+
+
+def _profile(conn: sqlite3.Connection, sql: str) -> dict:
+    """Profile the result of `sql`, evaluated by SQLite inside a CTE"""
+    sql = sql.strip().rstrip(";")
+    columns = [d[0] for d in conn.execute(f"SELECT * FROM ({sql}) LIMIT 0").description]
+    # positional names, result columns may be duplicated or not be valid identifiers
+    names = [f"c{i}" for i in range(len(columns))]
+    cte = f"WITH q({', '.join(names)}) AS {_MATERIALIZED}({sql})"
+
+    # one pass over the result for the row count and the statistics of every column
+    aggregates = ["COUNT(*)"]
+    for name in names:
+        aggregates += [
+            f"COUNT(*) - COUNT({name})",
+            f"COUNT(DISTINCT {name})",
+            f"MIN({name})",
+            f"MAX({name})",
+            f"AVG({name})",
+            f"SUM(typeof({name}) IN ('integer', 'real'))",
+        ]
+    stats = conn.execute(f"{cte} SELECT {', '.join(aggregates)} FROM q").fetchone()
+    total = stats[0]
+
+    profile = {"rows": total, "columns": []}
+    for i, column in enumerate(columns):
+        nulls, distinct, low, high, average, numeric = stats[1 + 6 * i : 7 + 6 * i]
+        profile["columns"].append(
+            {
+                "name": column,
+                "nulls": nulls,
+                "distinct": distinct,
+                "min": low,
+                "max": high,
+                # AVG of text is meaningless, only kept for purely numeric columns
+                "avg": average if numeric and numeric == total - nulls else None,
+                "top": [],
+            }
+        )
+
+    # most frequent values, skipped for columns where every value is unique
+    ranked = [i for i, c in enumerate(profile["columns"]) if 0 < c["distinct"] < total - c["nulls"]]
+    if ranked:
+        parts = [
+            f"SELECT * FROM (SELECT {i}, {names[i]}, COUNT(*) AS n FROM q "
+            f"WHERE {names[i]} IS NOT NULL GROUP BY {names[i]} ORDER BY n DESC LIMIT {TOP_VALUES})"
+            for i in ranked
+        ]
+        for i, value, count in conn.execute(f"{cte} {' UNION ALL '.join(parts)}"):
+            profile["columns"][i]["top"].append((value, count))
+
+    profile["preview"] = conn.execute(
+        f"SELECT * FROM ({sql}) LIMIT {PROFILE_PREVIEW_ROWS}"
+    ).fetchall()
+    return profile
+
+
+def profile_query(database, sql: str) -> dict:
+    """Profile the result of `sql` on a single database, reading it in one transaction.
+
+    Raises sqlite3.Error.
+    """
+    conn = database.connect()
+    try:
+        # statistics, top values and preview all describe the same snapshot
+        conn.execute("BEGIN")
+        profile = _profile(conn, sql)
+        conn.execute("COMMIT")
+        return profile
+    finally:
+        untrack_connection(conn)
+        conn.close()
+
+
+def profile_rows(columns, rows) -> dict:
+    """Profile rows already in memory, e.g. the merged result of a federated query"""
+    conn = sqlite3.connect(":memory:")
+    try:
+        names = [f"c{i}" for i in range(len(columns))]
+        conn.execute(f"CREATE TABLE result ({', '.join(names)})")
+        placeholders = ", ".join("?" for _ in columns)
+        conn.executemany(f"INSERT INTO result VALUES ({placeholders})", rows)
+        profile = _profile(conn, "SELECT * FROM result")
+    finally:
+        conn.close()
+    for column, name in zip(profile["columns"], columns):
+        column["name"] = name
+    return profile
+
+
+def _truncate(value):
+    if isinstance(value, str) and len(value) > PROFILE_VALUE_LENGTH:
+        return value[:PROFILE_VALUE_LENGTH] + "..."
+    return value
+
+
+def _value(value) -> str:
+    if isinstance(value, float):
+        return f"{value:.4g}"
+    return repr(_truncate(value))
+
+
+def format_profile(profile: dict, query_id: str) -> str:
+    """Compact text rendering of a profile, for the LLM"""
+    lines = [f"Profile of the result: {profile['rows']} rows (query ID {query_id})."]
+    for column in profile["columns"]:
+        details = [f"{column['nulls']} nulls", f"{column['distinct']} distinct"]
+        if column["min"] is not None:
+            details.append(f"min {_value(column['min'])}, max {_value(column['max'])}")
+        if column["avg"] is not None:
+            details.append(f"avg {_value(column['avg'])}")
+        line = f"- {column['name']}: {', '.join(details)}"
+        if column["top"]:
+            line += "; top: " + ", ".join(f"{_value(v)} ({n})" for v, n in column["top"])
+        lines.append(line)
+    if profile["preview"]:
+        lines.append(f"First {len(profile['preview'])} rows:")
+        lines.append(str([tuple(_truncate(v) for v in row) for row in profile["preview"]]))
+    return "\n".join(lines)
@@ -0,0 +1,202 @@
+import re
+
+try:
+    import numpy as np
+except ImportError:  # without NumPy, time series are returned as regular results
+    np = None
+
+
+# results with fewer rows are shown to the LLM as they are
+MIN_SERIES_POINTS = 100
+# bounds of the downsampled series served to the frontend
+DEFAULT_SERIES_POINTS = 1_000
+MAX_SERIES_POINTS = 5_000
+# results with more rows are not summarized nor plotted; rows are converted to arrays
+# chunk by chunk, so only the arrays (8 bytes per value) are ever held in full
+MAX_SERIES_ROWS = 500_000
+SERIES_CHUNK_ROWS = 10_000
+SERIES_METHODS = ("lttb", "minmax")
+
+TIME_NAME = re.compile(r"(date|time|day|week|month|period|timestamp|^ts$)", re.IGNORECASE)
+ISO_TIME = re.compile(r"^\d{4}-\d{2}(-\d{2}([ T]\d{2}:\d{2}(:\d{2}(\.\d+)?)?)?)?$")
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def detect_series(columns, rows):
+    """Return the time column and value columns of a time-series shaped result, or None.
+
+    A time series has one column of ISO dates or timestamps and only numeric columns besides.
+    Results with a label column (several series interleaved) are left alone.
+    """
+    if np is None or len(rows) < 2:
+        return None
+    sample = rows[:MIN_SERIES_POINTS]
+    time_index = None
+    value_indexes = []
+    for index, name in enumerate(columns):
+        values = [row[index] for row in sample if row[index] is not None]
+        if not values:
+            continue
+        if time_index is None and all(isinstance(v, str) and ISO_TIME.match(v) for v in values):
+            time_index = index
+        elif time_index is None and TIME_NAME.search(name) and all(_is_number(v) for v in values):
+            # epoch seconds, only trusted when the column name says so
+            time_index = index
+        elif all(_is_number(v) for v in values):
+            value_indexes.append(index)
+        else:
+            return None
+    if time_index is None or not value_indexes:
+        return None
+    return {
+        "time": columns[time_index],
+        "values": [columns[i] for i in value_indexes],
+        "time_index": time_index,
+        "value_indexes": value_indexes,
+        "text_time": any(isinstance(row[time_index], str) for row in sample),
+    }
+
+
+def _arrays(chunks, spec):
+    """Return (seconds since epoch, values with NaN for nulls) sorted by time, rows without a time left out.
+
+    Raises ValueError or TypeError when a row does not fit the detected shape, e.g. a
+    value that is not a number further down the result than the rows used for detection.
+    """
+    time_index, value_indexes = spec["time_index"], spec["value_indexes"]
+    xs, ys = [], []
+    for rows in chunks:
+        rows = [row for row in rows if row[time_index] is not None]
+        if not rows:
+            continue
+        times = [row[time_index] for row in rows]
+        if spec["text_time"]:
+            xs.append(np.array(times, dtype="datetime64[s]").astype("float64"))
+        else:
+            xs.append(np.array(times, dtype="float64"))
+        ys.append(np.array([[row[i] for i in value_indexes] for row in rows], dtype="float64"))
+    if not xs:
+        raise ValueError("The result has no timed rows")
+    x, y = np.concatenate(xs), np.concatenate(ys)
+    order = np.argsort(x, kind="stable")
+    return x[order], y[order]
+
+
+def lttb(x, y, points: int):
+    """Indices of the points kept by Largest-Triangle-Three-Buckets, first and last included"""
+    n = len(x)
+    if points >= n or points < 3:
+        return np.arange(n)
+    # the points between the first and the last are split into points - 2 buckets
+    edges = np.linspace(1, n - 1, points - 1).astype(np.int64)
+    cum_x = np.concatenate(([0.0], np.cumsum(x)))
+    cum_y = np.concatenate(([0.0], np.cumsum(y)))
+    counts = np.maximum(edges[1:] - edges[:-1], 1)
+    avg_x = (cum_x[edges[1:]] - cum_x[edges[:-1]]) / counts
+    avg_y = (cum_y[edges[1:]] - cum_y[edges[:-1]]) / counts
+    # each bucket is compared with the average of the next one, the last with the last point
+    next_x = np.append(avg_x[1:], x[-1])
+    next_y = np.append(avg_y[1:], y[-1])
+
+    selected = np.empty(points, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    previous = 0
+    for bucket in range(points - 2):
+        start, end = edges[bucket], max(edges[bucket + 1], edges[bucket] + 1)
+        ax, ay = x[previous], y[previous]
+        areas = np.abs(
+            (ax - next_x[bucket]) * (y[start:end] - ay) - (ax - x[start:end]) * (next_y[bucket] - ay)
+        )
+        previous = start + int(np.argmax(areas))
+        selected[bucket + 1] = previous
+    return selected
+
+
+def minmax(x, y, points: int):
+    """Indices of the minimum and maximum of each bucket, keeping every peak and trough"""
+    n = len(x)
+    if points >= n or points < 2:
+        return np.arange(n)
+    buckets = np.minimum(np.arange(n) * (points // 2) // n, points // 2 - 1)
+    # sorted by bucket then value: the first row of a bucket is its minimum, the last its maximum
+    order = np.lexsort((y, buckets))
+    sorted_buckets = buckets[order]
+    first = np.flatnonzero(np.r_[True, sorted_buckets[1:] != sorted_buckets[:-1]])
+    last = np.r_[first[1:] - 1, n - 1]
+    return np.unique(np.concatenate((order[first], order[last], [0, n - 1])))
+
+
+def downsample(chunks, spec, points: int, method: str = "lttb") -> dict:
+    """Chart-ready series of at most about `points` points per value column, from chunks of rows"""
+    if method not in SERIES_METHODS:
+        raise ValueError(f"Method must be one of: {', '.join(SERIES_METHODS)}")
+    points = max(10, min(points, MAX_SERIES_POINTS))
+    x, y = _arrays(chunks, spec)
+    select = lttb if method == "lttb" else minmax
+
+    # each column keeps its own shape, the union of the kept points is served
+    budget = max(points // y.shape[1], 10)
+    kept = []
+    for column in range(y.shape[1]):
+        present = np.flatnonzero(~np.isnan(y[:, column]))
+        if len(present):
+            kept.append(present[select(x[present], y[present, column], budget)])
+    indices = np.unique(np.concatenate(kept)) if kept else np.arange(0)
+
+    return {
+        "time": spec["time"],
+        "x": [_format_time(v, spec["text_time"]) if spec["text_time"] else float(v) for v in x[indices]],
+        "series": {
+            name: [None if np.isnan(v) else float(v) for v in y[indices, column]]
+            for column, name in enumerate(spec["values"])
+        },
+        "method": method,
+        "points": int(len(indices)),
+        "total": len(x),
+    }
+
+
+def _format_time(value: float, string_times: bool) -> str:
+    if string_times:
+        return str(np.datetime64(int(value), "s")).replace("T00:00:00", "")
+    return f"{value:g}"
+
+
+def _format_step(seconds: float) -> str:
+    for unit, length in (("day", 86_400), ("hour", 3_600), ("minute", 60)):
+        if seconds >= length:
+            return f"{seconds / length:g} {unit}(s)"
+    return f"{seconds:g} second(s)"
+
+
+def summarize(chunks, spec) -> str:
+    """Summary statistics of a time series given by chunks of rows, shown to the LLM instead of its points"""
+    x, y = _arrays(chunks, spec)
+    string_times = spec["text_time"]
+    step = float(np.median(np.diff(x))) if len(x) > 1 else 0.0
+    lines = [
+        f"Time series by {spec['time']}: {len(x)} points from {_format_time(x[0], string_times)} "
+        f"to {_format_time(x[-1], string_times)}"
+        + (f", one every {_format_step(step)} typically" if string_times and step > 0 else "")
+        + "."
+    ]
+    for column, name in enumerate(spec["values"]):
+        values = y[:, column]
+        present = np.flatnonzero(~np.isnan(values))
+        if not len(present):
+            lines.append(f"- {name}: all null")
+            continue
+        v = values[present]
+        low, high = present[np.argmin(v)], present[np.argmax(v)]
+        first, last = v[0], v[-1]
+        change = f" ({(last - first) / abs(first):+.1%})" if first else ""
+        lines.append(
+            f"- {name}: min {values[low]:.6g} at {_format_time(x[low], string_times)}, "
+            f"max {values[high]:.6g} at {_format_time(x[high], string_times)}, "
+            f"mean {v.mean():.6g}, std {v.std():.6g}, first {first:.6g}, last {last:.6g}{change}"
+            + (f", {len(values) - len(present)} nulls" if len(present) < len(values) else "")
+        )
+    return "\n".join(lines)
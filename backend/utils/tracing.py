@@ -0,0 +1,340 @@
+"""Per-request traces: spans for graph nodes, tools, SQL statements and LLM calls.
+
+Tracing is off unless TRACE_EXPORTER is set. Spans are exported in the OTLP/JSON format,
+to a JSON lines file or to an OTLP/HTTP collector, from a background thread. Render the
+waterfall of a request with:
+    python -m utils.tracing <request_id>
+"""
+
+import argparse
+import contextvars
+import functools
+import glob
+import inspect
+import json
+import os
+import queue
+import secrets
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+from datetime import datetime
+
+from utils.profiling import profiled_thread
+
+
+# "file", "otlp" or "none"
+TRACE_EXPORTER = os.getenv("TRACE_EXPORTER", "none")
+# EXPLAIN QUERY PLAN of every traced SQL statement, one more round trip per statement
+TRACE_SQL_PLANS = os.getenv("TRACE_SQL_PLANS", "0") == "1"
+TRACES_DIR = "traces"
+# trace files older than that are deleted
+TRACE_RETENTION_DAYS = int(os.getenv("TRACE_RETENTION_DAYS", "7"))
+# traces waiting to be written, dropped beyond that rather than slowing requests down
+MAX_PENDING_TRACES = 1_000
+OTLP_ENDPOINT = os.getenv("OTLP_ENDPOINT", "http://localhost:4318/v1/traces")
+SERVICE_NAME = "database-agent"
+
+
+class Span:
+    def __init__(self, trace, name: str, parent, attributes: dict):
+        self.trace = trace
+        self.name = name
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent.span_id if parent is not None else ""
+        self.attributes = dict(attributes)
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.error = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def to_otlp(self) -> dict:
+        span = {
+            "traceId": self.trace.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": 1,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns or time.time_ns()),
+            "attributes": [_otlp_attribute(k, v) for k, v in self.attributes.items()],
+            "status": {"code": 2, "message": self.error} if self.error else {"code": 1},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+class Trace:
+    """Spans of one request"""
+
+    def __init__(self, request_id: str):
+        self.request_id = request_id
+        self.trace_id = secrets.token_hex(16)
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add(self, span: Span):
+        with self._lock:
+            self.spans.append(span)
+
+    def to_otlp(self) -> dict:
+        with self._lock:
+            spans = [span.to_otlp() for span in self.spans]
+        return {
+            "resourceSpans": [
+                {
+                    "resource": {"attributes": [_otlp_attribute("service.name", SERVICE_NAME)]},
+                    "scopeSpans": [{"scope": {"name": SERVICE_NAME}, "spans": spans}],
+                }
+            ]
+        }
+
+
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+def _otlp_attribute(key: str, value) -> dict:
+    if isinstance(value, bool):
+        typed = {"boolValue": value}
+    elif isinstance(value, int):
+        typed = {"intValue": str(value)}
+    elif isinstance(value, float):
+        typed = {"doubleValue": value}
+    else:
+        typed = {"stringValue": str(value)}
+    return {"key": key, "value": typed}
+
+
+def is_tracing() -> bool:
+    """Whether the current code runs inside a traced request"""
+    return _current_trace.get() is not None
+
+
+def capture_plans() -> bool:
+    """Whether the SQL spans of the current request should carry their query plan"""
+    return TRACE_SQL_PLANS and is_tracing()
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """Record a span as a child of the current one; a no-op outside of a traced request.
+
+    The thread running the span is also sampled when the request is being profiled.
+    """
+    with profiled_thread():
+        trace = _current_trace.get()
+        if trace is None:
+            yield None
+            return
+
+        current = Span(trace, name, _current_span.get(), attributes)
+        token = _current_span.set(current)
+        try:
+            yield current
+        except BaseException as e:
+            current.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            current.end_ns = time.time_ns()
+            _current_span.reset(token)
+            trace.add(current)
+
+
+@contextmanager
+def start_trace(request_id: str, name: str, **attributes):
+    """Trace a whole request, exporting its spans once it completes"""
+    if TRACE_EXPORTER == "none":
+        yield None
+        return
+
+    trace = Trace(request_id)
+    token = _current_trace.set(trace)
+    try:
+        with span(name, **{"request.id": request_id, **attributes}) as root:
+            yield root
+    finally:
+        _current_trace.reset(token)
+        export(trace)
+
+
+def traced(name: str):
+    """Decorator recording a span around each call of a sync or async function"""
+
+    def decorator(fn):
+        if inspect.iscoroutinefunction(fn):
+
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with span(name):
+                    return await fn(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+# -------------------------- Export --------------------------
+
+
+class _Exporter:
+    """Writes or posts the finished traces from a background thread, off the event loop"""
+
+    def __init__(self):
+        self._queue = queue.Queue(maxsize=MAX_PENDING_TRACES)
+        self._lock = threading.Lock()
+        # threads do not survive a fork, each worker process starts its own
+        self._pid = None
+        self._pruned_day = None
+
+    def submit(self, trace: Trace):
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._queue = queue.Queue(maxsize=MAX_PENDING_TRACES)
+                    threading.Thread(target=self._run, args=(self._queue,), daemon=True).start()
+                    self._pid = os.getpid()
+        try:
+            self._queue.put_nowait(trace)
+        except queue.Full:
+            pass
+
+    def _run(self, pending: queue.Queue):
+        while True:
+            trace = pending.get()
+            try:
+                payload = trace.to_otlp()
+                if TRACE_EXPORTER == "otlp":
+                    _post_otlp(payload)
+                else:
+                    self._write(payload)
+            except Exception:
+                # tracing must never break serving
+                pass
+
+    def _write(self, payload: dict):
+        os.makedirs(TRACES_DIR, exist_ok=True)
+        day = datetime.now().strftime("%Y%m%d")
+        if day != self._pruned_day:
+            self._pruned_day = day
+            _prune(TRACES_DIR, TRACE_RETENTION_DAYS)
+        path = os.path.join(TRACES_DIR, f"traces_{day}_{os.getpid()}.jsonl")
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(payload, separators=(",", ":")) + "\n")
+
+
+def _prune(traces_dir: str, retention_days: int):
+    """Delete the trace files last written more than `retention_days` ago"""
+    cutoff = time.time() - retention_days * 86_400
+    for path in glob.glob(os.path.join(traces_dir, "traces_*.jsonl")):
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except OSError:
+            pass
+
+
+_exporter = _Exporter()
+
+
+def export(trace: Trace):
+    if TRACE_EXPORTER in ("file", "otlp"):
+        _exporter.submit(trace)
+
+
+def _post_otlp(payload: dict):
+    request = urllib.request.Request(
+        OTLP_ENDPOINT,
+        data=json.dumps(payload).encode("utf-8"),
+        headers={"Content-Type": "application/json"},
+        method="POST",
+    )
+    try:
+        urllib.request.urlopen(request, timeout=5).close()
+    except OSError:
+        # tracing must never break serving
+        pass
+
+
+# -------------------------- Waterfall --------------------------
+
+
+def _attributes(span: dict) -> dict:
+    values = {}
+    for attribute in span.get("attributes", []):
+        value = attribute["value"]
+        values[attribute["key"]] = next(iter(value.values()))
+    return values
+
+
+def find_trace(request_id: str, traces_dir: str = TRACES_DIR):
+    """Return the spans of the request from the exported files, most recent files first"""
+    for path in sorted(glob.glob(os.path.join(traces_dir, "traces_*.jsonl")), reverse=True):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if request_id not in line:
+                    continue
+                payload = json.loads(line)
+                spans = [
+                    span
+                    for resource in payload["resourceSpans"]
+                    for scope in resource["scopeSpans"]
+                    for span in scope["spans"]
+                ]
+                if any(_attributes(s).get("request.id") == request_id for s in spans):
+                    return spans
+    return None
+
+
+def render_waterfall(spans, width: int = 40) -> str:
+    start = min(int(s["startTimeUnixNano"]) for s in spans)
+    end = max(int(s["endTimeUnixNano"]) for s in spans)
+    total = max(end - start, 1)
+    children = {}
+    for s in spans:
+        children.setdefault(s.get("parentSpanId", ""), []).append(s)
+
+    lines = [f"{'start':>9} {'duration':>9}  span"]
+
+    def visit(s, depth):
+        offset = int(s["startTimeUnixNano"]) - start
+        duration = int(s["endTimeUnixNano"]) - int(s["startTimeUnixNano"])
+        bar_start = int(offset / total * width)
+        bar_length = max(1, int(duration / total * width))
+        bar = " " * bar_start + "█" * bar_length
+        details = ", ".join(
+            f"{k}={str(v)[:60]}" for k, v in _attributes(s).items() if k != "request.id"
+        )
+        error = "  !" if s.get("status", {}).get("code") == 2 else ""
+        label = "  " * depth + s["name"]
+        lines.append(
+            f"{offset / 1e9:>8.3f}s {duration / 1e9:>8.3f}s  {label:<36} |{bar:<{width}}|{error} {details}"
+        )
+        for child in sorted(children.get(s["spanId"], []), key=lambda c: int(c["startTimeUnixNano"])):
+            visit(child, depth + 1)
+
+    for root in children.get("", []):
+        visit(root, 0)
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render the span waterfall of a request")
+    parser.add_argument("request_id")
+    parser.add_argument("--dir", default=TRACES_DIR, help="folder holding the exported traces")
+    args = parser.parse_args()
+
+    spans = find_trace(args.request_id, args.dir)
+    if spans is None:
+        raise SystemExit(f"No trace found for request {args.request_id}")
+    print(render_waterfall(spans))
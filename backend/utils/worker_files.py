@@ -0,0 +1,30 @@
+import glob
+import os
+
+
+def worker_path(path: str, pid: int) -> str:
+    """Side file of one worker process, `<root>_<pid><ext>`"""
+    root, ext = os.path.splitext(path)
+    return f"{root}_{pid}{ext}"
+
+
+def remove_stale_worker_files(path: str):
+    """Delete the side files of the worker processes that are gone"""
+    root, ext = os.path.splitext(path)
+    for worker_file in glob.glob(f"{root}_*{ext}"):
+        pid = worker_file[len(root) + 1 : len(worker_file) - len(ext)]
+        if not pid.isdigit() or int(pid) == os.getpid():
+            continue
+        try:
+            os.kill(int(pid), 0)
+            continue
+        except ProcessLookupError:
+            pass
+        except OSError:
+            # alive, owned by another user
+            continue
+        for suffix in ("", "-journal", "-wal", "-shm"):
+            try:
+                os.remove(worker_file + suffix)
+            except OSError:
+                pass
@@ -7,6 +7,23 @@ export interface ChatRequest {
     role: string;
     content: string | Array<{ type: string; text: string }>;
   }>;
+  promptMode?: string;
+}
+export interface ResultPage {
+  queryId: string;
+  columns: string[];
+  rows: unknown[][];
+  offset: number;
+  total: number;
+}
+export interface ResultSeries {
+  queryId: string;
+  time: string;
+  x: Array<string | number>;
+  series: Record<string, Array<number | null>>;
+  method: string;
+  points: number;
+  total: number;
 }
 export class ChatService {
   private baseUrl = "http://localhost:8000";
@@ -15,6 +32,12 @@ export class ChatService {
     | "checking"
     | "connected"
     | "disconnected" = "unknown";
+  // aborting the pending request lets the backend cancel its graph run
+  private pendingRequest: AbortController | null = null;
+  // sent with every chat request, the mode is not shared between users
+  private promptMode: string | null = null;
+  // time-series results of the last answer, fetched downsampled by the charts
+  lastCharts: string[] = [];
 
   async sendMessage(messages: Message[]): Promise<string> {
     // Transform messages to the expected format
@@ -30,8 +53,14 @@ export class ChatService {
       system: "You are a helpful assistant for SQL queries.",
       tools: [],
       messages: transformedMessages,
+      promptMode: this.promptMode ?? undefined,
     };
 
+    this.pendingRequest?.abort();
+    this.lastCharts = [];
+    const controller = new AbortController();
+    this.pendingRequest = controller;
+
     try {
       const response = await fetch(`${this.baseUrl}/api/chat`, {
         method: "POST",
@@ -39,8 +68,14 @@ export class ChatService {
           "Content-Type": "application/json",
         },
         body: JSON.stringify(requestBody),
+        signal: controller.signal,
       });
 
+      if (response.status === 429 || response.status === 503) {
+        // the backend sheds load instead of letting every request time out
+        const retryAfter = response.headers.get("Retry-After") ?? "a few";
+        return `<i>Server busy, please retry in ${retryAfter} seconds</i>`;
+      }
       if (!response.ok) {
         throw new Error(`HTTP error! status: ${response.status}`);
       }
@@ -49,11 +84,21 @@ export class ChatService {
       if (result.type === "error") {
         throw new Error(result.content);
       }
+      this.lastCharts = (result.queries ?? [])
+        .filter((query: { series?: boolean }) => query.series)
+        .map((query: { id: string }) => query.id);
       return result.content;
     } catch (error) {
+      if (controller.signal.aborted) {
+        return "<i>Request cancelled</i>";
+      }
       console.error("Error in sendMessage:", error);
       // If backend is not available, return not connected message
       return "<i>Server unavailable</i>";
+    } finally {
+      if (this.pendingRequest === controller) {
+        this.pendingRequest = null;
+      }
     }
   }
 
@@ -85,11 +130,14 @@ export class ChatService {
 
   async getPromptMode(): Promise<string> {
     try {
-      const response = await fetch(`${this.baseUrl}/api/prompt-mode`);
+      const response = await fetch(`${this.baseUrl}/api/prompt-mode`, {
+        credentials: "include",
+      });
       if (!response.ok) {
         throw new Error(`HTTP error! status: ${response.status}`);
       }
       const result = await response.json();
+      this.promptMode = result.mode;
       return result.mode;
     } catch (error) {
       console.error("Error getting prompt mode:", error);
@@ -105,10 +153,12 @@ export class ChatService {
           "Content-Type": "application/json",
         },
         body: JSON.stringify({ mode }),
+        credentials: "include",
       });
       if (!response.ok) {
         throw new Error(`HTTP error! status: ${response.status}`);
       }
+      this.promptMode = mode;
       return true;
     } catch (error) {
       console.error("Error setting prompt mode:", error);
@@ -116,6 +166,48 @@ export class ChatService {
     }
   }
 
+  async getResultPage(
+    queryId: string,
+    offset = 0,
+    limit = 100
+  ): Promise<ResultPage | null> {
+    try {
+      const params = new URLSearchParams({
+        offset: String(offset),
+        limit: String(limit),
+      });
+      const response = await fetch(
+        `${this.baseUrl}/api/results/${encodeURIComponent(queryId)}?${params}`
+      );
+      if (!response.ok) {
+        throw new Error(`HTTP error! status: ${response.status}`);
+      }
+      return await response.json();
+    } catch (error) {
+      console.error("Error getting result page:", error);
+      return null;
+    }
+  }
+
+  async getResultSeries(
+    queryId: string,
+    points = 1000
+  ): Promise<ResultSeries | null> {
+    try {
+      const params = new URLSearchParams({ points: String(points) });
+      const response = await fetch(
+        `${this.baseUrl}/api/results/${encodeURIComponent(queryId)}/series?${params}`
+      );
+      if (!response.ok) {
+        throw new Error(`HTTP error! status: ${response.status}`);
+      }
+      return await response.json();
+    } catch (error) {
+      console.error("Error getting result series:", error);
+      return null;
+    }
+  }
+
   getConnectionStatus(): "unknown" | "checking" | "connected" | "disconnected" {
     return this.connectionStatus;
   }
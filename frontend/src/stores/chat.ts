@@ -8,6 +8,8 @@ export interface Message {
   timestamp: Date
   isEditing?: boolean
   isLoading?: boolean
+  // IDs of the time-series results of the answer, plotted under it
+  charts?: string[]
 }
 
 export interface Chat {
@@ -185,7 +187,7 @@ export const useChatStore = defineStore('chat', () => {
     return loadingMessage
   }
 
-  const updateLoadingMessage = (chatId: string, messageId: string, content: string) => {
+  const updateLoadingMessage = (chatId: string, messageId: string, content: string, charts: string[] = []) => {
     const chat = chats.value.find(c => c.id === chatId)
     if (!chat) return
 
@@ -193,6 +195,7 @@ export const useChatStore = defineStore('chat', () => {
     if (message) {
       message.content = content
       message.isLoading = false
+      message.charts = charts
       chat.updatedAt = new Date()
       saveToStorage()
     }